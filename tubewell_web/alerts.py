@@ -0,0 +1,234 @@
+import threading
+from collections import namedtuple
+
+from energy import MAX_SAMPLE_GAP_MS
+from live_state import PHASES, PHASE_METRICS
+from sessions import RUN_CURRENT_THRESHOLD
+
+RULE_KINDS = ("threshold", "rate")
+RULE_OPS = (">", "<")
+SEVERITIES = ("info", "warning", "critical")
+
+# Rules evaluated on every decoded frame. ``metric`` is a raw column
+# (voltage_a), a phase summary (current_max / _min / _avg / _imbalance) or
+# active_power_total. A threshold rule compares the value itself, a rate
+# rule its change per second. ``for_s`` is how long the condition must hold
+# before the alert opens; it closes once the value is back past ``clear``
+# (defaults to ``threshold``). ``running_only`` rules only apply while the
+# pump draws current.
+DEFAULT_ALERT_RULES = (
+    {"name": "over_voltage", "metric": "voltage_max", "op": ">", "threshold": 260, "clear": 255, "for_s": 10,
+     "severity": "critical"},
+    {"name": "under_voltage", "metric": "voltage_min", "op": "<", "threshold": 180, "clear": 185, "for_s": 10,
+     "running_only": True},
+    {"name": "phase_imbalance", "metric": "current_imbalance", "op": ">", "threshold": 0.2, "clear": 0.15, "for_s": 30,
+     "running_only": True},
+    {"name": "low_power_factor", "metric": "power_factor_min", "op": "<", "threshold": 0.75, "clear": 0.8, "for_s": 60,
+     "running_only": True},
+    # A pump running dry draws little current at a poor power factor
+    {"name": "dry_run", "metric": "power_factor_avg", "op": "<", "threshold": 0.5, "for_s": 20, "running_only": True,
+     "severity": "critical"},
+    {"name": "current_surge", "kind": "rate", "metric": "current_max", "op": ">", "threshold": 10, "severity": "info"},
+)
+
+ALERT_UPSERT_SQL = ("INSERT OR REPLACE INTO alerts (tubewell_id, rule, start_ms, end_ms, severity, value, peak) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)")
+
+# end_ms is None while the alert is open; value is the reading that opened it, peak the worst one since
+Alert = namedtuple("Alert", "tubewell_id rule start_ms end_ms severity value peak")
+
+# A compiled rule; extract reads its metric from a decoded frame
+Rule = namedtuple("Rule", "name metric kind op threshold clear for_ms severity running_only extract")
+
+
+# -----------------------------
+# Rules
+# -----------------------------
+def _imbalance(phases):
+    """Largest deviation from the phase average, as a fraction of it (NEMA unbalance)."""
+    avg = sum(phases) / len(phases)
+    return max(abs(v - avg) for v in phases) / avg if avg else 0.0
+
+
+_SUMMARIES = {
+    "max": max,
+    "min": min,
+    "avg": lambda phases: sum(phases) / len(phases),
+    "imbalance": _imbalance,
+}
+
+
+def metric_extractor(metric):
+    """Function reading ``metric`` from a decoded frame dict (see FrameDecoder.decode)."""
+    if metric == "frequency":
+        return lambda values: values["frequency"]
+    if metric == "active_power_total":
+        return lambda values: sum(values["active_power"].values())
+    base, _, suffix = metric.rpartition("_")
+    if base in PHASE_METRICS:
+        if suffix.upper() in PHASES:
+            phase = suffix.upper()
+            return lambda values: values[base][phase]
+        summary = _SUMMARIES.get(suffix)
+        if summary is not None:
+            return lambda values: summary([values[base][p] for p in PHASES])
+    raise ValueError(f"Unknown alert metric {metric!r}")
+
+
+def compile_rules(specs):
+    """Validate rule dicts (see DEFAULT_ALERT_RULES) into Rules; raises ValueError on a bad one."""
+    rules = []
+    for spec in specs:
+        name = spec.get("name")
+        if not name or any(rule.name == name for rule in rules):
+            raise ValueError(f"Alert rules need a unique name, got {name!r}")
+        kind = spec.get("kind", "threshold")
+        op = spec.get("op", ">")
+        severity = spec.get("severity", "warning")
+        if kind not in RULE_KINDS or op not in RULE_OPS or severity not in SEVERITIES:
+            raise ValueError(f"Alert rule {name}: kind, op or severity not one of {RULE_KINDS}, {RULE_OPS}, {SEVERITIES}")
+        threshold = float(spec["threshold"])
+        rules.append(Rule(name, spec["metric"], kind, op, threshold, float(spec.get("clear", threshold)),
+                          int(float(spec.get("for_s", 0)) * 1000), severity, bool(spec.get("running_only")),
+                          metric_extractor(spec["metric"])))
+    return tuple(rules)
+
+
+def rule_json(rule):
+    return {"name": rule.name, "metric": rule.metric, "kind": rule.kind, "op": rule.op, "threshold": rule.threshold,
+            "clear": rule.clear, "for_s": rule.for_ms / 1000, "severity": rule.severity, "running_only": rule.running_only}
+
+
+# -----------------------------
+# Engine
+# -----------------------------
+_IDLE, _PENDING, _FIRING = 0, 1, 2
+
+
+class AlertEngine:
+    """Per-device state machines for a fixed set of rules, stepped once per frame.
+
+    Each (device, rule) pair holds a small list: phase (idle, pending,
+    firing), when the condition started, the worst value while firing, and
+    the previous value and timestamp for rate rules. ``evaluate`` does a
+    constant amount of work per rule and only allocates when an alert opens
+    or closes; those changes go to ``on_change(alert)``. A gap longer than
+    ``max_gap_ms`` restarts the for_s count, so silence never counts as
+    sustained. Frames of one device must arrive in order from one thread,
+    as for the EnergyIntegrator.
+    """
+
+    def __init__(self, rules, on_change=None, max_gap_ms=MAX_SAMPLE_GAP_MS, run_threshold=RUN_CURRENT_THRESHOLD):
+        self.rules = tuple(rules)
+        self.on_change = on_change
+        self.max_gap_ms = max_gap_ms
+        self.run_threshold = run_threshold
+        self._states = {}  # tubewell_id -> [[phase, since_ms, peak, prev_value, prev_ts, value_at_fire], ...] per rule
+        self._lock = threading.Lock()
+        self.samples_evaluated = 0
+        self.alerts_opened = 0
+
+    def _device(self, tubewell_id):
+        states = self._states.get(tubewell_id)
+        if states is None:
+            with self._lock:
+                states = self._states.setdefault(tubewell_id, [[_IDLE, 0, None, None, None, None] for _ in self.rules])
+        return states
+
+    def evaluate(self, tubewell_id, values, ts):
+        """Step every rule with one decoded frame; returns the alerts it opened or closed."""
+        states = self._device(tubewell_id)
+        running = max(values["current"].values()) >= self.run_threshold
+        changes = []
+        for rule, state in zip(self.rules, states):
+            value = rule.extract(values)
+            prev_value, prev_ts = state[3], state[4]
+            state[3], state[4] = value, ts
+            if rule.kind == "rate":
+                if prev_ts is None or ts <= prev_ts or ts - prev_ts > self.max_gap_ms:
+                    continue
+                value = (value - prev_value) * 1000 / (ts - prev_ts)
+            elif prev_ts is not None and ts - prev_ts > self.max_gap_ms and state[0] == _PENDING:
+                state[1] = ts
+            active = running or not rule.running_only
+            phase = state[0]
+
+            if phase == _FIRING:
+                if active and (value > rule.clear if rule.op == ">" else value < rule.clear):
+                    if value > state[2] if rule.op == ">" else value < state[2]:
+                        state[2] = value
+                    continue
+                changes.append(Alert(tubewell_id, rule.name, state[1], ts, rule.severity, state[5], state[2]))
+                state[0] = _IDLE
+                continue
+
+            if not (active and (value > rule.threshold if rule.op == ">" else value < rule.threshold)):
+                state[0] = _IDLE
+                continue
+            if phase == _IDLE:
+                state[0], state[1] = _PENDING, ts
+            if ts - state[1] >= rule.for_ms:
+                state[0], state[2], state[5] = _FIRING, value, value
+                changes.append(Alert(tubewell_id, rule.name, state[1], None, rule.severity, value, value))
+                self.alerts_opened += 1
+        self.samples_evaluated += 1
+        if self.on_change is not None:
+            for change in changes:
+                self.on_change(change)
+        return changes
+
+    def open_alerts(self, ids=None):
+        """Alerts currently firing, oldest first."""
+        with self._lock:
+            devices = list(self._states.items())
+        alerts = []
+        for tubewell_id, states in devices:
+            if ids is not None and tubewell_id not in ids:
+                continue
+            for rule, state in zip(self.rules, states):
+                if state[0] == _FIRING:
+                    alerts.append(Alert(tubewell_id, rule.name, state[1], None, rule.severity, state[5], state[2]))
+        return sorted(alerts, key=lambda alert: alert.start_ms)
+
+    def restore(self, conn):
+        """Resume alerts left open in the alerts table, so a restart does not open them again."""
+        index = {rule.name: i for i, rule in enumerate(self.rules)}
+        restored = 0
+        for tubewell_id, rule, start_ms, value, peak in conn.execute(
+                "SELECT tubewell_id, rule, start_ms, value, peak FROM alerts WHERE end_ms IS NULL"):
+            if rule in index:
+                state = self._device(tubewell_id)[index[rule]]
+                state[0], state[1], state[2], state[5] = _FIRING, start_ms, peak, value
+                restored += 1
+        return restored
+
+
+# -----------------------------
+# Queries
+# -----------------------------
+def alerts_between(conn, start, end, ids=None, rule=None, limit=None):
+    """Alerts overlapping [start, end), newest first; open ones have end_ms None.
+
+    Like sessions_between, both halves seek the end_ms index.
+    """
+    where, params = "", []
+    if ids is not None:
+        ids = list(dict.fromkeys(ids))
+        where += f" AND tubewell_id IN ({', '.join('?' * len(ids))})"
+        params += ids
+    if rule is not None:
+        where += " AND rule = ?"
+        params.append(rule)
+    sql = f'''
+        SELECT tubewell_id, rule, start_ms, end_ms, severity, value, peak FROM alerts
+        WHERE end_ms > ? AND start_ms < ?{where}
+        UNION ALL
+        SELECT tubewell_id, rule, start_ms, end_ms, severity, value, peak FROM alerts
+        WHERE end_ms IS NULL AND start_ms < ?{where}
+        ORDER BY start_ms DESC
+    '''
+    all_params = [start, end] + params + [end] + params
+    if limit:
+        sql += " LIMIT ?"
+        all_params.append(limit)
+    return [Alert(*row) for row in conn.execute(sql, all_params)]
@@ -1,22 +1,81 @@
-import random
-import struct
-from flask import Flask, render_template, jsonify, request, redirect, url_for, flash
+from flask import Flask, Response, g, render_template, jsonify, request, redirect, url_for, flash
 from flask_cors import CORS
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 import threading
 import time
 import json
 import paho.mqtt.client as mqtt
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 import os
 import queue
+import re
 import shutil
 import sqlite3
+import sys
+import atexit
+import functools
+
+from db_schema import RAW_COLUMNS, RAW_COLUMN_KEYS, ROLLUP_STATS, create_schema, now_ms, parse_time_param, pending_migrations, to_ms
+from alerts import ALERT_UPSERT_SQL, DEFAULT_ALERT_RULES, AlertEngine, alerts_between, compile_rules, rule_json
+from chart_format import CHART_FORMATS, choose_encoding, compress, encode_chart
+from commands import CommandDispatcher, pump_frame
+from comparison import COMPARISON_METRICS, compare_tubewells
+from db_writer import BatchWriter, open_wal_connection
+from devices import DeviceRegistry, LazyStates
+from downsample import DOWNSAMPLE_MODES, downsample_lists, downsample_raw, downsample_rollups
+from energy import ENERGY_COUNTER_SQL, EnergyIntegrator, stored_energy_between
+from export import EXPORT_COMPRESSION, EXPORT_FORMATS, EXPORT_MIMETYPES, export_columns, export_filename, export_stream
+from frame_decoder import FrameDecoder, DEFAULT_REGISTER_MAP
+from history_store import HistoryJournal
+from live_state import PHASES, PHASE_METRICS, TubewellState
+from ingest import IngestPipeline
+from live_stream import LiveBroadcaster
+from metrics import MetricsRegistry
+from partitions import DAY_MS, RawPartitions
+from response_cache import ResponseCache
+from ring_buffer import HistoryRing
+from rollups import RESOLUTION_MS, MIN_CHART_POINTS, choose_resolution, query_rollups, rollup_watermark, run_rollups
+from shared_state import SharedStateTable, SharedStates
+from sessions import SESSION_UPSERT_SQL, SessionTracker, runtime_by_day, running_sessions, sessions_between
 
 app = Flask(__name__)
 app.secret_key = 'tubewell-manager-secret-key-2024'  # Change this to a secure secret key
 CORS(app)
 
+# -----------------------------
+# Metrics (scraped from /metrics)
+# -----------------------------
+metrics = MetricsRegistry()
+MQTT_RECEIVED = metrics.counter("tubewell_mqtt_messages_received_total", "MQTT messages received, by device", ("device",))
+MQTT_PARSED = metrics.counter("tubewell_mqtt_messages_parsed_total", "MQTT frames decoded and applied, by device", ("device",))
+MQTT_PARSE_ERRORS = metrics.counter("tubewell_mqtt_parse_errors_total", "MQTT messages that could not be applied")
+FRAME_DECODE_SECONDS = metrics.histogram("tubewell_frame_decode_seconds", "Time to decode one telemetry frame")
+RAW_STORE_SECONDS = metrics.histogram("tubewell_raw_store_seconds", "Time to queue one raw sample for the writer")
+RAW_BATCH_ROWS = metrics.histogram("tubewell_raw_batch_rows", "Rows per raw writer commit",
+                                   buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000))
+RAW_BATCH_SECONDS = metrics.histogram("tubewell_raw_batch_seconds", "Time to commit one raw writer batch")
+AGGREGATION_SECONDS = metrics.histogram("tubewell_aggregation_seconds", "Duration of one rollup and retention run")
+AGGREGATION_ROWS = metrics.counter("tubewell_aggregation_rows_total", "Rollup rows written")
+SAVE_HISTORY_SECONDS = metrics.histogram("tubewell_history_snapshot_seconds", "Time to write a history snapshot")
+REQUEST_SECONDS = metrics.histogram("tubewell_http_request_seconds", "HTTP request latency, by route", ("method", "route"))
+COMMAND_ACK_SECONDS = metrics.histogram("tubewell_command_ack_seconds", "Time from publishing a pump command to its Modbus echo",
+                                        buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8))
+ALERT_EVAL_SECONDS = metrics.histogram("tubewell_alert_eval_seconds", "Time to evaluate the alert rules on one frame")
+ALERTS_OPENED = metrics.counter("tubewell_alerts_opened_total", "Alerts raised, by rule and severity", ("rule", "severity"))
+COMMAND_RESULTS = metrics.counter("tubewell_command_results_total", "Pump commands finished, by outcome", ("state",))
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _observe_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUEST_SECONDS.labels(request.method, route).observe(time.perf_counter() - started)
+    return response
+
 # -----------------------------
 # Flask-Login Configuration
 # -----------------------------
@@ -76,61 +135,115 @@ def logout():
 # -----------------------------
 # History storage
 # -----------------------------
-history_data = {}
+# history_data (tubewell id -> HistoryRing) is created with the device registry in init_storage()
+HISTORY_POINTS = 500  # samples kept in memory per tubewell
+RAW_RANGE_MAX_POINTS = 1500  # default ?max_points= of /raw, about one point per pixel of a wide chart
 HISTORY_FILE = "history.json"
+HISTORY_JOURNAL_FILE = "history.journal"
+HISTORY_COMPACT_INTERVAL = 600  # seconds between snapshots
+HISTORY_COMPACT_BYTES = 4 * 1024 * 1024  # compact early once the journal is this large
 history_Lock = threading.Lock()
+history_seq = 0  # sequence number of the last point added to history_data
+history_journal = None  # HistoryJournal, opened by init_storage()
 save_queue = queue.Queue()
+COMPACT = object()  # save_queue marker asking for a snapshot
 
 # -----------------------------
 # Tubewell Data Structure
 # -----------------------------
-tubewells = {}
-for i in range(30):
-    tubewells[i] = {
-        "name": f"Tubewell {i+1}",
-        "status": False,
-        "voltage": {"A": 0, "B": 0, "C": 0},
-        "current": {"A": 0, "B": 0, "C": 0},
-        "active_power": {"A": 0, "B": 0, "C": 0},
-        "reactive_power": {"A": 0, "B": 0, "C": 0},
-        "power_factor": {"A": 0, "B": 0, "C": 0},
-        "frequency": 0,
-        "total_runtime": 0,
-        "session_start": None,
-        "history": []
-    }
-
-# Map PLC device IDs to tubewell IDs
-device_to_tubewell = {}
-for i in range(30):
-    device_to_tubewell[f"device-{i+1}"] = i
-
-toggle_commands = {
-    0: {
-        "on":  {"msgType": "setRs485Value", "data": "03060000000149E8"},
-        "off": {"msgType": "setRs485Value", "data": "03060000000209E9"},
-    },
-    1: {
-        "on":  {"msgType": "setRs485Value", "data": " "},
-        "off": {"msgType": "setRs485Value", "data": " "},
-    },
-    2: {
-        "on":  {"msgType": "setRs485Value", "data": " "},
-        "off": {"msgType": "setRs485Value", "data": " "},
-    },
-    3: {
-        "on":  {"msgType": "setRs485Value", "data": " "},
-        "off": {"msgType": "setRs485Value", "data": " "},
-    },
-    4: {
-        "on":  {"msgType": "setRs485Value", "data": " "},
-        "off": {"msgType": "setRs485Value", "data": " "},
-    },
-    5: {
-        "on":  {"msgType": "setRs485Value", "data": " "},
-        "off": {"msgType": "setRs485Value", "data": " "},
-    },
-}
+# Live state is an immutable TubewellState per device, replaced as a whole by
+# ingest and read without locks. It is created on first telemetry and dropped
+# after DEVICE_IDLE_SECONDS without any, see devices.LazyStates. tubewells is
+# created with the registry in init_storage().
+DEVICE_IDLE_SECONDS = 6 * 60 * 60
+DEVICE_EVICT_INTERVAL = 60  # seconds between idle sweeps
+AUTO_REGISTER_DEVICES = True  # register unknown devIds on their first frame
+
+def _new_tubewell_state(device):
+    return TubewellState(device.name, **session_tracker.state_fields(device.tubewell_id))
+
+# -----------------------------
+# Live push channel
+# -----------------------------
+STREAM_QUEUE_SIZE = 64  # events a subscriber may fall behind before it is dropped
+STREAM_KEEPALIVE = 15   # seconds between keep-alive comments on an idle stream
+live_broadcaster = LiveBroadcaster(STREAM_QUEUE_SIZE, STREAM_KEEPALIVE)
+
+def live_snapshot(tw):
+    """Current values of one tubewell as served to the dashboard (zeros while OFF)."""
+    state = {"name": tw.name, "status": "ON" if tw.status else "OFF"}
+    for metric in PHASE_METRICS:
+        state[metric] = tw.phases(metric) if tw.status else {"A": 0, "B": 0, "C": 0}
+    state["frequency"] = tw.frequency if tw.status else 0
+    state["total_runtime"] = tw.runtime()
+    return state
+
+# Serialized /api/fleet/snapshot body, rebuilt at most once per fleet_version().
+# The boot id keeps ETags from one process run from matching the next.
+FLEET_BOOT_ID = format(int(time.time()), "x")
+_fleet_cache = {"version": None, "body": b""}
+_fleet_cache_lock = threading.Lock()
+
+def fleet_version():
+    """(boot id, version) of the live state; from the shared state table when there is one, so all workers agree."""
+    if shared_state is not None:
+        # Registering a device writes its slot, so the table version covers the registry
+        return format(shared_state.boot_ms, "x"), shared_state.version
+    # Both only grow, so the sum changes whenever either does
+    return FLEET_BOOT_ID, live_broadcaster.version + device_registry.version
+
+def fleet_entry(tubewell_id, tw):
+    """One tubewell of the fleet snapshot.
+
+    The body is cached until the fleet changes, so it cannot carry a runtime
+    that grows while a pump runs: ``closed_runtime`` is the runtime of the
+    finished sessions and ``session_start`` (epoch seconds, null while OFF)
+    lets the client add the running one.
+    """
+    entry = live_snapshot(tw)
+    del entry["total_runtime"]
+    entry.update(id=tubewell_id, closed_runtime=tw.total_runtime,
+                 session_start=tw.session_start if tw.status else None)
+    return entry
+
+def fleet_snapshot_body():
+    """Return ((boot id, version), JSON bytes) with the live state of every tubewell."""
+    with _fleet_cache_lock:
+        version = fleet_version()
+        if _fleet_cache["version"] != version:
+            snapshot = {
+                "version": version[1],
+                "tubewells": {i: fleet_entry(i, tw) for i, tw in tubewells.all_items()},
+            }
+            _fleet_cache["body"] = json.dumps(snapshot, separators=(",", ":")).encode()
+            _fleet_cache["version"] = version
+        return version, _fleet_cache["body"]
+
+# Devices registered on first start: (devId, tubewell id, name, RS485 on frame, RS485 off frame)
+DEFAULT_DEVICES = [("device-1", 0, "Tubewell 1", "03060000000149E8", "03060000000209E9")] + [
+    (f"device-{i+1}", i, f"Tubewell {i+1}", None, None) for i in range(1, 30)
+]
+
+def device_commands(device):
+    """Hex RS485 frames that switch a device's pump "on" / "off", None where it cannot be addressed.
+
+    Frames configured on the device win; otherwise they are built for its
+    Modbus slave address. A device with neither gets no frame: any guessed
+    address could be another well's PLC.
+    """
+    cmds = {}
+    for action, frame in (("on", device.on_command), ("off", device.off_command)):
+        if frame and frame.strip():
+            cmds[action] = frame.strip()
+        elif device.slave_address is not None:
+            cmds[action] = pump_frame(device.slave_address, action)
+        else:
+            cmds[action] = None
+    return cmds
+
+def uncommandable(ids, action):
+    """Tubewells in ``ids`` that have no ``action`` frame and no slave address configured."""
+    return [i for i in ids if device_commands(device_registry.get(i))[action] is None]
 
 MQTT_BROKER = "broker.hivemq.com"
 MQTT_PORT = 1883
@@ -144,127 +257,171 @@ client = mqtt.Client()
 # -----------------------------
 DB_FILE = "tubewell_data.db"
 
-# Initialize database
+# Batch writer: commit when this many rows are pending or the oldest row is this old
+DB_FLUSH_MAX_ROWS = 500
+DB_FLUSH_MAX_LATENCY = 1.0  # seconds
+
+# Raw samples are stored in one table per RAW_PARTITION_DAYS. Partitions older
+# than RAW_RETENTION_DAYS are dropped once rolled up (None keeps raw data forever)
+RAW_PARTITION_DAYS = 1
+RAW_RETENTION_DAYS = 90
+
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # Create table for raw data (for small charts)
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS raw_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            tubewell_id INTEGER,
-            timestamp DATETIME,
-            voltage_a REAL,
-            voltage_b REAL,
-            voltage_c REAL,
-            current_a REAL,
-            current_b REAL,
-            current_c REAL,
-            active_power_a REAL,
-            active_power_b REAL,
-            active_power_c REAL,
-            reactive_power_a REAL,
-            reactive_power_b REAL,
-            reactive_power_c REAL,
-            frequency REAL
-        )
-    ''')
-    
-    # Create table for aggregated data (for big charts)
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS aggregated_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            tubewell_id INTEGER,
-            bucket_start DATETIME,
-            voltage_a_avg REAL,
-            voltage_b_avg REAL,
-            voltage_c_avg REAL,
-            current_a_avg REAL,
-            current_b_avg REAL,
-            current_c_avg REAL,
-            active_power_a_avg REAL,
-            active_power_b_avg REAL,
-            active_power_c_avg REAL,
-            reactive_power_a_avg REAL,
-            reactive_power_b_avg REAL,
-            reactive_power_c_avg REAL,
-            frequency_avg REAL,
-            data_points INTEGER
-        )
-    ''')
-    
-    conn.commit()
+    conn = open_wal_connection(DB_FILE)
+
+    # Raw data (for small charts) and aggregated data (for big charts), schema v2
+    create_schema(conn)
+    pending = pending_migrations(conn)
+    if pending:
+        print(f"[SCHEMA] v1 data in {pending} is not migrated yet; run: python db_schema.py migrate --db {DB_FILE}")
+
     conn.close()
 
-# Call this function when starting the app
-init_db()
+# Opened by init_storage(): device registry, per-device live state and history
+# rings, raw partitions and the batch writer that all persistence goes through
+device_registry = None
+tubewells = None
+history_data = None
+raw_partitions = None
+db_writer = None
+
+def _observe_raw_batch(batch, seconds):
+    RAW_BATCH_ROWS.observe(len(batch))
+    RAW_BATCH_SECONDS.observe(seconds)
 
 # Store incoming MQTT data
-def store_raw_data(tubewell_id, data):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    c.execute('''
-        INSERT INTO raw_data 
-        (tubewell_id, timestamp, voltage_a, voltage_b, voltage_c, 
-         current_a, current_b, current_c, active_power_a, active_power_b, active_power_c,
-         reactive_power_a, reactive_power_b, reactive_power_c, frequency)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        tubewell_id, datetime.utcnow(),
-        data["voltage"]["A"], data["voltage"]["B"], data["voltage"]["C"],
-        data["current"]["A"], data["current"]["B"], data["current"]["C"],
-        data["active_power"]["A"], data["active_power"]["B"], data["active_power"]["C"],
-        data["reactive_power"]["A"], data["reactive_power"]["B"], data["reactive_power"]["C"],
-        data["frequency"]
-    ))
-    
-    conn.commit()
-    conn.close()
+def store_raw_data(tubewell_id, state, ts=None):
+    """Queue one sample for the batch writer (committed in groups, not per row)."""
+    if ts is None:
+        ts = now_ms()
+    started = time.perf_counter()
+    db_writer.submit(raw_partitions.insert_sql(ts), (tubewell_id, ts) + state.sample())
+    RAW_STORE_SECONDS.observe(time.perf_counter() - started)
+
+# Energy is integrated from every decoded sample; cumulative counters at each
+# 15-minute boundary go through the batch writer with the raw rows
+def store_energy_counter(tubewell_id, bucket_start, totals):
+    db_writer.submit(ENERGY_COUNTER_SQL, (tubewell_id, bucket_start) + totals)
+
+energy_integrator = EnergyIntegrator(on_counter=store_energy_counter)
+
+def checkpoint_energy():
+    conn = open_wal_connection(DB_FILE)
+    try:
+        energy_integrator.checkpoint(conn)
+    finally:
+        conn.close()
+
+# Run sessions: status, runtime and the ON/OFF history follow the measured
+# current; each session is written to the sessions table as it opens and closes
+SESSION_SWEEP_INTERVAL = 15  # seconds between checks for pumps that went silent
+
+def store_session(session):
+    db_writer.submit(SESSION_UPSERT_SQL, session)
+
+session_tracker = SessionTracker(on_change=store_session)
+
+def checkpoint_sessions():
+    conn = open_wal_connection(DB_FILE)
+    try:
+        session_tracker.checkpoint(conn)
+    finally:
+        conn.close()
+
+def apply_sessions(state, changes):
+    """Fold opened / closed sessions of one tubewell into its live state."""
+    for session in changes:
+        if session.end_ms is None:
+            state = state.with_event(timestamp=session.start_ms // 1000, action="ON", source="telemetry")
+        else:
+            state = state.with_event(timestamp=session.end_ms // 1000, action="OFF", source="telemetry",
+                                     runtime=(session.end_ms - session.start_ms) // 1000)
+    return state.replace(**session_tracker.state_fields(changes[0].tubewell_id))
+
+# -----------------------------
+# Alerts
+# -----------------------------
+# Rules are checked on every decoded frame (see alerts.AlertEngine). Alerts
+# are written to the alerts table as they open and close and pushed to
+# /api/stream subscribers as "alert" events. ALERT_RULES_FILE, when present,
+# holds a JSON list of rule dicts that replaces DEFAULT_ALERT_RULES.
+ALERT_RULES_FILE = "alert_rules.json"
+
+def load_alert_rules():
+    if os.path.exists(ALERT_RULES_FILE):
+        try:
+            with open(ALERT_RULES_FILE) as f:
+                rules = compile_rules(json.load(f))
+            print(f"[ALERTS] Loaded {len(rules)} rules from {ALERT_RULES_FILE}")
+            return rules
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"[ALERTS] Ignoring {ALERT_RULES_FILE}: {e}")
+    return compile_rules(DEFAULT_ALERT_RULES)
+
+def alert_json(alert):
+    return {"tubewell_id": alert.tubewell_id, "rule": alert.rule, "severity": alert.severity,
+            "start_ms": alert.start_ms, "end_ms": alert.end_ms, "value": alert.value, "peak": alert.peak}
+
+def record_alert(alert):
+    db_writer.submit(ALERT_UPSERT_SQL, alert)
+    if alert.end_ms is None:
+        ALERTS_OPENED.labels(alert.rule, alert.severity).inc()
+        print(f"[ALERTS] {alert.severity.upper()} {alert.rule} on tubewell {alert.tubewell_id} ({alert.value:.3g})")
+    live_broadcaster.notify(alert.tubewell_id, "alert", alert_json(alert))
+
+alert_engine = None  # AlertEngine over the loaded rules, created by init_storage()
+
+# Roll raw data up into 1m / 15m / 1h / 1d buckets
+AGGREGATION_INTERVAL = 60  # seconds
+# Samples are stamped on receipt, a moment before they are queued for ingest;
+# rollups treat only samples older than this margin behind the drain as complete
+INGEST_CLOCK_MARGIN_MS = 1000
+AGGREGATION_DRAIN_TIMEOUT = 10  # seconds to wait for queued samples before rolling up
+
+# Encoded /aggregated responses. Ranges that end before the rollup watermark
+# never change again and are kept until evicted; newer ones until the
+# watermark moves
+AGGREGATED_CACHE_BYTES = 32 * 1024 * 1024
+CLOSED_RANGE_MAX_AGE = 365 * 24 * 60 * 60  # Cache-Control max-age for final ranges, seconds
+
+aggregated_cache = ResponseCache(AGGREGATED_CACHE_BYTES)  # watermark set by init_storage()
 
-# Aggregate data into 15-minute buckets
 def aggregate_data():
-    """Run this periodically to aggregate raw data into 15-minute buckets"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # Get the latest aggregation time
-    c.execute('SELECT MAX(bucket_start) FROM aggregated_data')
-    result = c.fetchone()
-    last_aggregation = result[0] if result[0] else '2000-01-01 00:00:00'
-    
-    print(f"[AGGREGATION] Last aggregation: {last_aggregation}")
-    
-    # Aggregate new data in 15-minute intervals
-    c.execute('''
-        INSERT INTO aggregated_data 
-        (tubewell_id, bucket_start, 
-         voltage_a_avg, voltage_b_avg, voltage_c_avg,
-         current_a_avg, current_b_avg, current_c_avg,
-         active_power_a_avg, active_power_b_avg, active_power_c_avg,
-         reactive_power_a_avg, reactive_power_b_avg, reactive_power_c_avg,
-         frequency_avg, data_points)
-        
-        SELECT 
-            tubewell_id,
-            datetime(strftime('%s', timestamp) - (strftime('%s', timestamp) % 900), 'unixepoch') as bucket_start,
-            AVG(voltage_a), AVG(voltage_b), AVG(voltage_c),
-            AVG(current_a), AVG(current_b), AVG(current_c),
-            AVG(active_power_a), AVG(active_power_b), AVG(active_power_c),
-            AVG(reactive_power_a), AVG(reactive_power_b), AVG(reactive_power_c),
-            AVG(frequency), COUNT(*)
-        FROM raw_data 
-        WHERE timestamp > ?
-        GROUP BY tubewell_id, bucket_start
-        HAVING COUNT(*) > 0
-    ''', (last_aggregation,))
-    
-    rows_affected = c.rowcount
-    print(f"[AGGREGATION] Added {rows_affected} new aggregated rows")
-    
-    conn.commit()
-    conn.close()
+    """Run this periodically to bring every rollup resolution up to date"""
+    started = time.perf_counter()
+    # Buckets behind the watermark are final (and cached as such), so it may only
+    # pass samples that are stored: drain what ingest has queued, then the writer
+    final_before = now_ms() - INGEST_CLOCK_MARGIN_MS
+    if not ingest_pipeline.wait_for(ingest_pipeline.mark(), timeout=AGGREGATION_DRAIN_TIMEOUT):
+        print("[AGGREGATION] Ingest queue did not drain in time, watermarks stay where they are")
+        final_before = 0
+    if not db_writer.flush(timeout=AGGREGATION_DRAIN_TIMEOUT):
+        print("[AGGREGATION] Raw writer did not flush in time, watermarks stay where they are")
+        final_before = 0
+    conn = open_wal_connection(DB_FILE)
+    try:
+        rows_affected = run_rollups(conn, raw_partitions, final_before)
+        AGGREGATION_ROWS.inc(rows_affected)
+        print(f"[AGGREGATION] Updated {rows_affected} aggregated rows")
+        watermark = rollup_watermark(conn)
+        aggregated_cache.advance(watermark)
+        if shared_state is not None:
+            shared_state.set_watermark(watermark)
+        energy_integrator.checkpoint(conn)
+        session_tracker.checkpoint(conn)
+        expire_raw_partitions(conn)
+    finally:
+        conn.close()
+        AGGREGATION_SECONDS.observe(time.perf_counter() - started)
+
+def expire_raw_partitions(conn):
+    """Drop raw partitions past retention, but only once their rollups are complete"""
+    if not RAW_RETENTION_DAYS:
+        return
+    cutoff = min(now_ms() - RAW_RETENTION_DAYS * DAY_MS, rollup_watermark(conn))
+    dropped = raw_partitions.expire(conn, cutoff)
+    if dropped:
+        print(f"[RETENTION] Dropped raw partitions: {', '.join(dropped)}")
 
 # -----------------------------
 # Safe JSON Save Helper
@@ -294,94 +451,106 @@ def safe_save_json(data, filename):
 # File save worker
 # -----------------------------
 def save_history():
-    """Write history_data to disk with locking and retry."""
-    max_retries = 10
-    retry_delay = 0.2
-    for attempt in range(max_retries):
-        try:
-            with history_Lock:
-                safe_save_json(json.dumps(history_data, indent=2), HISTORY_FILE)
-                print(f"[save_worker] History saved successfully (attempt {attempt + 1})")
-                return True
-        except PermissionError as e:
-            if attempt < max_retries - 1:
-                print(f"[save_worker] File locked, retrying in {retry_delay}s... (attempt {attempt + 1})")
-                time.sleep(retry_delay)
-            else:
-                print(f"[save_worker] Failed to save history after {max_retries} attempts: {e}")
+    """Write a compact snapshot of history_data and truncate the journal."""
+    with SAVE_HISTORY_SECONDS.time():
+        max_retries = 10
+        retry_delay = 0.2
+        with history_Lock:
+            history = {tubewell_id: ring.to_lists() for tubewell_id, ring in history_data.items()}
+            snapshot = json.dumps({"seq": history_seq, "history": history}, separators=(",", ":"))
+        for attempt in range(max_retries):
+            try:
+                if safe_save_json(snapshot, HISTORY_FILE):
+                    history_journal.truncate()
+                    print(f"[save_worker] History snapshot saved (attempt {attempt + 1})")
+                    return True
+                return False
+            except PermissionError as e:
+                if attempt < max_retries - 1:
+                    print(f"[save_worker] File locked, retrying in {retry_delay}s... (attempt {attempt + 1})")
+                    time.sleep(retry_delay)
+                else:
+                    print(f"[save_worker] Failed to save history after {max_retries} attempts: {e}")
+                    return False
+            except Exception as e:
+                print(f"[save_worker] Unexpected error saving history: {e}")
                 return False
-        except Exception as e:
-            print(f"[save_worker] Unexpected error saving history: {e}")
-            return False
 
 def save_worker():
-    """Background worker thread that saves history when queued."""
+    """Background worker thread that appends queued history points to the journal."""
     while True:
-        save_queue.get()
-        save_history()
-        save_queue.task_done()
+        batch = [save_queue.get()]
+        while True:
+            try:
+                batch.append(save_queue.get_nowait())
+            except queue.Empty:
+                break
+        records = [item for item in batch if item is not COMPACT]
+        try:
+            if records:
+                history_journal.append(records)
+            if len(records) < len(batch) or history_journal.size > HISTORY_COMPACT_BYTES:
+                save_history()
+        except Exception as e:
+            print(f"[save_worker] Unexpected error writing history journal: {e}")
+        for _ in batch:
+            save_queue.task_done()
 
 # -----------------------------
-# Helpers
+# Frame decoding
 # -----------------------------
-def get_ieee_float(b1, b2, b3, b4, byteorder="big"):
-    if byteorder == "big":
-        raw = bytes([b1, b2, b3, b4])
-    else:
-        raw = bytes([b4, b3, b2, b1])
-    return struct.unpack('!f', raw)[0]
+frame_decoder = FrameDecoder(DEFAULT_REGISTER_MAP)
 
 # -----------------------------
 # MQTT parsing
 # -----------------------------
-def parse_mqtt_data(payload, tubewell_id):
+# Last sample timestamp per tubewell. Raw rows are keyed (tubewell_id, ts), so
+# frames of one device received in the same millisecond get consecutive
+# timestamps instead of overwriting each other. Only the device's own ingest
+# worker touches its entry.
+_last_sample_ms = {}
+
+def unique_sample_ms(tubewell_id, received_ms):
+    """``received_ms``, moved past the previous sample of ``tubewell_id`` if needed."""
+    last = _last_sample_ms.get(tubewell_id)
+    if last is not None and received_ms <= last:
+        received_ms = last + 1
+    _last_sample_ms[tubewell_id] = received_ms
+    return received_ms
+
+def parse_mqtt_data(payload, tubewell_id, received_ms=None):
     try:
         dev_id = payload.get("devId")
-        data_hex = payload.get("data", "").replace("\n", "").replace(" ", "")
-        if len(data_hex) < 250:
-            print(f"[WARN] Skipping short MQTT payload ({len(data_hex)} chars)")
+        data_hex = payload.get("data", "")
+        with FRAME_DECODE_SECONDS.time():
+            frame = bytes.fromhex(data_hex)
+            values = frame_decoder.decode(frame)
+        if values is None:
+            # Short frames are Modbus responses to pump commands
+            if command_dispatcher.handle_response(dev_id, frame, received_ms or now_ms()) is None:
+                print(f"[WARN] Skipping short MQTT payload ({len(frame)} bytes)")
             return
 
-        bytes_list = [int(data_hex[i:i+2], 16) for i in range(0, len(data_hex), 2)]
-
-        print("\n=== RAW PAYLOAD DEBUG ===")
-        print("Device ID:", dev_id)
-        print("Hex string (first 80 chars):", data_hex[:80], "...")
-        print("Bytes (first 40):", bytes_list[:40])
-        print("Total bytes received:", len(bytes_list))
-        print("==========================\n")
-
-        tw = tubewells[tubewell_id]
-        tw["status"] = True 
-
-        # Parse values
-        tw["voltage"]["A"] = round(get_ieee_float(bytes_list[13], bytes_list[14], bytes_list[15], bytes_list[16]), 1)
-        tw["voltage"]["B"] = round(get_ieee_float(bytes_list[17], bytes_list[18], bytes_list[19], bytes_list[20]), 1)
-        tw["voltage"]["C"] = round(get_ieee_float(bytes_list[21], bytes_list[22], bytes_list[23], bytes_list[24]), 1)
-
-        tw["current"]["A"] = round(get_ieee_float(bytes_list[29], bytes_list[30], bytes_list[31], bytes_list[32]), 2)
-        tw["current"]["B"] = round(get_ieee_float(bytes_list[33], bytes_list[34], bytes_list[35], bytes_list[36]), 2)
-        tw["current"]["C"] = round(get_ieee_float(bytes_list[37], bytes_list[38], bytes_list[39], bytes_list[40]), 2)
-
-        tw["active_power"]["A"] = round(get_ieee_float(bytes_list[49], bytes_list[50], bytes_list[51], bytes_list[52]), 2)
-        tw["active_power"]["B"] = round(get_ieee_float(bytes_list[53], bytes_list[54], bytes_list[55], bytes_list[56]), 2)
-        tw["active_power"]["C"] = round(get_ieee_float(bytes_list[57], bytes_list[58], bytes_list[59], bytes_list[60]), 2)
-
-        tw["reactive_power"]["A"] = round(get_ieee_float(bytes_list[65], bytes_list[66], bytes_list[67], bytes_list[68]), 2)
-        tw["reactive_power"]["B"] = round(get_ieee_float(bytes_list[69], bytes_list[70], bytes_list[71], bytes_list[72]), 2)
-        tw["reactive_power"]["C"] = round(get_ieee_float(bytes_list[73], bytes_list[74], bytes_list[75], bytes_list[76]), 2)
-
-        tw["power_factor"]["A"] = round(get_ieee_float(bytes_list[97], bytes_list[98], bytes_list[99], bytes_list[100]), 3)
-        tw["power_factor"]["B"] = round(get_ieee_float(bytes_list[101], bytes_list[102], bytes_list[103], bytes_list[104]), 3)
-        tw["power_factor"]["C"] = round(get_ieee_float(bytes_list[105], bytes_list[106], bytes_list[107], bytes_list[108]), 3)
+        # Publish the whole frame at once; readers see either the old or the new state
+        received_ms = unique_sample_ms(tubewell_id, received_ms if received_ms is not None else now_ms())
+        with ALERT_EVAL_SECONDS.time():
+            alert_engine.evaluate(tubewell_id, values, received_ms)
+        sessions = session_tracker.observe(tubewell_id, [values["current"][p] for p in PHASES], received_ms)
+        if sessions:
+            tw = tubewells.update(tubewell_id, lambda state: apply_sessions(state.with_frame(values, received_ms), sessions))
+        else:
+            tw = tubewells.update(tubewell_id, lambda state: state.with_frame(values, received_ms))
 
-        tw["frequency"] = round(get_ieee_float(bytes_list[121], bytes_list[122], bytes_list[123], bytes_list[124]), 2)
+        live_broadcaster.publish(tubewell_id, live_snapshot(tw))
 
         # Store data in database
-        store_raw_data(tubewell_id, tw)
+        store_raw_data(tubewell_id, tw, received_ms)
+        energy_integrator.add(tubewell_id, tw.active_power, tw.reactive_power, received_ms)
 
-        log_history(tubewell_id, tw)
+        log_history(tubewell_id, tw, received_ms)
+        MQTT_PARSED.labels(dev_id).inc()
     except Exception as e:
+        MQTT_PARSE_ERRORS.inc()
         print(f"Error parsing MQTT data for tubewell {tubewell_id}:", e)
 
 def on_connect(client, userdata, flags, rc):
@@ -397,70 +566,85 @@ def on_connect(client, userdata, flags, rc):
         print(f"FAILED: Connection error code {rc}")
     print("="*50 + "\n")
 
-def on_message(client, userdata, msg):
-    
-    print("MQTT MESSAGE RECEIVED!")
-    print(f"Topic: {msg.topic}")
-    print(f"Payload length: {len(msg.payload)} bytes")
-    
+def handle_mqtt_message(item):
+    """Ingest worker: decode one queued MQTT message and apply it."""
+    received_ms, topic, raw = item
     try:
-        payload_str = msg.payload.decode()
-        print(f"Raw payload (first 200 chars): {payload_str[:200]}...")
-        
-        payload = json.loads(payload_str)
+        payload = json.loads(raw.decode())
         dev_id = payload.get("devId", "MISSING_DEV_ID")
         data_present = bool(payload.get("data"))
-        
-        print(f"Device ID: '{dev_id}'")
-        print(f"Data present: {data_present}")
-        print(f"Available devices: {list(device_to_tubewell.keys())[:5]}...")  # First 5
-        
-        if dev_id in device_to_tubewell:
-            tubewell_id = device_to_tubewell[dev_id]
-            print(f" MATCH: {dev_id} → Tubewell {tubewell_id}")
-            
-            if data_present:
-                print("Starting data parsing...")
-                parse_mqtt_data(payload, tubewell_id)
-                print("Data parsing completed")
-                
-                # Verify data was stored
-                tw = tubewells[tubewell_id]
-                print(f"Updated Tubewell {tubewell_id} - Voltage A: {tw['voltage']['A']}V")
-            else:
-                print("No data field in payload")
-        else:
-            print(f"NO MATCH: '{dev_id}' not in device_to_tubewell")
-            print(f"Looking for: {dev_id}")
-            print(f"Available: {list(device_to_tubewell.keys())}")
-            
-    except json.JSONDecodeError as e:
-        print(f"JSON DECODE ERROR: {e}")
+
+        tubewell_id = device_registry.lookup(dev_id)
+        if tubewell_id is None and AUTO_REGISTER_DEVICES and data_present and isinstance(dev_id, str):
+            device = device_registry.register(dev_id)
+            tubewell_id = device.tubewell_id
+            print(f"[DEVICES] Registered new device {dev_id} as tubewell {tubewell_id}")
+
+        if tubewell_id is None:
+            print(f"[WARN] Ignoring message from unregistered device {dev_id!r}")
+        elif data_present:
+            parse_mqtt_data(payload, tubewell_id, received_ms)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        print(f"[WARN] Ignoring MQTT message on {topic} that is not JSON: {e}")
     except Exception as e:
         print(f"UNEXPECTED ERROR: {e}")
         import traceback
         traceback.print_exc()
-    
 
-client.on_connect = on_connect
-client.on_message = on_message
+# -----------------------------
+# Ingest pipeline
+# -----------------------------
+# paho's network thread only queues payloads; decoding, live state updates and
+# persistence run on INGEST_WORKERS threads. Frames of one device always go to
+# the same worker so they are applied in order.
+INGEST_WORKERS = 2
+INGEST_QUEUE_SIZE = 10000
+INGEST_OVERFLOW = "drop_oldest"  # or "block" to push back on the MQTT client instead
+ingest_pipeline = None  # IngestPipeline, started by start()
 
-print("Connecting to MQTT broker...")
-print(f"Broker: {MQTT_BROKER}:{MQTT_PORT}")
-print(f"Subscribe topic: {MQTT_TOPIC_SUB}")
-print(f"Publish topic: {MQTT_TOPIC_PUB}")
+_DEV_ID_RE = re.compile(rb'"devId"\s*:\s*"?([^",}]*)')
 
-try:
-    client.connect(MQTT_BROKER, MQTT_PORT, 60)
-    print("MQTT connect() called successfully")
-except Exception as e:
-    print(f"MQTT connect() failed: {e}")
+def on_message(client, userdata, msg):
+    match = _DEV_ID_RE.search(msg.payload)
+    key = match.group(1) if match else None
+    device = key.decode(errors="replace") if key else ""
+    MQTT_RECEIVED.labels(device if device_registry.lookup(device) is not None else "unknown").inc()
+    ingest_pipeline.submit((now_ms(), msg.topic, msg.payload), key=key)
+
+# Queue and writer state, read when /metrics is scraped
+metrics.gauge("tubewell_ingest_queue_depth", "Messages waiting for an ingest worker").set_function(lambda: ingest_pipeline.depth)
+metrics.counter("tubewell_ingest_dropped_total", "Messages discarded by the drop_oldest policy").set_function(lambda: ingest_pipeline.dropped)
+metrics.gauge("tubewell_raw_writer_pending_rows", "Raw rows buffered for the next commit").set_function(lambda: db_writer.pending)
+metrics.counter("tubewell_raw_writer_errors_total", "Raw writer batches that failed").set_function(lambda: db_writer.errors)
+metrics.counter("tubewell_raw_writer_dropped_rows_total", "Rows the raw writer could not write even on their own").set_function(lambda: db_writer.rows_dropped)
+metrics.gauge("tubewell_devices_registered", "Devices in the registry").set_function(lambda: len(device_registry))
+metrics.gauge("tubewell_devices_live", "Devices with live state in memory").set_function(lambda: len(tubewells))
+metrics.gauge("tubewell_stream_subscribers", "Open /api/stream connections").set_function(lambda: live_broadcaster.subscriber_count)
+metrics.counter("tubewell_energy_counters_total", "Energy counters written at bucket boundaries").set_function(lambda: energy_integrator.counters_emitted)
+metrics.gauge("tubewell_aggregated_cache_bytes", "Size of cached /aggregated responses").set_function(lambda: aggregated_cache.size)
+metrics.counter("tubewell_aggregated_cache_hits_total", "/aggregated requests answered from the cache").set_function(lambda: aggregated_cache.hits)
+metrics.counter("tubewell_aggregated_cache_misses_total", "/aggregated requests that ran the rollup query").set_function(lambda: aggregated_cache.misses)
+metrics.gauge("tubewell_history_journal_bytes", "Size of the history journal").set_function(lambda: history_journal.size)
+metrics.gauge("tubewell_alerts_open", "Alerts firing now").set_function(lambda: len(alert_engine.open_alerts()))
+metrics.gauge("tubewell_commands_pending", "Pump commands waiting for their echo").set_function(lambda: len(command_dispatcher.pending()))
+metrics.counter("tubewell_command_retries_total", "Pump commands published again after a timeout").set_function(lambda: command_dispatcher.retried)
+
+client.on_connect = on_connect
+client.on_message = on_message
 
-# Start MQTT loop
-print("Starting MQTT loop...")
-mqtt_thread = threading.Thread(target=client.loop_start, daemon=True)
-mqtt_thread.start()
-print("MQTT loop started in background thread")
+def start_mqtt():
+    """Connect to the broker and start paho's network thread (it reconnects by itself from then on)."""
+    print("Connecting to MQTT broker...")
+    print(f"Broker: {MQTT_BROKER}:{MQTT_PORT}")
+    print(f"Subscribe topic: {MQTT_TOPIC_SUB}")
+    print(f"Publish topic: {MQTT_TOPIC_PUB}")
+    try:
+        client.connect(MQTT_BROKER, MQTT_PORT, 60)
+        print("MQTT connect() called successfully")
+    except Exception as e:
+        print(f"MQTT connect() failed: {e}")
+    client.loop_start()
+    print("MQTT loop started in background thread")
 
 # -----------------------------
 # Dummy data simulation
@@ -491,81 +675,274 @@ print("MQTT loop started in background thread")
 # -----------------------------
 # History load & log
 # -----------------------------
+# One column per raw metric column plus the runtime counter, stored as float32
+HISTORY_COLUMNS = RAW_COLUMNS + ("runtime",)
+_register_digits = {(reg.metric, reg.phase): reg.ndigits for reg in DEFAULT_REGISTER_MAP}
+HISTORY_DIGITS = tuple(_register_digits.get(key) for key in RAW_COLUMN_KEYS) + (0,)
+
+def _new_history_ring():
+    return HistoryRing(HISTORY_COLUMNS, HISTORY_POINTS, digits=HISTORY_DIGITS)
+
+def _history_values(data):
+    """Flatten old-style live data dicts (pre ring buffer journal records) into HISTORY_COLUMNS order."""
+    values = [data[metric] if phase is None else data[metric][phase] for metric, phase in RAW_COLUMN_KEYS]
+    values.append(data["total_runtime"])
+    return values
+
+def _iso_to_ms(when):
+    return int(datetime.fromisoformat(when).timestamp() * 1000)
+
+def _legacy_history_samples(series):
+    """Regroup the old per-point history dicts into (epoch ms, values) samples."""
+    samples = {}
+    for metric, points in series.items():
+        for point in points:
+            column = f"{metric}_{point['phase'].lower()}" if "phase" in point else metric
+            samples.setdefault(point["time"], {})[column] = point["value"]
+    for when in sorted(samples):
+        values = samples[when]
+        yield _iso_to_ms(when), [values.get(column, 0) for column in HISTORY_COLUMNS]
+
 def load_history():
-    global history_data
+    """Rebuild history_data from the last snapshot plus the journal written since."""
+    global history_seq
+    snapshot_seq = 0
+    raw = {}
     try:
         with open(HISTORY_FILE, "r") as f:
             raw = json.load(f)
-        converted = {}
-        for k, v in raw.items():
-            try:
-                ik = int(k)
-            except Exception:
-                ik = k
-            converted[ik] = v
-        history_data = converted
+        if "seq" in raw and "history" in raw:
+            snapshot_seq = raw["seq"]
+            raw = raw["history"]
         print("History loaded from disk.")
     except (FileNotFoundError, json.JSONDecodeError):
         print("No previous history found or file invalid; starting fresh.")
-        history_data = {}
-
-    for i in range(30):
-        if i not in history_data:
-            history_data[i] = {
-                "voltage": [], "current": [], "active_power": [],
-                "reactive_power": [], "power_factor": [],
-                "frequency": [], "runtime": []
-            }
+
+    for k, v in raw.items():
+        try:
+            ik = int(k)
+        except Exception:
+            continue
+        if ik not in history_data:
+            continue
+        ring = history_data[ik]
+        if "time" in v:
+            ring.load_lists(v)
         else:
-            for key in ("voltage", "current", "active_power", "reactive_power", "power_factor", "frequency", "runtime"):
-                if key not in history_data[i]:
-                    history_data[i][key] = []
-
-def log_history(tubewell_id, mqtt_data):
-    global history_data
-    now = datetime.now().isoformat()
-    for phase in ("A", "B", "C"):
-        history_data[tubewell_id]["voltage"].append({"time": now, "phase": phase, "value": mqtt_data["voltage"][phase]})
-        history_data[tubewell_id]["current"].append({"time": now, "phase": phase, "value": mqtt_data["current"][phase]})
-        history_data[tubewell_id]["active_power"].append({"time": now, "phase": phase, "value": mqtt_data["active_power"][phase]})
-        history_data[tubewell_id]["reactive_power"].append({"time": now, "phase": phase, "value": mqtt_data["reactive_power"][phase]})
-        history_data[tubewell_id]["power_factor"].append({"time": now, "phase": phase, "value": mqtt_data["power_factor"][phase]})
-    history_data[tubewell_id]["frequency"].append({"time": now, "value": mqtt_data["frequency"]})
-    history_data[tubewell_id]["runtime"].append({"time": now, "value": mqtt_data["total_runtime"]})
-    for key in history_data[tubewell_id]:
-        history_data[tubewell_id][key] = history_data[tubewell_id][key][-500:]
-    try:
-        save_queue.put_nowait(True)
-    except queue.Full:
-        pass
+            for ts, values in _legacy_history_samples(v):
+                ring.append(ts, values)
+
+    history_seq = snapshot_seq
+    replayed = 0
+    for seq, tubewell_id, ts, values in history_journal.replay(snapshot_seq):
+        if isinstance(values, dict):
+            # Journal written before history moved to ring buffers
+            ts, values = _iso_to_ms(ts), _history_values(values)
+        if tubewell_id in history_data:
+            history_data[tubewell_id].append(ts, values)
+        history_seq = max(history_seq, seq)  # Journals from before records were queued in order may be shuffled
+        replayed += 1
+    if replayed:
+        print(f"Replayed {replayed} history points from {HISTORY_JOURNAL_FILE}.")
+
+def log_history(tubewell_id, state, ts=None):
+    global history_seq
+    if ts is None:
+        ts = now_ms()
+    values = list(state.sample()) + [state.runtime()]
+    with history_Lock:
+        history_seq += 1
+        history_data[tubewell_id].append(ts, values)
+        history_data.touch(tubewell_id)
+        # Queued under the lock so the journal gets records in seq order whichever ingest worker made them
+        save_queue.put_nowait([history_seq, tubewell_id, ts, values])
+
+def start_background_loop(target, name):
+    """Run a ``while not _stopping.wait(...)`` loop on a daemon thread that stop() joins."""
+    t = threading.Thread(target=target, name=name, daemon=True)
+    t.start()
+    _background_threads.append(t)
 
-def start_periodic_saver(interval_seconds=300):
+def start_periodic_saver(interval_seconds):
     def _loop():
-        while True:
-            time.sleep(interval_seconds)
+        while not _stopping.wait(interval_seconds):
             try:
-                save_queue.put_nowait(True)
+                save_queue.put_nowait(COMPACT)
             except queue.Full:
                 pass
-    t = threading.Thread(target=_loop, daemon=True)
-    t.start()
+    start_background_loop(_loop, "history_compactor")
 
-# Add periodic aggregation (run every 15 minutes)
+# Add periodic aggregation (run every AGGREGATION_INTERVAL seconds)
 def start_periodic_aggregation():
     def _aggregate_loop():
-        while True:
-            time.sleep(900)  # 15 minutes
+        while not _stopping.wait(AGGREGATION_INTERVAL):
             try:
                 aggregate_data()
-                print("Data aggregated into 15-minute buckets")
             except Exception as e:
                 print(f"Error during aggregation: {e}")
     
-    t = threading.Thread(target=_aggregate_loop, daemon=True)
-    t.start()
+    start_background_loop(_aggregate_loop, "aggregator")
+
+# -----------------------------
+# Idle device eviction
+# -----------------------------
+def evict_idle_devices():
+    """Drop live state and history buffers of devices that stopped reporting"""
+    def publish_default(tubewell_id, state):
+        # Under the states lock: a frame arriving now is published after this
+        publish_shared_state(tubewell_id, state)
+        live_broadcaster.publish(tubewell_id, live_snapshot(state))
+
+    evicted = tubewells.evict_idle(on_evict=publish_default)
+    with history_Lock:
+        history_data.evict_idle()
+    if evicted:
+        print(f"[DEVICES] Evicted idle state of {len(evicted)} devices")
+
+def start_device_eviction():
+    def _evict_loop():
+        while not _stopping.wait(DEVICE_EVICT_INTERVAL):
+            try:
+                evict_idle_devices()
+            except Exception as e:
+                print(f"Error during device eviction: {e}")
+
+    start_background_loop(_evict_loop, "device_evictor")
+
+def close_stale_sessions():
+    """Stop the sessions of pumps that stopped sending frames"""
+    for session in session_tracker.close_stale(now_ms()):
+        tw = tubewells.update(session.tubewell_id, lambda state: apply_sessions(state, [session]))
+        live_broadcaster.publish(session.tubewell_id, live_snapshot(tw))
+
+def start_session_sweeper():
+    def _sweep_loop():
+        while not _stopping.wait(SESSION_SWEEP_INTERVAL):
+            try:
+                close_stale_sessions()
+            except Exception as e:
+                print(f"Error closing stale sessions: {e}")
 
-# Start aggregation when app starts
-start_periodic_aggregation()
+    start_background_loop(_sweep_loop, "session_sweeper")
+
+# -----------------------------
+# Pump commands
+# -----------------------------
+# Frames go out on MQTT_TOPIC_PUB with the target devId; PLCs echo Modbus
+# writes back on MQTT_TOPIC_SUB, which completes the command. See
+# commands.CommandDispatcher for retries and timeouts.
+COMMAND_SWEEP_INTERVAL = 0.5
+
+def publish_command(dev_id, frame):
+    client.publish(MQTT_TOPIC_PUB, json.dumps({"msgType": "setRs485Value", "devId": dev_id, "data": frame}))
+
+def record_command_result(result):
+    COMMAND_RESULTS.labels(result.state).inc()
+    if result.state == "acked":
+        COMMAND_ACK_SECONDS.observe(result.latency_ms / 1000)
+    elif result.state != "superseded":
+        print(f"[COMMAND] {result.action.upper()} for tubewell {result.tubewell_id} {result.state} "
+              f"after {result.attempts} attempt(s)")
+
+command_dispatcher = CommandDispatcher(publish_command, on_result=record_command_result)
+
+def send_pump_commands(ids, action):
+    """Publish ``action`` ("on" / "off") to every tubewell in ``ids`` in one go; returns {id: command id}."""
+    now = now_ms()
+    batch = []
+    for tubewell_id in ids:
+        device = device_registry.get(tubewell_id)
+        batch.append((tubewell_id, device.dev_id, action, device_commands(device)[action]))
+    command_ids = command_dispatcher.send_many(batch, now)
+    for tubewell_id in ids:
+        tubewells.update(tubewell_id, lambda tw: tw.with_event(timestamp=now // 1000, action=action.upper(), source="command"))
+    return dict(zip(ids, command_ids))
+
+def command_json(result):
+    return {"id": result.id, "tubewell_id": result.tubewell_id, "action": result.action, "state": result.state,
+            "attempts": result.attempts, "sent_ms": result.sent_ms, "finished_ms": result.finished_ms,
+            "latency_ms": result.latency_ms, "error": result.error}
+
+def start_command_sweeper():
+    def _sweep_loop():
+        while not _stopping.wait(COMMAND_SWEEP_INTERVAL):
+            try:
+                command_dispatcher.sweep(now_ms())
+            except Exception as e:
+                print(f"Error sweeping pump commands: {e}")
+
+    start_background_loop(_sweep_loop, "command_sweeper")
+
+# -----------------------------
+# Multi-process serving
+# -----------------------------
+# SERVER_ROLE "all" runs everything in one process. To serve HTTP from many
+# processes, run exactly one with "ingest" (MQTT, writer and background
+# loops, publishing live state to SHARED_STATE_FILE) and any number of WSGI
+# workers with "web", which map that file read-only (shared_state.py) and
+# read everything else from SQLite:
+#
+#     python app.py ingest
+#     gunicorn -w 8 'app:create_app({"SERVER_ROLE": "web"})'
+#
+# Put the file on a tmpfs such as /dev/shm. Routes that need state only the
+# ingest process holds answer 503 in a web worker; send them to the ingest
+# process (see ingest_only).
+SERVER_ROLES = ("all", "ingest", "web")
+SERVER_ROLE = "all"
+SHARED_STATE_FILE = "tubewell_live.state"
+SHARED_STATE_SLOTS = 16384  # at least this many; more when the registry already has higher tubewell ids
+SHARED_STATE_POLL_INTERVAL = 0.25  # seconds between a web worker's scans for rewritten slots
+shared_state = None  # SharedStateTable, writable in the ingest process, read-only in web workers
+
+_shared_state_overflow = False  # reported once
+
+def publish_shared_state(tubewell_id, state):
+    """LazyStates on_update hook of the ingest process."""
+    global _shared_state_overflow
+    if shared_state is not None and shared_state.writer:
+        try:
+            shared_state.write(tubewell_id, state)
+        except IndexError as e:
+            if not _shared_state_overflow:
+                _shared_state_overflow = True
+                print(f"[SHARED] {e}; web workers will not see it. Raise SHARED_STATE_SLOTS and restart ingest.")
+
+def ingest_only(view):
+    """Answer 503 in a web worker, for routes that need the ingest process's memory or MQTT client."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if SERVER_ROLE == "web":
+            return jsonify({"error": "Served by the ingest process only"}), 503
+        return view(*args, **kwargs)
+    return wrapper
+
+def follow_shared_state():
+    """Web worker: push slots the ingest process rewrote to local /api/stream subscribers and pick up new rollups"""
+    global shared_state, tubewells
+    if shared_state.replaced():
+        shared_state = SharedStateTable(SHARED_STATE_FILE)
+        tubewells = SharedStates(shared_state)
+        print(f"[SHARED] Reopened {SHARED_STATE_FILE} ({shared_state.slots} slots) after an ingest restart")
+    changed = shared_state.changed()
+    if any(tubewell_id not in device_registry for tubewell_id in changed):
+        # The ingest process registered a device; the routes that check ids against the registry need it too
+        print(f"[DEVICES] Loaded {device_registry.reload()} devices registered by the ingest process")
+    for tubewell_id in changed:
+        state = shared_state.read(tubewell_id)
+        if state is not None:
+            live_broadcaster.publish(tubewell_id, live_snapshot(state))
+    aggregated_cache.advance(shared_state.watermark)
+
+def start_shared_state_follower():
+    def _follow_loop():
+        while not _stopping.wait(SHARED_STATE_POLL_INTERVAL):
+            try:
+                follow_shared_state()
+            except Exception as e:
+                print(f"Error following shared state: {e}")
+
+    start_background_loop(_follow_loop, "shared_state_follower")
 
 # -----------------------------
 # Protected Routes
@@ -585,7 +962,7 @@ def history():
 def tubewell_detail(id):
     if id not in tubewells:
         return "Tubewell not found", 404
-    tubewell = tubewells[id]
+    tubewell = tubewells.peek(id)
     return render_template("tubewell_detail.html", tubewell_id=id, tubewell=tubewell)
 
 # -----------------------------
@@ -594,112 +971,280 @@ def tubewell_detail(id):
 @app.route("/api/tubewells")
 def api_tubewells():
     return jsonify([
-        {"id": i, "name": tw["name"], "status": "ON" if tw["status"] else "OFF"}
-        for i, tw in tubewells.items()
+        {"id": i, "name": tw.name, "status": "ON" if tw.status else "OFF"}
+        for i, tw in tubewells.all_items()
     ])
 
+@app.route("/api/fleet/snapshot")
+def api_fleet_snapshot():
+    """Live state of the whole fleet in one payload; answers 304 until something changes."""
+    etag = "fleet-%s-%d" % fleet_version()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        version, body = fleet_snapshot_body()
+        etag = "fleet-%s-%d" % version
+        response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/api/devices", methods=["GET"])
+def api_devices():
+    return jsonify([device_json(d) for d in device_registry.devices()])
+
+def device_json(device):
+    return {"id": device.tubewell_id, "dev_id": device.dev_id, "name": device.name,
+            "on_command": device.on_command, "off_command": device.off_command,
+            "slave_address": device.slave_address, "feeder": device.feeder}
+
+@app.route("/api/devices", methods=["POST"])
+@login_required
+@ingest_only
+def api_register_device():
+    """Register a PLC or update it: {"dev_id", "name", "on_command", "off_command", "slave_address", "feeder"}"""
+    body = request.get_json(silent=True) or {}
+    dev_id = body.get("dev_id")
+    if not isinstance(dev_id, str) or not dev_id.strip():
+        return jsonify({"error": "dev_id is required"}), 400
+    slave_address = body.get("slave_address")
+    if slave_address is not None and (not isinstance(slave_address, int) or not 1 <= slave_address <= 247):
+        return jsonify({"error": "slave_address must be a Modbus address between 1 and 247"}), 400
+    device = device_registry.register(dev_id.strip(), body.get("name"), body.get("on_command"), body.get("off_command"),
+                                      slave_address=slave_address, feeder=body.get("feeder"))
+    publish_shared_state(device.tubewell_id, tubewells.peek(device.tubewell_id))
+    return jsonify(device_json(device))
+
 @app.route("/api/tubewell/<int:id>/data")
 def api_tubewell_data(id):
     if id not in tubewells:
         return jsonify({"error": "Invalid tubewell"}), 404
-    tw = tubewells[id]
-    runtime = tw["total_runtime"]
-    if tw["status"] and tw["session_start"]:
-        runtime += int(time.time() - tw["session_start"])
+    tw = tubewells.peek(id)
+    data = live_snapshot(tw)
+    data["history"] = list(tw.events)
+    return jsonify(data)
 
- 
-    
-    # Return zero values if tubewell is OFF
-    if not tw["status"]:
-        return jsonify({
-            "name": tw["name"],
-            "status": "OFF",
-            "voltage": {"A": 0, "B": 0, "C": 0},
-            "current": {"A": 0, "B": 0, "C": 0},
-            "active_power": {"A": 0, "B": 0, "C": 0},
-            "reactive_power": {"A": 0, "B": 0, "C": 0},
-            "power_factor": {"A": 0, "B": 0, "C": 0},
-            "frequency": 0,
-            "total_runtime": runtime,
-            "history": tw["history"]
-        })
-    
-    else:
-        return jsonify({
-            "name": tw["name"],
-            "status": "ON",
-            "voltage": tw["voltage"],
-            "current": tw["current"],
-            "active_power": tw["active_power"],
-            "reactive_power": tw["reactive_power"],
-            "power_factor": tw["power_factor"],
-            "frequency": tw["frequency"],
-            "total_runtime": runtime,
-            "history": tw["history"]
-        })
+@app.route("/api/stream")
+def api_stream():
+    """Server-Sent Events feed of live values; ?ids=0,3 limits it to some tubewells."""
+    ids = None
+    if request.args.get('ids'):
+        try:
+            ids = {int(i) for i in request.args['ids'].split(',') if i.strip()}
+        except ValueError:
+            return jsonify({"error": "ids must be comma separated tubewell ids"}), 400
+        ids = {i for i in ids if i in tubewells}
+    sub = live_broadcaster.subscribe(ids)
+    snapshots = [(i, live_snapshot(tw)) for i, tw in tubewells.all_items() if ids is None or i in ids]
+    return Response(live_broadcaster.stream(sub, snapshots), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/api/tubewell/<int:id>/toggle", methods=["POST"])
 @login_required  # Protect toggle functionality
+@ingest_only
 def api_toggle_tubewell(id):
     if id not in tubewells:
         return jsonify({"error": "Invalid tubewell"}), 404
-    tw = tubewells[id]
-    cmds = toggle_commands.get(id, {})
-    if tw["status"]:
-        runtime = int(time.time() - tw["session_start"]) if tw["session_start"] else 0
-        tw["total_runtime"] += runtime
-        tw["status"] = False
-        tw["session_start"] = None
-        tw["history"].append({"timestamp": int(time.time()), "action": "OFF", "runtime": runtime})
-        if cmds.get("off"):
-            client.publish(MQTT_TOPIC_PUB, json.dumps(cmds["off"]))
+
+    # Only sends the command; status and runtime change once telemetry shows the pump start or stop
+    action = "OFF" if tubewells.peek(id).status else "ON"
+    if uncommandable([id], action.lower()):
+        return jsonify({"error": f"No slave address or {action} frame configured for tubewell {id}"}), 409
+    command_id = send_pump_commands([id], action.lower())[id]
+    return jsonify({"status": action, "pending": True, "command_id": command_id})
+
+def parse_ids():
+    """Tubewell ids from ?ids=1,2,3, or None when absent.
+
+    Raises ValueError for a malformed list and LookupError naming the ids
+    that are not registered; routes answer those with 400 and 404.
+    """
+    ids = request.args.get('ids')
+    if not ids:
+        return None
+    try:
+        id_list = [int(i) for i in ids.split(',') if i.strip()]
+    except ValueError:
+        raise ValueError("ids must be a comma separated list of tubewell ids") from None
+    unknown = [i for i in id_list if i not in device_registry]
+    if unknown:
+        raise LookupError(f"Unknown tubewell ids: {unknown}")
+    return id_list
+
+def parse_range(default_span=DAY_MS):
+    """(start, end) in ms from ?date= (one UTC day) or ?from=&to=; raises ValueError.
+
+    ``to`` defaults to now and a plain date in it includes that whole day;
+    ``from`` defaults to ``default_span`` before the end, or with None to the
+    start of the end's UTC day.
+    """
+    try:
+        date_str = request.args.get('date')
+        if date_str:
+            start = to_ms(datetime.strptime(date_str, '%Y-%m-%d'))
+            return start, start + DAY_MS
+        to_str = request.args.get('to')
+        from_str = request.args.get('from')
+        end = parse_time_param(to_str) if to_str else now_ms()
+        if to_str and len(to_str) == 10 and not to_str.isdigit():
+            end += DAY_MS  # a plain date includes the whole day
+        if from_str:
+            start = parse_time_param(from_str)
+        else:
+            start = end - default_span if default_span else (end - 1) - (end - 1) % DAY_MS
+    except ValueError:
+        raise ValueError("Invalid date. Use YYYY-MM-DD, an ISO datetime or epoch milliseconds") from None
+    if end <= start:
+        raise ValueError("'to' must be after 'from'")
+    return start, end
+
+@app.route("/api/alerts")
+def api_alerts():
+    """Alerts overlapping ?from=&to= (default the last 7 days), newest first; ?open=1 for only those firing now"""
+    try:
+        id_list = parse_ids()
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rule = request.args.get('rule')
+    if request.args.get('open') in ('1', 'true'):
+        if SERVER_ROLE == "web":
+            # The engine runs in the ingest process; the alerts table has every open alert
+            now = now_ms()
+            conn = sqlite3.connect(DB_FILE)
+            try:
+                alerts = [a for a in alerts_between(conn, now, now + 1, id_list, rule) if a.end_ms is None]
+            finally:
+                conn.close()
+            return jsonify([alert_json(a) for a in alerts])
+        alerts = [a for a in alert_engine.open_alerts(id_list and set(id_list)) if rule is None or a.rule == rule]
+        return jsonify([alert_json(a) for a in reversed(alerts)])
+
+    try:
+        start, end = parse_range(7 * DAY_MS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    limit = request.args.get('limit', 1000, type=int)
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        alerts = alerts_between(conn, start, end, id_list, rule, limit)
+    finally:
+        conn.close()
+    return jsonify([alert_json(a) for a in alerts])
+
+@app.route("/api/alerts/rules")
+def api_alert_rules():
+    return jsonify([rule_json(rule) for rule in alert_engine.rules])
+
+@app.route("/api/commands", methods=["POST"])
+@login_required
+@ingest_only
+def api_group_command():
+    """Switch many pumps at once: {"action": "on" | "off", and "ids": [...], "feeder": "F1" or "all": true}"""
+    body = request.get_json(silent=True) or {}
+    action = body.get("action")
+    if action not in ("on", "off"):
+        return jsonify({"error": "action must be 'on' or 'off'"}), 400
+    if body.get("all"):
+        ids = list(device_registry)
+    elif body.get("feeder") is not None:
+        ids = [d.tubewell_id for d in device_registry.in_feeder(body["feeder"])]
+        if not ids:
+            return jsonify({"error": f"No tubewells on feeder {body['feeder']!r}"}), 404
+    elif isinstance(body.get("ids"), list) and all(isinstance(i, int) for i in body["ids"]):
+        ids = list(dict.fromkeys(body["ids"]))
+        unknown = [i for i in ids if i not in device_registry]
+        if unknown:
+            return jsonify({"error": f"Unknown tubewell ids: {unknown}"}), 404
     else:
-        tw["status"] = True
-        tw["session_start"] = time.time()
-        tw["history"].append({"timestamp": int(time.time()), "action": "ON"})
-        if cmds.get("on"):
-            client.publish(MQTT_TOPIC_PUB, json.dumps(cmds["on"]))
-    return jsonify({"status": "ON" if tw["status"] else "OFF"})
+        return jsonify({"error": "Give 'ids' (a list of tubewell ids), 'feeder' or 'all'"}), 400
+
+    # Wells named explicitly must all be addressable; a feeder or "all" skips those that are not
+    explicit = not body.get("all") and body.get("feeder") is None
+    refused = uncommandable(ids, action)
+    if refused and (explicit or len(refused) == len(ids)):
+        return jsonify({"error": "No slave address configured", "refused": refused}), 409
+    ids = [i for i in ids if i not in refused]
+
+    started = time.perf_counter()
+    command_ids = send_pump_commands(ids, action)
+    print(f"[COMMAND] {current_user.username}: {action.upper()} to {len(ids)} tubewells "
+          f"in {(time.perf_counter() - started) * 1000:.1f}ms")
+    return jsonify({"action": action, "pending": True, "refused": refused,
+                    "commands": [{"tubewell_id": i, "command_id": c} for i, c in command_ids.items()]})
+
+@app.route("/api/commands")
+@login_required
+@ingest_only
+def api_commands():
+    """Outstanding and recently finished pump commands, with acknowledgement stats"""
+    limit = request.args.get('limit', 100, type=int)
+    return jsonify({
+        "stats": command_dispatcher.stats(),
+        "pending": [command_json(r) for r in command_dispatcher.pending()],
+        "recent": [command_json(r) for r in command_dispatcher.history(limit)],
+    })
 
 @app.route("/api/tubewell/<int:id>/status")
 def api_tubewell_status(id):
     if id not in tubewells:
         return jsonify({"error": "Invalid tubewell"}), 404
-    tw = tubewells[id]
-    return jsonify({"status": "ON" if tw["status"] else "OFF"})
+    tw = tubewells.peek(id)
+    return jsonify({"status": "ON" if tw.status else "OFF"})
 
 @app.route("/api/tubewell/<int:id>/history")
 @login_required  # Protect history data
+@ingest_only
 def api_tubewell_history(id):
+    """In-memory history as one array per series: {"time": [...], "voltage": {"A": [...]}, ...}"""
     if id not in history_data:
         return jsonify({"error": "Invalid tubewell"}), 404
-    
-    # Ensure all required keys exist
-    tw_history = history_data[id]
-    for key in ("voltage", "current", "active_power", "reactive_power", "power_factor", "frequency", "runtime"):
-        if key not in tw_history:
-            tw_history[key] = []
-    
-    return jsonify(tw_history)
+    last = request.args.get('points', type=int)
+    try:
+        downsample = downsample_args(default_points=0)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(_history_payload(history_data.peek(id), last, downsample))
+
+def _history_payload(ring, last=None, downsample=None):
+    with history_Lock:
+        lists = ring.to_lists(last)
+    if downsample and downsample[0]:
+        max_points, mode, series = downsample
+        names = list(RAW_COLUMNS) + ["runtime"]
+        times, columns = downsample_lists(lists["time"], [lists[name] for name in names],
+                                          max_points, mode, names.index(series))
+        lists = dict(zip(names, columns), time=times)
+    payload = {"time": lists["time"]}
+    for column, (metric, phase) in zip(RAW_COLUMNS, RAW_COLUMN_KEYS):
+        if phase is None:
+            payload[metric] = lists[column]
+        else:
+            payload.setdefault(metric, {})[phase] = lists[column]
+    payload["runtime"] = lists["runtime"]
+    return payload
 
 @app.route("/api/tubewell/history")
 @login_required
+@ingest_only
 def api_all_tubewell_history():
     """API endpoint to get history for all tubewells"""
-    return jsonify(history_data)
+    last = request.args.get('points', type=int)
+    return jsonify({tubewell_id: _history_payload(ring, last) for tubewell_id, ring in history_data.items()})
 
 @app.route("/api/tubewell/<int:id>/chart_data")
 def api_tubewell_chart_data(id):
     if id not in tubewells:
         return jsonify({"error": "Invalid tubewell"}), 404
-    tw = tubewells[id]
+    tw = tubewells.peek(id)
     return jsonify({
-        "voltage": tw["voltage"],
-        "current": tw["current"],
-        "active_power": tw["active_power"],
-        "reactive_power": tw["reactive_power"],
-        "frequency": tw["frequency"],
-        "status": "ON" if tw["status"] else "OFF"
+        "voltage": tw.phases("voltage"),
+        "current": tw.phases("current"),
+        "active_power": tw.phases("active_power"),
+        "reactive_power": tw.phases("reactive_power"),
+        "frequency": tw.frequency,
+        "status": "ON" if tw.status else "OFF"
     })
 
 @app.route("/api/debug/tubewell/<int:id>")
@@ -708,198 +1253,574 @@ def api_debug_tubewell(id):
     if id not in tubewells:
         return jsonify({"error": "Invalid tubewell"}), 404
     
-    tw = tubewells[id]
+    tw = tubewells.peek(id)
     return jsonify({
         "id": id,
-        "name": tw["name"],
-        "status": "ON" if tw["status"] else "OFF",
-        "voltage": tw["voltage"],
-        "current": tw["current"], 
-        "active_power": tw["active_power"],
-        "reactive_power": tw["reactive_power"],
-        "frequency": tw["frequency"],
+        "name": tw.name,
+        "status": "ON" if tw.status else "OFF",
+        "voltage": tw.phases("voltage"),
+        "current": tw.phases("current"), 
+        "active_power": tw.phases("active_power"),
+        "reactive_power": tw.phases("reactive_power"),
+        "frequency": tw.frequency,
         "has_data": any([
-            tw["voltage"]["A"] > 0,
-            tw["current"]["A"] > 0, 
-            tw["active_power"]["A"] > 0
+            tw.voltage[0] > 0,
+            tw.current[0] > 0, 
+            tw.active_power[0] > 0
         ]),
-        "last_mqtt_update": "Never" if not tw["history"] else tw["history"][-1]["timestamp"] if tw["history"] else "Never"
+        "last_mqtt_update": tw.updated_ms if tw.updated_ms is not None else "Never"
     })
 
+# -----------------------------
+# Chart payloads
+# -----------------------------
+# Every chart endpoint takes ?format=rows (one object per row, the default),
+# columnar (one array per series) or binary (packed columns, see
+# chart_format.encode_binary), and is gzipped when the client accepts it.
+_RECENT_PATHS = [("timestamp",)] + [
+    (metric,) if phase is None else (metric, phase)
+    for metric, phase in RAW_COLUMN_KEYS if metric != "power_factor"
+]
+
+def _aggregated_paths(stats):
+    """Key path of each column of a query_rollups row; averages stay at the top level."""
+    paths = [("timestamp",), ("data_points",)]
+    for metric, phase in RAW_COLUMN_KEYS:
+        for stat in stats:
+            path = (metric,) if phase is None else (metric, phase)
+            paths.append(path if stat == "avg" else (stat,) + path)
+    return paths
+
+def downsample_args(default_points):
+    """(max_points, mode, series) from ?max_points=&mode=&series=; max_points 0 means no downsampling.
+
+    Both keep real samples, chosen on ``series`` (a raw column such as
+    current_a): mode "minmax" (default) the ones with its lowest and highest
+    value per bucket, so no spike in it is lost; "lttb" one per bucket.
+    """
+    max_points = request.args.get('max_points', default_points, type=int)
+    mode = request.args.get('mode', DOWNSAMPLE_MODES[0])
+    series = request.args.get('series', RAW_COLUMNS[0])
+    if max_points < 0:
+        raise ValueError("'max_points' must be 0 or more")
+    if mode not in DOWNSAMPLE_MODES:
+        raise ValueError(f"Unknown mode. Use one of {list(DOWNSAMPLE_MODES)}")
+    if series not in RAW_COLUMNS:
+        raise ValueError(f"Unknown series. Use one of {list(RAW_COLUMNS)}")
+    return max_points, mode, series
+
+def chart_body(rows, paths, typecodes, fmt):
+    """Encode chart rows for the current request: returns (body, headers)."""
+    body, mimetype = encode_chart(rows, paths, typecodes, fmt)
+    headers = {"Content-Type": mimetype}
+    encoding = choose_encoding(request.accept_encodings, len(body))
+    if encoding:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return body, headers
+
 @app.route("/api/tubewell/<int:id>/recent")
 def api_tubewell_recent(id):
     """Get recent data for small charts (last 20 seconds)"""
+    fmt = request.args.get('format', 'rows')
+    if fmt not in CHART_FORMATS:
+        return jsonify({"error": f"Unknown format. Use one of {list(CHART_FORMATS)}"}), 400
     conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
     
-    c.execute('''
-        SELECT * FROM raw_data 
-        WHERE tubewell_id = ? AND timestamp > datetime('now', '-20 seconds')
-        ORDER BY timestamp DESC
+    since = now_ms() - 20 * 1000
+    rows = raw_partitions.select(conn, '''
+        SELECT ts, voltage_a, voltage_b, voltage_c, current_a, current_b, current_c,
+               active_power_a, active_power_b, active_power_c,
+               reactive_power_a, reactive_power_b, reactive_power_c, frequency
+        FROM {table}
+        WHERE tubewell_id = ? AND ts > ?
+        ORDER BY ts DESC
         LIMIT 20
-    ''', (id,))
-    
-    rows = c.fetchall()
+    ''', (id, since), start=since, newest_first=True, limit=20)
     conn.close()
     
-    data = []
-    for row in rows:
-        data.append({
-            "timestamp": row[2],
-            "voltage": {"A": row[3], "B": row[4], "C": row[5]},
-            "current": {"A": row[6], "B": row[7], "C": row[8]},
-            "active_power": {"A": row[9], "B": row[10], "C": row[11]},
-            "reactive_power": {"A": row[12], "B": row[13], "C": row[14]},
-            "frequency": row[15]
-        })
-    
-    return jsonify(data)
+    body, headers = chart_body(rows, _RECENT_PATHS, "q" + "f" * (len(_RECENT_PATHS) - 1), fmt)
+    response = Response(body, headers=headers)
+    response.vary.add("Accept-Encoding")
+    return response
+
+_RAW_PATHS = [("timestamp",)] + [(metric,) if phase is None else (metric, phase) for metric, phase in RAW_COLUMN_KEYS]
+
+@app.route("/api/tubewell/<int:id>/raw")
+def api_tubewell_raw(id):
+    """Raw samples over an arbitrary range, downsampled to ?max_points= for charting (0 for every sample)"""
+    if id not in tubewells:
+        return jsonify({"error": "Invalid tubewell"}), 404
+    try:
+        start, end = parse_range()
+        max_points, mode, series = downsample_args(RAW_RANGE_MAX_POINTS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    fmt = request.args.get('format', 'rows')
+    if fmt not in CHART_FORMATS:
+        return jsonify({"error": f"Unknown format. Use one of {list(CHART_FORMATS)}"}), 400
+
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        if max_points:
+            rows = downsample_raw(conn, raw_partitions, id, start, end, max_points, mode, series)
+        else:
+            rows = raw_partitions.select(conn, f'''
+                SELECT ts, {", ".join(RAW_COLUMNS)} FROM {{table}}
+                WHERE tubewell_id = ? AND ts >= ? AND ts < ? ORDER BY ts
+            ''', (id, start, end), start=start, end=end)
+    finally:
+        conn.close()
+
+    body, headers = chart_body(rows, _RAW_PATHS, "q" + "f" * len(RAW_COLUMNS), fmt)
+    response = Response(body, headers=headers)
+    response.vary.add("Accept-Encoding")
+    return response
 
 @app.route("/api/tubewell/<int:id>/aggregated")
 def api_tubewell_aggregated(id):
-    """Get 15-minute aggregated data for big charts"""
-    date_str = request.args.get('date')
-    if date_str:
-        # Specific date requested
+    """Get aggregated data for big charts at the coarsest resolution that fits the range"""
+    try:
+        # A whole ?date=, or an arbitrary range defaulting to the last 24 hours
+        start, end = parse_range()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    resolution = request.args.get('resolution')
+    if not resolution:
+        min_points = request.args.get('min_points', MIN_CHART_POINTS, type=int)
+        resolution = choose_resolution(start, end, min_points)
+    elif resolution not in RESOLUTION_MS:
+        return jsonify({"error": f"Unknown resolution. Use one of {list(RESOLUTION_MS)}"}), 400
+    try:
+        downsample = downsample_args(default_points=0)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if downsample[0] and (end - start) // RESOLUTION_MS[resolution] <= downsample[0]:
+        downsample = (0, None, None)  # Already few enough buckets
+    # Downsampled rows carry one value per series, shaped like stats=avg
+    stats = ROLLUP_STATS if request.args.get('stats') == 'all' and not downsample[0] else ("avg",)
+    fmt = request.args.get('format', 'rows')
+    if fmt not in CHART_FORMATS:
+        return jsonify({"error": f"Unknown format. Use one of {list(CHART_FORMATS)}"}), 400
+
+    # Final once the last bucket touched by the range lies before the watermark
+    watermark = aggregated_cache.watermark
+    res_ms = RESOLUTION_MS[resolution]
+    final = end + (-end % res_ms) <= watermark
+    gzip_ok = request.accept_encodings["gzip"] > 0
+    key = (id, start, end, resolution, stats, downsample, fmt, gzip_ok, None if final else watermark)
+    # A default range ends "now" and would never be asked for again
+    cacheable = final or request.args.get('date') or request.args.get('to')
+    entry = aggregated_cache.get(key) if cacheable else None
+    if entry is None:
+        conn = sqlite3.connect(DB_FILE)
         try:
-            target_date = datetime.strptime(date_str, '%Y-%m-%d')
-            start_time = target_date
-            end_time = target_date + timedelta(days=1)
-        except ValueError:
-            return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
+            if downsample[0]:
+                rows = downsample_rollups(conn, id, resolution, start, end, *downsample)
+            else:
+                rows = query_rollups(conn, id, resolution, start, end, stats)
+        finally:
+            conn.close()
+        paths = _aggregated_paths(stats)
+        body, headers = chart_body(rows, paths, "qq" + "f" * (len(paths) - 2), fmt)
+        entry = aggregated_cache.put(key, body, final, headers) if cacheable else (body, None, headers)
+        cache_status = "MISS"
     else:
-        # Default to last 24 hours
-        end_time = datetime.utcnow()
-        start_time = end_time - timedelta(days=1)
-    
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    c.execute('''
-        SELECT * FROM aggregated_data 
-        WHERE tubewell_id = ? AND bucket_start BETWEEN ? AND ?
-        ORDER BY bucket_start
-    ''', (id, start_time, end_time))
-    
-    rows = c.fetchall()
-    conn.close()
-    
-    data = []
-    for row in rows:
-        data.append({
-            "timestamp": row[2],
-            "voltage": {"A": row[3], "B": row[4], "C": row[5]},
-            "current": {"A": row[6], "B": row[7], "C": row[8]},
-            "active_power": {"A": row[9], "B": row[10], "C": row[11]},
-            "reactive_power": {"A": row[12], "B": row[13], "C": row[14]},
-            "frequency": row[15],
-            "data_points": row[16]
-        })
-    
-    return jsonify(data)
+        cache_status = "HIT"
+    body, etag, headers = entry
+
+    if etag is not None and request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, headers=headers)
+    if etag is not None:
+        response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = f"public, max-age={CLOSED_RANGE_MAX_AGE}, immutable" if final else "no-cache"
+    response.headers["X-Resolution"] = resolution
+    response.headers["X-Cache"] = cache_status
+    return response
+
+@app.route("/metrics")
+@ingest_only
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/debug/ingest")
+@ingest_only
+def api_debug_ingest():
+    """Queue depth, drops and stage latency of the ingest pipeline and the raw writer"""
+    return jsonify({
+        "pipeline": ingest_pipeline.stats(),
+        "writer": {
+            "pending": db_writer.pending,
+            "rows_written": db_writer.rows_written,
+            "batches_written": db_writer.batches_written,
+            "last_batch_size": db_writer.last_batch_size,
+            "last_flush_ms": round(db_writer.last_flush_seconds * 1000, 3),
+            "errors": db_writer.errors,
+            "rows_dropped": db_writer.rows_dropped,
+        },
+    })
 
 @app.route("/api/debug/data-flow")
 def api_debug_data_flow():
     """Debug endpoint to check data flow for device-1"""
-    tubewell_id = 0  # device-1 maps to tubewell 0
-    tw = tubewells[tubewell_id]
+    tubewell_id = device_registry.lookup("device-1")
+    if tubewell_id is None:
+        return jsonify({"error": "device-1 is not registered"}), 404
+    tw = tubewells.peek(tubewell_id)
     
     return jsonify({
         "tubewell_id": tubewell_id,
-        "device_mapping": "device-1 -> tubewell 0",
-        "status": "ON" if tw["status"] else "OFF",
+        "device_mapping": f"device-1 -> tubewell {tubewell_id}",
+        "status": "ON" if tw.status else "OFF",
         "current_data": {
-            "voltage": tw["voltage"],
-            "current": tw["current"], 
-            "active_power": tw["active_power"],
-            "reactive_power": tw["reactive_power"],
-            "frequency": tw["frequency"]
+            "voltage": tw.phases("voltage"),
+            "current": tw.phases("current"), 
+            "active_power": tw.phases("active_power"),
+            "reactive_power": tw.phases("reactive_power"),
+            "frequency": tw.frequency
         },
         "has_mqtt_data": any([
-            tw["voltage"]["A"] > 0,
-            tw["current"]["A"] > 0,
-            tw["active_power"]["A"] > 0
+            tw.voltage[0] > 0,
+            tw.current[0] > 0,
+            tw.active_power[0] > 0
         ]),
-        "last_update": tw["history"][-1]["timestamp"] if tw["history"] else "Never"
+        "last_update": tw.updated_ms if tw.updated_ms is not None else "Never"
+    })
+
+@app.route("/api/export")
+@login_required
+def api_export():
+    """Stream raw samples for ?ids= (default all) over ?from=&to= as csv or columnar, gzipped unless ?compression=none"""
+    try:
+        id_list = parse_ids()
+        start, end = parse_range()
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    metric_names = request.args.get('metrics')
+    try:
+        columns = export_columns([m.strip() for m in metric_names.split(',') if m.strip()] if metric_names else None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    fmt = request.args.get('format', 'csv')
+    compression = request.args.get('compression', 'gzip')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unknown format. Use one of {list(EXPORT_FORMATS)}"}), 400
+    if compression not in EXPORT_COMPRESSION:
+        return jsonify({"error": f"Unknown compression. Use one of {list(EXPORT_COMPRESSION)}"}), 400
+
+    print(f"[EXPORT] {current_user.username}: ids={id_list or 'all'} {start}..{end} {fmt}/{compression}")
+    filename = export_filename(start, end, fmt, compression)
+    return Response(
+        export_stream(DB_FILE, raw_partitions, id_list, start, end, columns, fmt, compression),
+        mimetype="application/gzip" if compression == "gzip" else EXPORT_MIMETYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+@app.route("/api/energy")
+@ingest_only  # "today so far" includes the open bucket, which only the ingest process's integrator holds
+def api_energy():
+    """kWh / kVARh per phase over a range, from the integrated energy counters (default: today so far)"""
+    try:
+        id_list = parse_ids()
+        start, end = parse_range(default_span=None)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        energy = energy_integrator.energy_between(conn, start, end, id_list)
+    finally:
+        conn.close()
+
+    tubewells_energy = {}
+    for tw_id, totals in sorted(energy.items()):
+        active = dict(zip(PHASES, (round(v, 4) for v in totals[:3])))
+        reactive = dict(zip(PHASES, (round(v, 4) for v in totals[3:])))
+        active["total"] = round(sum(totals[:3]), 4)
+        reactive["total"] = round(sum(totals[3:]), 4)
+        tubewells_energy[tw_id] = {"active_kwh": active, "reactive_kvarh": reactive}
+    return jsonify({"from": start, "to": end, "tubewells": tubewells_energy})
+
+def _session_dict(session):
+    return {"id": session.tubewell_id, "start": session.start_ms, "end": session.end_ms, "last": session.last_ms}
+
+@app.route("/api/sessions")
+def api_sessions():
+    """Run sessions overlapping a range (default: last 24 hours); open sessions have "end": null"""
+    try:
+        id_list = parse_ids()
+        start, end = parse_range()
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        sessions = sessions_between(conn, start, end, id_list)
+    finally:
+        conn.close()
+    return jsonify({"from": start, "to": end, "sessions": [_session_dict(s) for s in sessions]})
+
+@app.route("/api/sessions/running")
+def api_sessions_running():
+    """Tubewells running right now, with the start of their session"""
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        sessions = running_sessions(conn)
+    finally:
+        conn.close()
+    return jsonify([_session_dict(s) for s in sessions])
+
+@app.route("/api/sessions/daily")
+def api_sessions_daily():
+    """Runtime in seconds per tubewell per UTC day (default: last 7 days)"""
+    now = now_ms()
+    try:
+        id_list = parse_ids()
+        start, end = parse_range(7 * DAY_MS)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        daily = runtime_by_day(conn, start, end, now, id_list)
+    finally:
+        conn.close()
+    return jsonify({
+        str(tw_id): [{"day": datetime.fromtimestamp(day / 1000, timezone.utc).strftime('%Y-%m-%d'), "runtime": round(seconds)}
+                     for day, seconds in sorted(days.items())]
+        for tw_id, days in sorted(daily.items())
     })
 
 @app.route('/api/comparison')
 def api_comparison():
-    ids = request.args.get('ids', '')
-    id_list = [i.strip() for i in ids.split(',') if i.strip()]
-    from_date = request.args.get('from')
-    to_date = request.args.get('to')
+    """Rollup series of several tubewells on one shared time grid, as columnar arrays"""
+    try:
+        id_list = parse_ids() or []
+        start, end = parse_range()
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    resolution = request.args.get('resolution')
+    if not resolution:
+        min_points = request.args.get('min_points', MIN_CHART_POINTS, type=int)
+        resolution = choose_resolution(start, end, min_points)
+    elif resolution not in RESOLUTION_MS:
+        return jsonify({"error": f"Unknown resolution. Use one of {list(RESOLUTION_MS)}"}), 400
+    metric_names = request.args.get('metrics')
+    metric_names = [m.strip() for m in metric_names.split(',')] if metric_names else COMPARISON_METRICS
+    if set(metric_names) - set(COMPARISON_METRICS):
+        return jsonify({"error": f"Unknown metrics. Use any of {list(COMPARISON_METRICS)}"}), 400
 
-    # Optional: parse date range
+    conn = sqlite3.connect(DB_FILE)
     try:
-        from_dt = datetime.strptime(from_date, "%Y-%m-%d") if from_date else datetime.now() - timedelta(days=1)
-        to_dt = datetime.strptime(to_date, "%Y-%m-%d") if to_date else datetime.now()
-    except Exception:
-        from_dt = datetime.now() - timedelta(days=1)
-        to_dt = datetime.now()
-
-    # --- Mock data ---
-    tubewells_data = {}
-    for tw_id in id_list:
-        name = str(tw_id)
-        metrics = {
-            "voltage": [{"time": (from_dt + timedelta(hours=i)).isoformat(), "value": {"A": random.uniform(210, 230), "B": random.uniform(210, 230), "C": random.uniform(210, 230)}} for i in range(24)],
-            "current": [{"time": (from_dt + timedelta(hours=i)).isoformat(), "value": {"A": random.uniform(10, 20), "B": random.uniform(10, 20), "C": random.uniform(10, 20)}} for i in range(24)],
-            "active_power": [{"time": (from_dt + timedelta(hours=i)).isoformat(), "value": random.uniform(2000, 4000)} for i in range(24)],
-            "reactive_power": [{"time": (from_dt + timedelta(hours=i)).isoformat(), "value": random.uniform(500, 1000)} for i in range(24)],
-            "power_factor": [{"time": (from_dt + timedelta(hours=i)).isoformat(), "value": random.uniform(0.85, 0.95)} for i in range(24)]
-        }
-
-        tubewells_data[tw_id] = {
-            "id": tw_id,
-            "name": name,
-            "metrics": metrics,
-            "available_start": from_dt.isoformat(),
-            "available_end": to_dt.isoformat(),
-            "total_energy": round(random.uniform(100, 300), 2)
-        }
-
-    response = {
-        "tubewells": tubewells_data,
-        "available_start": from_dt.isoformat(),
-        "available_end": to_dt.isoformat(),
-        "labels": [(from_dt + timedelta(hours=i)).isoformat() for i in range(24)]
-    }
-
-    return jsonify(response)
+        result = compare_tubewells(conn, id_list, start, end, resolution, metric_names,
+                                   stat=request.args.get('stat', 'avg'), fill=request.args.get('fill', 'null'))
+        # Served by web workers too, which have no live integrator: energy up to the last checkpoint
+        energy = stored_energy_between(conn, start, end, id_list)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    finally:
+        conn.close()
+
+    # The page shows Wh / VARh
+    for tw_id, tw in result["tubewells"].items():
+        tw["id"] = tw_id
+        tw["name"] = device_registry.get(tw_id).name
+        tw["total_active_energy"] = round(sum(energy[tw_id][:3]) * 1000, 2)
+        tw["total_reactive_energy"] = round(sum(energy[tw_id][3:]) * 1000, 2)
+    starts = [tw["available_start"] for tw in result["tubewells"].values() if tw["available_start"] is not None]
+    ends = [tw["available_end"] for tw in result["tubewells"].values() if tw["available_end"] is not None]
+    result.update({
+        "resolution": resolution,
+        "from": start,
+        "to": end,
+        "available_start": min(starts, default=None),
+        "available_end": max(ends, default=None),
+    })
+    return jsonify(result)
 
 
 # Main
 
+# -----------------------------
+# Application lifecycle
+# -----------------------------
+# Importing this module only defines things. create_app(config) applies
+# settings; start() opens the database, restores state and starts the writer,
+# ingest workers, background loops and the MQTT client, exactly once; stop()
+# shuts all of it down in dependency order and is also run at exit. A WSGI
+# server that serves ``app:app`` or ``app:create_app()`` gets start() on the
+# first request, but should call it at worker boot so ingest starts at once.
+MQTT_ENABLED = True  # False runs without a broker connection (tests, tools)
+
+# Module settings create_app() may override; anything else goes to app.config
+CONFIG_KEYS = (
+    "DB_FILE", "DB_FLUSH_MAX_ROWS", "DB_FLUSH_MAX_LATENCY", "RAW_PARTITION_DAYS", "RAW_RETENTION_DAYS",
+    "HISTORY_FILE", "HISTORY_JOURNAL_FILE", "HISTORY_COMPACT_INTERVAL", "HISTORY_COMPACT_BYTES",
+    "MQTT_ENABLED", "MQTT_BROKER", "MQTT_PORT", "MQTT_TOPIC_SUB", "MQTT_TOPIC_PUB",
+    "INGEST_WORKERS", "INGEST_QUEUE_SIZE", "INGEST_OVERFLOW", "AGGREGATION_INTERVAL",
+    "DEVICE_IDLE_SECONDS", "DEVICE_EVICT_INTERVAL", "AUTO_REGISTER_DEVICES",
+    "SESSION_SWEEP_INTERVAL", "COMMAND_SWEEP_INTERVAL", "ALERT_RULES_FILE",
+    "SERVER_ROLE", "SHARED_STATE_FILE", "SHARED_STATE_SLOTS", "SHARED_STATE_POLL_INTERVAL",
+)
+
+_lifecycle_lock = threading.RLock()
+_lifecycle = "new"  # -> "started" -> "stopped"
+_stopping = threading.Event()  # wakes the background loops on stop()
+_background_threads = []  # see start_background_loop()
+BACKGROUND_JOIN_TIMEOUT = 30  # seconds; an aggregation run may be waiting for ingest to drain
+
+def create_app(config=None):
+    """Apply ``config`` and return the Flask app; nothing is opened or started yet."""
+    with _lifecycle_lock:
+        if _lifecycle != "new" or device_registry is not None:
+            raise RuntimeError("create_app() must be called before the app is started")
+        for key, value in (config or {}).items():
+            if key in CONFIG_KEYS:
+                globals()[key] = value
+            else:
+                app.config[key] = value
+    return app
+
+def init_storage():
+    """Create the schema and load the registry and persisted state; runs once."""
+    global db_writer, raw_partitions, history_journal, alert_engine, tubewells, history_data, device_registry
+    with _lifecycle_lock:
+        if device_registry is not None:
+            return
+        init_db()
+        registry = DeviceRegistry(DB_FILE)
+        registry.seed(DEFAULT_DEVICES)
+        raw_partitions = RawPartitions(DB_FILE, RAW_PARTITION_DAYS)
+        db_writer = BatchWriter(DB_FILE, max_batch=DB_FLUSH_MAX_ROWS, max_latency=DB_FLUSH_MAX_LATENCY,
+                                name="raw_writer", on_batch=_observe_raw_batch)
+        history_journal = HistoryJournal(HISTORY_JOURNAL_FILE)
+        alert_engine = AlertEngine(load_alert_rules(), on_change=record_alert)
+        conn = open_wal_connection(DB_FILE)
+        try:
+            print(f"[ENERGY] Restored integrator state for {energy_integrator.restore(conn)} devices")
+            print(f"[SESSIONS] Restored {session_tracker.restore(conn)} open sessions")
+            print(f"[ALERTS] Resumed {alert_engine.restore(conn)} open alerts")
+            aggregated_cache.advance(rollup_watermark(conn))
+        finally:
+            conn.close()
+        tubewells = LazyStates(registry, _new_tubewell_state, DEVICE_IDLE_SECONDS, on_update=publish_shared_state)
+        history_data = LazyStates(registry, lambda device: _new_history_ring(), DEVICE_IDLE_SECONDS)
+        device_registry = registry  # Set last: storage is ready
+
+def init_web_worker():
+    """Map the ingest process's shared state table and open what the read-only routes need."""
+    global shared_state, raw_partitions, alert_engine, tubewells, device_registry
+    if not os.path.exists(SHARED_STATE_FILE):
+        raise RuntimeError(f"{SHARED_STATE_FILE} does not exist; start the ingest process first")
+    shared_state = SharedStateTable(SHARED_STATE_FILE)
+    raw_partitions = RawPartitions(DB_FILE, RAW_PARTITION_DAYS)
+    alert_engine = AlertEngine(load_alert_rules())  # For /api/alerts/rules; nothing is evaluated here
+    aggregated_cache.advance(shared_state.watermark)
+    tubewells = SharedStates(shared_state)
+    device_registry = DeviceRegistry(DB_FILE)
+    print(f"[APP] Web worker {os.getpid()} serving live state from {SHARED_STATE_FILE}")
+
+def start():
+    """Bring every subsystem of this process's SERVER_ROLE up once; later calls return immediately."""
+    global _lifecycle, ingest_pipeline, shared_state
+    with _lifecycle_lock:
+        if _lifecycle == "started":
+            return app
+        if _lifecycle == "stopped":
+            raise RuntimeError("The app was stopped; start a new process instead")
+        if SERVER_ROLE not in SERVER_ROLES:
+            raise ValueError(f"SERVER_ROLE must be one of {SERVER_ROLES}, got {SERVER_ROLE!r}")
+        if SERVER_ROLE == "web":
+            init_web_worker()
+            start_shared_state_follower()
+            atexit.register(stop)
+            _lifecycle = "started"
+            return app
+
+        init_storage()
+        load_history()
+        if SERVER_ROLE == "ingest":
+            slots = max(SHARED_STATE_SLOTS, max(device_registry, default=-1) + 1)
+            shared_state = SharedStateTable(SHARED_STATE_FILE, slots, writer=True)
+            shared_state.set_watermark(aggregated_cache.watermark)
+            for tubewell_id, state in tubewells.all_items():
+                publish_shared_state(tubewell_id, state)
+            print(f"[APP] Publishing live state to {SHARED_STATE_FILE} for web workers")
+        db_writer.start()
+        ingest_pipeline = IngestPipeline(handle_mqtt_message, workers=INGEST_WORKERS, max_queue=INGEST_QUEUE_SIZE,
+                                         overflow=INGEST_OVERFLOW, name="ingest")
+        ingest_pipeline.start()
+        threading.Thread(target=save_worker, name="history_saver", daemon=True).start()
+        start_periodic_saver(HISTORY_COMPACT_INTERVAL)
+        start_periodic_aggregation()
+        start_device_eviction()
+        start_session_sweeper()
+        start_command_sweeper()
+        if MQTT_ENABLED:
+            start_mqtt()
+        atexit.register(stop)
+        _lifecycle = "started"
+        print(f"[APP] Started with {len(device_registry)} devices registered")
+    return app
+
+def stop():
+    """Stop taking messages, finish the background loops, drain ingest, persist state and history, flush the writer."""
+    global _lifecycle
+    with _lifecycle_lock:
+        if _lifecycle != "started":
+            return
+        _lifecycle = "stopped"
+        if SERVER_ROLE != "web" and MQTT_ENABLED:
+            client.loop_stop()
+            client.disconnect()
+        # Every loop may still be using ingest or the writer; let each finish its current pass
+        _stopping.set()
+        deadline = time.monotonic() + BACKGROUND_JOIN_TIMEOUT
+        for t in _background_threads:
+            t.join(max(0, deadline - time.monotonic()))
+            if t.is_alive():
+                print(f"[APP] Background loop {t.name} did not stop in time")
+        if SERVER_ROLE == "web":
+            return
+        ingest_pipeline.stop()
+        try:
+            checkpoint_energy()
+            checkpoint_sessions()
+        except Exception as e:
+            print(f"[APP] Checkpoint on shutdown failed: {e}")
+        save_queue.join()  # The history saver has journaled every queued point
+        save_history()
+        history_journal.close()
+        db_writer.stop()
+        print("[APP] Stopped")
+
+@app.before_request
+def _ensure_started():
+    if _lifecycle == "new":
+        start()
+
 if __name__ == "__main__":
-    load_history()
-    init_db()  # Ensure database is initialized
-    threading.Thread(target=save_worker, daemon=True).start()
-    start_periodic_saver(60)
-    start_periodic_aggregation()  # Start the aggregation thread
-   
-    print("\n" + "="*60)
-    print(" STARTING TUBEWELL MONITORING SYSTEM")
-    print("="*60)
-    
-    # Connect to MQTT broker
-    print("Connecting to MQTT broker...")
-    try:
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        print(f" Connected to {MQTT_BROKER}:{MQTT_PORT}")
-    except Exception as e:
-        print(f" MQTT connection failed: {e}")
-    
-    # Start MQTT loop in background thread
-    print(" Starting MQTT message loop...")
-    mqtt_thread = threading.Thread(target=client.loop_start, daemon=True)
-    mqtt_thread.start()
-    print(" MQTT client started and listening for messages")
-    
-    print(f" Subscribed to: {MQTT_TOPIC_SUB}")
-    print(f" Publishing to: {MQTT_TOPIC_PUB}")
-    print(f" Device mapping: {len(device_to_tubewell)} devices configured")
-    print("="*60 + "\n")
-    
+    # python app.py [all | ingest]; web workers run under a WSGI server, see SERVER_ROLE
+    create_app({"SERVER_ROLE": sys.argv[1] if len(sys.argv) > 1 else "all"})
+    # The debug reloader runs this file in a watcher process as well; only the serving child starts services
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        print("\n" + "="*60)
+        print(" STARTING TUBEWELL MONITORING SYSTEM")
+        print("="*60)
+        start()
+
     # Start Flask app
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
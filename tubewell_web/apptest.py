@@ -0,0 +1,93 @@
+"""One started app per test process, for the tests that go through app.py.
+
+The app can only be started once per process, so every test module shares
+the instance ``started_app`` brings up, with its files in a temporary
+directory and MQTT disabled. Messages are fed to ``handle_mqtt_message`` the
+way the ingest workers would.
+"""
+import atexit
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+
+import app as appmod
+from db_writer import open_wal_connection
+from test_frame_decoder import build_frame
+
+WORK_DIR = tempfile.mkdtemp(prefix="tubewell_test_")
+
+CONFIG = {
+    "DB_FILE": os.path.join(WORK_DIR, "tubewell_data.db"),
+    "HISTORY_FILE": os.path.join(WORK_DIR, "history.json"),
+    "HISTORY_JOURNAL_FILE": os.path.join(WORK_DIR, "history.journal"),
+    "ALERT_RULES_FILE": os.path.join(WORK_DIR, "alert_rules.json"),
+    "SHARED_STATE_FILE": os.path.join(WORK_DIR, "tubewell_live.state"),
+    "MQTT_ENABLED": False,
+    # The tests drive aggregation and eviction themselves
+    "AGGREGATION_INTERVAL": 3600,
+    "DEVICE_EVICT_INTERVAL": 3600,
+    "TESTING": True,
+}
+
+
+def quiet(fn, *args, **kwargs):
+    """Call ``fn`` without its console logging."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def _stop():
+    quiet(appmod.stop)
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+def started_app():
+    """The app module, started on the first call."""
+    if appmod._lifecycle == "new":
+        quiet(appmod.create_app, CONFIG)
+        quiet(appmod.start)
+        atexit.register(_stop)
+    return appmod
+
+
+def frame(current=4.0, voltage=230.0, power=0.9, frequency=50.0):
+    """Hex frame with the same values on every phase."""
+    values = {}
+    for phase in ("A", "B", "C"):
+        values.update({("voltage", phase): voltage, ("current", phase): current,
+                       ("active_power", phase): power, ("reactive_power", phase): power / 4,
+                       ("power_factor", phase): 0.95})
+    values[("frequency", None)] = frequency
+    return build_frame(values).hex()
+
+
+def message(dev_id, received_ms, **values):
+    """An item for ``handle_mqtt_message``, as ``on_message`` queues it."""
+    payload = json.dumps({"devId": dev_id, "data": frame(**values)}).encode()
+    return received_ms, appmod.MQTT_TOPIC_SUB, payload
+
+
+def ingest(dev_id, received_ms, **values):
+    """Apply one frame synchronously and wait until its sample is committed."""
+    quiet(appmod.handle_mqtt_message, message(dev_id, received_ms, **values))
+    appmod.db_writer.flush(timeout=10)
+
+
+def logged_in_client():
+    client = started_app().app.test_client()
+    client.post("/login", data={"username": "admin", "password": "123"})
+    return client
+
+
+def raw_rows(tubewell_id, start=0, end=2 ** 62):
+    """(ts, current_a) of the stored raw samples of ``tubewell_id``."""
+    conn = open_wal_connection(appmod.DB_FILE)
+    try:
+        return appmod.raw_partitions.select(
+            conn, "SELECT ts, current_a FROM {table} WHERE tubewell_id = ? AND ts >= ? AND ts < ? ORDER BY ts",
+            (tubewell_id, start, end), start, end)
+    finally:
+        conn.close()
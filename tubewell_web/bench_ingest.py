@@ -0,0 +1,377 @@
+"""End-to-end ingest benchmark.
+
+Simulates a fleet of PLCs publishing meter frames (same layout as pub.py)
+into an in-process copy of the app, and reports sustained throughput,
+receipt-to-commit latency, CPU and memory. Nothing touches the network: the
+MQTT client is wired to a local broker stand-in and the database lives in a
+scratch directory.
+
+    python bench_ingest.py --devices 30,1000,10000 --rate 1 --duration 30
+    python bench_ingest.py --devices 1000 --save-baseline bench_baseline.json
+    python bench_ingest.py --devices 1000 --baseline bench_baseline.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import queue
+import random
+import resource
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from frame_decoder import DEFAULT_REGISTER_MAP
+
+FRAME_SIZE = 200
+
+# Statements writing raw samples, see partitions.RawPartitions.insert_sql
+RAW_INSERT_PREFIX = "INSERT INTO raw_data_"
+
+# Value ranges per metric, as generated by pub.py
+VALUE_RANGES = {
+    "voltage": (210, 230),
+    "current": (1, 5),
+    "active_power": (0.5, 2.0),
+    "reactive_power": (0.1, 1.0),
+    "power_factor": (0.8, 1.0),
+    "frequency": (49.5, 50.5),
+}
+
+# Metrics compared against a baseline: (key, higher is better)
+BASELINE_METRICS = (
+    ("ingest_rate", True),
+    ("commit_rate", True),
+    ("latency_p50_ms", False),
+    ("latency_p99_ms", False),
+    ("cpu_percent", False),
+    ("rss_mb", False),
+)
+
+
+# -----------------------------
+# Load generation
+# -----------------------------
+def build_frame(rng, register_map=DEFAULT_REGISTER_MAP):
+    """Random meter frame (hex) laid out like the PLC frames the app decodes."""
+    buf = bytearray(FRAME_SIZE)
+    for reg in register_map:
+        low, high = VALUE_RANGES.get(reg.metric, (0, 1))
+        struct.pack_into(">" + reg.fmt, buf, reg.offset, round(rng.uniform(low, high), 2) / reg.scale)
+    return buf.hex().upper()
+
+
+class LocalBroker:
+    """In-process MQTT broker stand-in.
+
+    Messages are delivered one at a time to the client's ``on_message`` from
+    a single thread, like paho's network loop, so a slow callback shows up as
+    a growing ``backlog`` exactly as it would stall a real broker session.
+    """
+
+    def __init__(self):
+        self.client = None
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def install(self):
+        """Route every paho Client created from now on to this broker."""
+        broker = self
+
+        def connect(client, *args, **kwargs):
+            broker.client = client
+            return 0
+
+        mqtt.Client.connect = connect
+        mqtt.Client.loop_start = lambda client, *args, **kwargs: broker.start()
+        mqtt.Client.publish = lambda client, topic, payload=None, *args, **kwargs: None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="local_broker", daemon=True)
+            self._thread.start()
+
+    @property
+    def backlog(self):
+        return self._queue.qsize()
+
+    def publish(self, topic, payload):
+        self._queue.put((topic, payload))
+
+    def _run(self):
+        while True:
+            topic, payload = self._queue.get()
+            msg = mqtt.MQTTMessage(topic=topic.encode())
+            msg.payload = payload
+            self.client.on_message(self.client, None, msg)
+
+
+def generate_load(send, devices, rate, duration, frames):
+    """Offer ``devices * rate`` messages per second for ``duration`` seconds.
+
+    Returns (messages sent, seconds taken). Devices are visited round-robin and
+    each visit uses the next frame variant, so consecutive values differ.
+    """
+    total_rate = devices * rate
+    variants = len(frames)
+    sent = 0
+    started = time.perf_counter()
+    while True:
+        elapsed = time.perf_counter() - started
+        if elapsed >= duration:
+            break
+        due = min(int(elapsed * total_rate) + 1, int(duration * total_rate))
+        while sent < due:
+            device = sent % devices
+            frame = frames[(sent // devices + device) % variants]
+            send(b'{"devId": "device-%d", "data": "%s"}' % (device + 1, frame))
+            sent += 1
+        time.sleep(0.005)
+    return sent, time.perf_counter() - started
+
+
+# -----------------------------
+# App under test
+# -----------------------------
+def load_app(workdir):
+    """Import app.py with its files in ``workdir`` and MQTT wired to a LocalBroker."""
+    broker = LocalBroker()
+    broker.install()
+    os.chdir(workdir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as appmod
+        appmod.create_app()
+        appmod.start()
+    return appmod, broker
+
+
+def register_devices(appmod, count):
+    """Make sure device-1 .. device-<count> are in the registry before load starts."""
+    registry = appmod.device_registry
+    for i in range(count):
+        if registry.lookup(f"device-{i+1}") is None:
+            registry.register(f"device-{i+1}")
+
+
+class CommitLatency:
+    """Hooks the raw writer and records receipt-to-commit latency of every raw sample row.
+
+    ``rows`` counts the raw inserts the writer committed, not what was
+    stored; a failed insert is dropped by the writer. ``stored_rows`` counts
+    the samples actually in the database.
+    """
+
+    def __init__(self, writer):
+        self.samples = []
+        self.rows = 0
+        self._writer = writer
+        self._chained = writer.on_batch
+        writer.on_batch = self._on_batch
+
+    def _on_batch(self, batch, seconds):
+        if self._chained is not None:
+            self._chained(batch, seconds)
+        committed = time.time() * 1000
+        # Raw sample rows only; energy counters and sessions share the writer but are keyed differently
+        received = [params[1] for sql, params in batch if sql.startswith(RAW_INSERT_PREFIX)]
+        self.samples.extend(committed - ts for ts in received)
+        self.rows += len(received)
+
+    def reset(self):
+        self.samples = []
+        self.rows = 0
+
+
+def stored_rows(appmod, since_ms):
+    """Raw samples in the database with a timestamp at or after ``since_ms``."""
+    conn = appmod.open_wal_connection(appmod.DB_FILE)
+    try:
+        counts = appmod.raw_partitions.select(conn, "SELECT COUNT(*) FROM {table} WHERE ts >= ?", (since_ms,), since_ms)
+    finally:
+        conn.close()
+    return sum(count for count, in counts)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def wait_for_drain(appmod, broker, expected, timeout):
+    """Wait until every sent message was delivered, handled (or dropped) and committed."""
+    pipeline = appmod.ingest_pipeline
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if broker.backlog == 0 and pipeline.processed + pipeline.dropped >= expected:
+            break
+        time.sleep(0.01)
+    else:
+        return False
+    return appmod.db_writer.flush(max(0, deadline - time.monotonic()))
+
+
+def run_scenario(appmod, broker, latency, devices, rate, duration, mode, drain_timeout, seed):
+    register_devices(appmod, devices)
+    rng = random.Random(seed)
+    frames = [build_frame(rng).encode() for _ in range(16)]
+
+    if mode == "broker":
+        def send(payload):
+            broker.publish(appmod.MQTT_TOPIC_SUB, payload)
+    else:
+        topic = appmod.MQTT_TOPIC_SUB.encode()
+
+        def send(payload):
+            msg = mqtt.MQTTMessage(topic=topic)
+            msg.payload = payload
+            appmod.on_message(appmod.client, None, msg)
+
+    pipeline = appmod.ingest_pipeline
+    base_processed = pipeline.processed
+    base_dropped = pipeline.dropped
+    latency.reset()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_before = usage.ru_utime + usage.ru_stime
+    started = time.perf_counter()
+    started_ms = int(time.time() * 1000)
+
+    sent, offered_seconds = generate_load(send, devices, rate, duration, frames)
+    drained = wait_for_drain(appmod, broker, base_processed + base_dropped + sent, drain_timeout)
+
+    elapsed = time.perf_counter() - started
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    processed = pipeline.processed - base_processed
+    stored = stored_rows(appmod, started_ms)
+    return {
+        "mode": mode,
+        "devices": devices,
+        "rate_per_device": rate,
+        "duration": duration,
+        "sent": sent,
+        "offered_rate": round(sent / offered_seconds, 1),
+        "processed": processed,
+        "dropped": pipeline.dropped - base_dropped,
+        "committed": stored,
+        "lost": max(0, processed - stored),
+        "drained": drained,
+        "ingest_rate": round(processed / elapsed, 1),
+        "commit_rate": round(stored / elapsed, 1),
+        "latency_p50_ms": round(percentile(latency.samples, 50), 2),
+        "latency_p99_ms": round(percentile(latency.samples, 99), 2),
+        "latency_max_ms": round(max(latency.samples, default=0), 2),
+        "cpu_percent": round((usage.ru_utime + usage.ru_stime - cpu_before) / elapsed * 100, 1),
+        "rss_mb": round(rss_mb(), 1),
+    }
+
+
+# -----------------------------
+# Reporting
+# -----------------------------
+def scenario_key(result):
+    return f"{result['mode']}-{result['devices']}x{result['rate_per_device']}"
+
+
+def print_result(result):
+    print(f"[BENCH] {scenario_key(result)}: sent {result['sent']} "
+          f"(offered {result['offered_rate']}/s), processed {result['processed']}, "
+          f"dropped {result['dropped']}, committed {result['committed']}"
+          + (f"  ** lost {result['lost']} **" if result["lost"] else "")
+          + ("" if result["drained"] else "  ** did not drain **"))
+    print(f"        ingest {result['ingest_rate']}/s, commit {result['commit_rate']}/s, "
+          f"latency p50 {result['latency_p50_ms']} ms / p99 {result['latency_p99_ms']} ms "
+          f"/ max {result['latency_max_ms']} ms, cpu {result['cpu_percent']}%, rss {result['rss_mb']} MB")
+
+
+def compare(result, baseline, tolerance):
+    """Print the change against ``baseline``; returns the metrics that regressed."""
+    regressions = []
+    for key, higher_is_better in BASELINE_METRICS:
+        old, new = baseline.get(key), result.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = ""
+        if worse > tolerance:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print(f"        {key:<16} {old:>10} -> {new:<10} ({change:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end ingest benchmark")
+    parser.add_argument("--devices", default="30,1000", help="comma separated fleet sizes to run")
+    parser.add_argument("--rate", type=float, default=1.0, help="messages per second per device")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load per scenario")
+    parser.add_argument("--mode", choices=("broker", "direct"), default="broker",
+                        help="deliver through the local broker thread or call on_message directly")
+    parser.add_argument("--drain-timeout", type=float, default=120)
+    parser.add_argument("--workdir", help="directory for the scratch database (default: a new temp dir)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", help="JSON file with stored results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    parser.add_argument("--save-baseline", help="write (merge) this run's results into a JSON file")
+    args = parser.parse_args()
+
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    save_path = os.path.abspath(args.save_baseline) if args.save_baseline else None
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    appmod, broker = load_app(args.workdir or tempfile.mkdtemp(prefix="tubewell_bench_"))
+    latency = CommitLatency(appmod.db_writer)
+
+    baseline = {}
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    for devices in (int(d) for d in args.devices.split(",")):
+        result = run_scenario(appmod, broker, latency, devices, args.rate, args.duration,
+                              args.mode, args.drain_timeout, args.seed)
+        key = scenario_key(result)
+        results[key] = result
+        print_result(result)
+        if result["lost"]:
+            regressions.append(f"{key}:lost")
+        if key in baseline:
+            regressions += [f"{key}:{metric}" for metric in compare(result, baseline[key], args.tolerance)]
+        elif baseline_path:
+            print(f"        (no baseline for {key})")
+
+    if save_path:
+        stored = {}
+        if os.path.exists(save_path):
+            with open(save_path) as f:
+                stored = json.load(f)
+        stored.update(results)
+        with open(save_path, "w") as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+        print(f"[BENCH] Baseline written to {save_path}")
+
+    if regressions:
+        print(f"[BENCH] Regressed beyond {args.tolerance:.0%} or lost samples: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
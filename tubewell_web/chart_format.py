@@ -0,0 +1,95 @@
+import array
+import gzip
+import json
+import math
+import struct
+import sys
+
+# ?format= values understood by the chart endpoints
+CHART_FORMATS = ("rows", "columnar", "binary")
+
+BINARY_MIMETYPE = "application/vnd.tubewell.chart"
+BINARY_MAGIC = b"TWC1"
+
+# Bodies smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+
+_BINARY_TYPES = {"q": "int64", "f": "float32"}
+
+
+def _nest(target, path, value):
+    for key in path[:-1]:
+        target = target.setdefault(key, {})
+    target[path[-1]] = value
+
+
+def encode_rows(rows, paths):
+    """[{"timestamp": .., "voltage": {"A": ..}}, ...]: one object per row, as the charts always got."""
+    data = []
+    for row in rows:
+        item = {}
+        for path, value in zip(paths, row):
+            _nest(item, path, value)
+        data.append(item)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def encode_columnar(rows, paths):
+    """{"timestamp": [..], "voltage": {"A": [..]}, ...}: one array per series, same nesting as a row."""
+    columns = list(zip(*rows)) if rows else [()] * len(paths)
+    data = {}
+    for path, column in zip(paths, columns):
+        _nest(data, path, list(column))
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def encode_binary(rows, paths, typecodes):
+    """Packed little-endian columns behind a small JSON header.
+
+    Layout: b"TWC1", uint32 header length, the header (JSON, space padded
+    to a multiple of 8 bytes), then every column back to back in header
+    order. The header is {"rows": n, "columns": [{"name": "voltage.A",
+    "type": "float32"}, ...]}; int64 columns come first so every column
+    stays aligned for typed-array views. Missing values are NaN (float32)
+    or 0 (int64).
+    """
+    order = sorted(range(len(paths)), key=lambda i: typecodes[i] != "q")
+    columns = list(zip(*rows)) if rows else [()] * len(paths)
+    header = json.dumps({
+        "rows": len(rows),
+        "columns": [{"name": ".".join(paths[i]), "type": _BINARY_TYPES[typecodes[i]]} for i in order],
+    }, separators=(",", ":")).encode()
+    header += b" " * (-(len(BINARY_MAGIC) + 4 + len(header)) % 8)
+    parts = [BINARY_MAGIC, struct.pack("<I", len(header)), header]
+    for i in order:
+        missing = 0 if typecodes[i] == "q" else math.nan
+        packed = array.array(typecodes[i], [missing if v is None else v for v in columns[i]])
+        if sys.byteorder != "little":
+            packed.byteswap()
+        parts.append(packed.tobytes())
+    return b"".join(parts)
+
+
+def encode_chart(rows, paths, typecodes, fmt):
+    """Encode ``rows`` (tuples matching ``paths``) as (body, mimetype) in one of CHART_FORMATS.
+
+    ``paths`` are key tuples such as ("voltage", "A"); ``typecodes`` give
+    the binary type of each column, "q" (int64) or "f" (float32).
+    """
+    if fmt == "columnar":
+        return encode_columnar(rows, paths), "application/json"
+    if fmt == "binary":
+        return encode_binary(rows, paths, typecodes), BINARY_MIMETYPE
+    return encode_rows(rows, paths), "application/json"
+
+
+def choose_encoding(accept_encodings, size):
+    """"gzip" when the client accepts it (werkzeug Accept) and the body is worth compressing, else None."""
+    if size >= COMPRESS_MIN_BYTES and accept_encodings["gzip"] > 0:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    return gzip.compress(body, COMPRESS_LEVEL, mtime=0) if encoding == "gzip" else body
@@ -0,0 +1,225 @@
+import itertools
+import threading
+import time
+from collections import deque, namedtuple
+
+# -----------------------------
+# Modbus RTU frames
+# -----------------------------
+def _crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+
+# Modbus CRC-16 (polynomial 0xA001 reflected), one lookup per byte
+CRC16_TABLE = _crc16_table()
+
+WRITE_SINGLE_REGISTER = 0x06
+EXCEPTION_FLAG = 0x80
+
+# Pump control register of the field PLCs: 1 starts the pump, 2 stops it
+PUMP_REGISTER = 0x0000
+PUMP_VALUES = {"on": 1, "off": 2}
+
+
+def crc16(data):
+    crc = 0xFFFF
+    for byte in data:
+        crc = (crc >> 8) ^ CRC16_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def rtu_frame(slave, function, payload):
+    """slave address + function code + payload + CRC (low byte first)."""
+    body = bytes((slave, function)) + bytes(payload)
+    crc = crc16(body)
+    return body + bytes((crc & 0xFF, crc >> 8))
+
+
+def write_register_frame(slave, register, value):
+    """Function 0x06 request; the slave answers with the same eight bytes."""
+    return rtu_frame(slave, WRITE_SINGLE_REGISTER, register.to_bytes(2, "big") + value.to_bytes(2, "big"))
+
+
+def pump_frame(slave, action):
+    """Hex frame ("03060000000149E8") that switches the pump at ``slave`` "on" or "off"."""
+    return write_register_frame(slave, PUMP_REGISTER, PUMP_VALUES[action]).hex().upper()
+
+
+def parse_rtu(frame):
+    """(slave, function, payload) of a response frame, or None when it is too short or its CRC is wrong."""
+    if len(frame) < 4 or crc16(frame[:-2]) != frame[-2] | frame[-1] << 8:
+        return None
+    return frame[0], frame[1], frame[2:-2]
+
+
+# -----------------------------
+# Dispatch and acknowledgement
+# -----------------------------
+# Without an echo a command is published again this often, up to MAX_RETRIES times
+ACK_TIMEOUT_S = 2.0
+MAX_RETRIES = 2
+
+# Finished commands kept for /api/commands
+COMMAND_HISTORY = 500
+
+# state: pending, acked, failed (exception response), timeout or superseded
+CommandResult = namedtuple("CommandResult", "id tubewell_id dev_id action frame state attempts sent_ms finished_ms latency_ms error")
+
+
+class _Pending:
+    __slots__ = ("id", "tubewell_id", "dev_id", "action", "frame", "slave", "attempts", "sent_ms", "last_sent")
+
+    def __init__(self, command_id, tubewell_id, dev_id, action, frame, sent_ms):
+        self.id = command_id
+        self.tubewell_id = tubewell_id
+        self.dev_id = dev_id
+        self.action = action
+        self.frame = frame
+        self.slave = bytes.fromhex(frame)[0]
+        self.attempts = 1
+        self.sent_ms = sent_ms
+        self.last_sent = time.monotonic()
+
+
+class CommandDispatcher:
+    """Publishes RS485 frames to PLCs and matches their Modbus responses.
+
+    ``publish(dev_id, frame)`` sends one frame and must not wait for the
+    broker, so ``send_many`` puts a whole group on the wire back to back.
+    Each device has at most one outstanding command; a newer one
+    supersedes it. A write is acknowledged by its echo, a response with the
+    exception bit set fails it, and ``sweep`` republishes commands that got
+    neither within ``timeout`` seconds, giving up after ``retries``.
+    Finished commands go to ``on_result(result)`` and a bounded history.
+    """
+
+    def __init__(self, publish, timeout=ACK_TIMEOUT_S, retries=MAX_RETRIES, on_result=None, history=COMMAND_HISTORY):
+        self.publish = publish
+        self.timeout = timeout
+        self.retries = retries
+        self.on_result = on_result
+        self._pending = {}  # dev_id -> _Pending
+        self._history = deque(maxlen=history)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        # Counters exposed for monitoring
+        self.sent = 0
+        self.acked = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.retried = 0
+        self.ack_latency_ms_total = 0
+        self.ack_latency_ms_max = 0
+
+    def _finish(self, pending, state, now_ms, error=None):
+        latency = now_ms - pending.sent_ms if state == "acked" else None
+        result = CommandResult(pending.id, pending.tubewell_id, pending.dev_id, pending.action, pending.frame,
+                               state, pending.attempts, pending.sent_ms, now_ms, latency, error)
+        self._history.append(result)
+        return result
+
+    def _report(self, results):
+        if self.on_result is not None:
+            for result in results:
+                self.on_result(result)
+
+    def send_many(self, commands, now_ms):
+        """Publish (tubewell_id, dev_id, action, hex frame) commands without waiting between them; returns their ids."""
+        finished = []
+        queued = []
+        with self._lock:
+            for tubewell_id, dev_id, action, frame in commands:
+                pending = _Pending(next(self._ids), tubewell_id, dev_id, action, frame, now_ms)
+                old = self._pending.pop(dev_id, None)
+                if old is not None:
+                    finished.append(self._finish(old, "superseded", now_ms))
+                self._pending[dev_id] = pending
+                queued.append(pending)
+            self.sent += len(queued)
+        for pending in queued:
+            self.publish(pending.dev_id, pending.frame)
+        self._report(finished)
+        return [pending.id for pending in queued]
+
+    def send(self, tubewell_id, dev_id, action, frame, now_ms):
+        return self.send_many([(tubewell_id, dev_id, action, frame)], now_ms)[0]
+
+    def handle_response(self, dev_id, frame, now_ms):
+        """Match a response frame from ``dev_id``; returns the finished CommandResult or None."""
+        parsed = parse_rtu(frame)
+        if parsed is None:
+            return None
+        slave, function, payload = parsed
+        with self._lock:
+            pending = self._pending.get(dev_id)
+            if pending is None or pending.slave != slave:
+                return None
+            if function & EXCEPTION_FLAG:
+                del self._pending[dev_id]
+                self.failed += 1
+                result = self._finish(pending, "failed", now_ms, error=payload[0] if payload else None)
+            elif frame.hex().upper() == pending.frame.upper():
+                del self._pending[dev_id]
+                result = self._finish(pending, "acked", now_ms)
+                self.acked += 1
+                self.ack_latency_ms_total += result.latency_ms
+                self.ack_latency_ms_max = max(self.ack_latency_ms_max, result.latency_ms)
+            else:
+                return None
+        self._report([result])
+        return result
+
+    def sweep(self, now_ms):
+        """Republish overdue commands and time out those out of retries; returns the timed out results."""
+        now = time.monotonic()
+        resend = []
+        finished = []
+        with self._lock:
+            for dev_id, pending in list(self._pending.items()):
+                if now - pending.last_sent < self.timeout:
+                    continue
+                if pending.attempts > self.retries:
+                    del self._pending[dev_id]
+                    self.timeouts += 1
+                    finished.append(self._finish(pending, "timeout", now_ms))
+                else:
+                    pending.attempts += 1
+                    pending.last_sent = now
+                    resend.append(pending)
+            self.retried += len(resend)
+        for pending in resend:
+            self.publish(pending.dev_id, pending.frame)
+        self._report(finished)
+        return finished
+
+    def pending(self):
+        """CommandResult (state "pending") for every outstanding command."""
+        with self._lock:
+            return [CommandResult(p.id, p.tubewell_id, p.dev_id, p.action, p.frame, "pending", p.attempts,
+                                  p.sent_ms, None, None, None) for p in self._pending.values()]
+
+    def history(self, limit=None):
+        """Finished commands, newest first."""
+        with self._lock:
+            items = list(self._history)
+        items.reverse()
+        return items[:limit] if limit else items
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "sent": self.sent,
+            "acked": self.acked,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "retried": self.retried,
+            "ack_latency_ms_avg": round(self.ack_latency_ms_total / self.acked, 1) if self.acked else None,
+            "ack_latency_ms_max": self.ack_latency_ms_max,
+        }
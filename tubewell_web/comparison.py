@@ -0,0 +1,88 @@
+from db_schema import RAW_COLUMN_KEYS, RAW_COLUMNS, ROLLUP_STATS
+from rollups import RESOLUTION_MS
+
+# Metrics a comparison can ask for, in response order
+COMPARISON_METRICS = tuple(dict.fromkeys(metric for metric, _ in RAW_COLUMN_KEYS))
+
+# Largest grid (buckets per well) one request may build
+MAX_COMPARISON_BUCKETS = 5000
+
+FILL_POLICIES = ("null", "previous", "zero")
+
+
+def comparison_grid(start, end, resolution):
+    """Bucket starts shared by every well: [start, end) aligned to ``resolution``."""
+    res = RESOLUTION_MS[resolution]
+    return list(range(start - start % res, end, res))
+
+
+def _forward_fill(values):
+    last = None
+    for i, value in enumerate(values):
+        if value is None:
+            values[i] = last
+        else:
+            last = value
+    return values
+
+
+def compare_tubewells(conn, ids, start, end, resolution, metrics=COMPARISON_METRICS, stat="avg", fill="null"):
+    """Rollup series of several wells on one shared bucket grid.
+
+    A single query joins every (well, bucket) pair of the grid against
+    aggregated_data, so missing buckets come back as NULL rows already in
+    place. Rows arrive grouped by well and ordered by bucket; each well's
+    block is transposed into columns with ``zip`` instead of being walked
+    point by point. ``fill`` decides what a missing bucket holds: null,
+    the previous value, or zero.
+
+    Returns {"time": [...], "tubewells": {id: {...}}}; three-phase metrics
+    are {"A": [...], "B": [...], "C": [...]}, the rest plain lists.
+    """
+    if stat not in ROLLUP_STATS:
+        raise ValueError(f"stat must be one of {ROLLUP_STATS}")
+    if fill not in FILL_POLICIES:
+        raise ValueError(f"fill must be one of {FILL_POLICIES}")
+    grid = comparison_grid(start, end, resolution)
+    if len(grid) > MAX_COMPARISON_BUCKETS:
+        raise ValueError(f"Range needs {len(grid)} buckets at {resolution}, limit is {MAX_COMPARISON_BUCKETS}")
+    keys = [(metric, phase, col) for (metric, phase), col in zip(RAW_COLUMN_KEYS, RAW_COLUMNS) if metric in metrics]
+    ids = list(dict.fromkeys(ids))
+    result = {"time": grid, "tubewells": {}}
+    if not ids or not grid:
+        return result
+
+    res = RESOLUTION_MS[resolution]
+    columns = "".join(f", ROUND(a.{col}_{stat}, 3)" for _, _, col in keys)
+    rows = conn.execute(f'''
+        WITH RECURSIVE grid(bucket) AS (
+            SELECT ? UNION ALL SELECT bucket + ? FROM grid WHERE bucket + ? < ?
+        ), wells(tubewell_id) AS (VALUES {", ".join(["(?)"] * len(ids))})
+        SELECT a.data_points{columns}
+        FROM wells w CROSS JOIN grid g
+        LEFT JOIN aggregated_data a
+            ON a.tubewell_id = w.tubewell_id AND a.resolution = ? AND a.bucket_start = g.bucket
+        ORDER BY w.tubewell_id, g.bucket
+    ''', [grid[0], res, res, end] + sorted(ids) + [res]).fetchall()
+
+    n = len(grid)
+    for i, tid in enumerate(sorted(ids)):
+        data_points, *values = (list(col) for col in zip(*rows[i * n:(i + 1) * n]))
+        present = [t for t, count in zip(grid, data_points) if count]
+        series = {}
+        for (metric, phase, _), column in zip(keys, values):
+            if fill == "previous":
+                _forward_fill(column)
+            elif fill == "zero":
+                column = [0 if v is None else v for v in column]
+            if phase is None:
+                series[metric] = column
+            else:
+                series.setdefault(metric, {})[phase] = column
+        result["tubewells"][tid] = {
+            "data_points": [count or 0 for count in data_points],
+            "metrics": series,
+            "available_start": present[0] if present else None,
+            "available_end": present[-1] + res if present else None,
+        }
+    return result
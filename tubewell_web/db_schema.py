@@ -0,0 +1,406 @@
+import argparse
+import calendar
+import time
+from datetime import datetime, timezone
+
+from db_writer import open_wal_connection
+
+# -----------------------------
+# Schema
+# -----------------------------
+# Timestamps are integer epoch milliseconds (UTC). Raw samples and rollups are
+# clustered on (tubewell_id, time) so per-well range queries are index seeks.
+#   v2: epoch-ms keys, WITHOUT ROWID tables
+#   v3: aggregated_data holds every rollup resolution with avg/min/max/last
+#   v4: raw samples live in one raw_data_YYYYMMDD table per time partition
+#   v5: devices table maps PLC device ids to tubewell ids
+#   v6: energy_counters / energy_state for the energy integrator
+#   v7: sessions table of telemetry-derived run sessions
+#   v8: devices get a Modbus slave address and a feeder for group commands
+#   v9: alerts table written by the alert rule engine
+SCHEMA_VERSION = 9
+
+RAW_COLUMNS = (
+    "voltage_a", "voltage_b", "voltage_c",
+    "current_a", "current_b", "current_c",
+    "active_power_a", "active_power_b", "active_power_c",
+    "reactive_power_a", "reactive_power_b", "reactive_power_c",
+    "power_factor_a", "power_factor_b", "power_factor_c",
+    "frequency",
+)
+
+# (metric, phase) for each raw column; phase is None for single-value metrics
+RAW_COLUMN_KEYS = tuple(
+    (col[:-2], col[-1].upper()) if col[-2:] in ("_a", "_b", "_c") else (col, None)
+    for col in RAW_COLUMNS
+)
+
+# Energy counters: kWh per phase, then kVARh per phase
+ENERGY_COLUMNS = ("active_a", "active_b", "active_c", "reactive_a", "reactive_b", "reactive_c")
+
+# Columns present in the v1 raw_data table (power factor was never stored)
+LEGACY_RAW_COLUMNS = RAW_COLUMNS[:12] + ("frequency",)
+
+# Statistics kept per metric column in aggregated_data
+ROLLUP_STATS = ("avg", "min", "max", "last")
+
+# Formatted with the partition table name, see partitions.RawPartitions. A plain
+# INSERT: a sample is never replaced, a clashing key fails in the batch writer
+RAW_INSERT_SQL = (
+    f"INSERT INTO {{table}} (tubewell_id, ts, {', '.join(RAW_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * (len(RAW_COLUMNS) + 2))})"
+)
+
+LEGACY_TABLES = {"raw_data": "raw_data_v1", "aggregated_data": "aggregated_data_v1"}
+
+# The single unpartitioned raw_data table used by schema v2/v3
+UNPARTITIONED_RAW_TABLE = "raw_data_v3"
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def to_ms(dt):
+    """Convert a naive UTC datetime to epoch milliseconds."""
+    return calendar.timegm(dt.timetuple()) * 1000 + dt.microsecond // 1000
+
+
+def parse_time_param(value):
+    """Accept epoch milliseconds, YYYY-MM-DD or an ISO datetime (UTC unless an offset is given)."""
+    if value.isdigit():
+        return int(value)
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return to_ms(dt)
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def create_raw_table(conn, table):
+    """Create one raw sample partition (see partitions.RawPartitions)."""
+    metric_cols = ",\n            ".join(f"{col} REAL" for col in RAW_COLUMNS)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            tubewell_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            {metric_cols},
+            PRIMARY KEY (tubewell_id, ts)
+        ) WITHOUT ROWID
+    ''')
+    # Used by the aggregator, which scans all wells from a watermark
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_ts ON {table} (ts)")
+
+
+def _create_tables(conn):
+    # resolution is the bucket width in milliseconds
+    stat_cols = ",\n            ".join(f"{col}_{stat} REAL" for col in RAW_COLUMNS for stat in ROLLUP_STATS)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS aggregated_data (
+            tubewell_id INTEGER NOT NULL,
+            resolution INTEGER NOT NULL,
+            bucket_start INTEGER NOT NULL,
+            data_points INTEGER,
+            last_ts INTEGER,
+            {stat_cols},
+            PRIMARY KEY (tubewell_id, resolution, bucket_start)
+        ) WITHOUT ROWID
+    ''')
+    # Used when rolling one resolution up into the next across all wells
+    conn.execute("CREATE INDEX IF NOT EXISTS aggregated_data_bucket ON aggregated_data (resolution, bucket_start)")
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            resolution INTEGER PRIMARY KEY,
+            watermark INTEGER NOT NULL
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS storage_settings (
+            key TEXT PRIMARY KEY,
+            value
+        )
+    ''')
+
+    # on_command / off_command are hex RS485 frames that override the ones built
+    # for slave_address (see commands.pump_frame); feeder groups wells for commands
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS devices (
+            tubewell_id INTEGER PRIMARY KEY,
+            dev_id TEXT NOT NULL UNIQUE,
+            name TEXT NOT NULL,
+            on_command TEXT,
+            off_command TEXT,
+            created_ms INTEGER NOT NULL,
+            slave_address INTEGER,
+            feeder TEXT
+        )
+    ''')
+
+    # Cumulative energy per phase at each energy bucket boundary, see energy.EnergyIntegrator
+    energy_cols = ",\n            ".join(f"{col} REAL" for col in ENERGY_COLUMNS)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS energy_counters (
+            tubewell_id INTEGER NOT NULL,
+            bucket_start INTEGER NOT NULL,
+            {energy_cols},
+            PRIMARY KEY (tubewell_id, bucket_start)
+        ) WITHOUT ROWID
+    ''')
+    # Integrator state at the last checkpoint, so a restart continues the counters
+    power_cols = ",\n            ".join(f"power_{col} REAL" for col in ENERGY_COLUMNS)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS energy_state (
+            tubewell_id INTEGER PRIMARY KEY,
+            ts INTEGER NOT NULL,
+            {power_cols},
+            {energy_cols}
+        )
+    ''')
+
+    # Run sessions derived from telemetry; end_ms is NULL while the pump is running
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            tubewell_id INTEGER NOT NULL,
+            start_ms INTEGER NOT NULL,
+            end_ms INTEGER,
+            last_ms INTEGER NOT NULL,
+            PRIMARY KEY (tubewell_id, start_ms)
+        ) WITHOUT ROWID
+    ''')
+    # Range queries over closed sessions; open ones (NULL end_ms) sit together at its start
+    conn.execute("CREATE INDEX IF NOT EXISTS sessions_end ON sessions (end_ms)")
+
+    # Alerts raised by alerts.AlertEngine; end_ms is NULL while the alert is open
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS alerts (
+            tubewell_id INTEGER NOT NULL,
+            rule TEXT NOT NULL,
+            start_ms INTEGER NOT NULL,
+            end_ms INTEGER,
+            severity TEXT NOT NULL,
+            value REAL,
+            peak REAL,
+            PRIMARY KEY (tubewell_id, start_ms, rule)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS alerts_end ON alerts (end_ms)")
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            source TEXT PRIMARY KEY,
+            last_rowid INTEGER NOT NULL DEFAULT 0,
+            done INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+def create_schema(conn):
+    """Create (or upgrade to) the current schema.
+
+    v1 tables are renamed out of the way, which is instant, so ingest can
+    continue into the new tables while ``migrate`` copies old rows across.
+    """
+    with conn:
+        for table, legacy in LEGACY_TABLES.items():
+            # Only the v1 tables have an AUTOINCREMENT id column
+            if "id" in _columns(conn, table):
+                print(f"[SCHEMA] Moving v1 table {table} to {legacy}")
+                conn.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+
+        if _columns(conn, "raw_data"):
+            print(f"[SCHEMA] Moving unpartitioned raw_data to {UNPARTITIONED_RAW_TABLE}")
+            conn.execute(f"ALTER TABLE raw_data RENAME TO {UNPARTITIONED_RAW_TABLE}")
+
+        cols = _columns(conn, "aggregated_data")
+        if cols and "resolution" not in cols:
+            # v2 rollups only held 15-minute averages; they are rebuilt by the migration
+            print("[SCHEMA] Dropping v2 aggregated_data, rollups will be rebuilt from raw data")
+            conn.execute("DROP TABLE aggregated_data")
+            conn.execute("DROP TABLE IF EXISTS rollup_state")
+
+        _create_tables(conn)
+        device_cols = _columns(conn, "devices")
+        for col, decl in (("slave_address", "INTEGER"), ("feeder", "TEXT")):
+            if col not in device_cols:
+                conn.execute(f"ALTER TABLE devices ADD COLUMN {col} {decl}")
+        for legacy in list(LEGACY_TABLES.values()) + [UNPARTITIONED_RAW_TABLE]:
+            if _columns(conn, legacy):
+                conn.execute("INSERT OR IGNORE INTO schema_migrations (source) VALUES (?)", (legacy,))
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def pending_migrations(conn):
+    return [row[0] for row in conn.execute("SELECT source FROM schema_migrations WHERE done = 0 ORDER BY source")]
+
+
+# -----------------------------
+# Migration of older layouts
+# -----------------------------
+# julianday() understands the text timestamps written by the v1 code
+_MS_EXPR = "CAST(ROUND((julianday({col}) - 2440587.5) * 86400000) AS INTEGER)"
+
+# v1 rollups only had averages, which also stand in for min/max/last
+_LEGACY_AGG_TARGETS = ", ".join(f"{c}_{stat}" for c in LEGACY_RAW_COLUMNS for stat in ROLLUP_STATS)
+_LEGACY_AGG_SOURCES = ", ".join(f"{c}_avg" for c in LEGACY_RAW_COLUMNS for stat in ROLLUP_STATS)
+
+_AGG_V1_COPY_SQL = (
+    f"INSERT OR IGNORE INTO aggregated_data (tubewell_id, resolution, bucket_start, "
+    f"data_points, last_ts, {_LEGACY_AGG_TARGETS}) "
+    f"SELECT tubewell_id, 900000, {_MS_EXPR.format(col='bucket_start')}, "
+    f"data_points, {_MS_EXPR.format(col='bucket_start')}, {_LEGACY_AGG_SOURCES} "
+    f"FROM aggregated_data_v1 WHERE id > ? AND id <= ? AND bucket_start IS NOT NULL"
+)
+
+# Raw rows are read in keyset order, (tubewell_id, ts, *RAW_COLUMNS), and routed to partitions
+_RAW_V1_READ_SQL = (
+    f"SELECT id, tubewell_id, {_MS_EXPR.format(col='timestamp')}, {', '.join(LEGACY_RAW_COLUMNS[:12])}, "
+    f"NULL, NULL, NULL, frequency "
+    f"FROM raw_data_v1 WHERE id > ? AND timestamp IS NOT NULL ORDER BY id LIMIT ?"
+)
+_RAW_V3_READ_SQL = (
+    f"SELECT ts, tubewell_id, ts, {', '.join(RAW_COLUMNS)} "
+    f"FROM {UNPARTITIONED_RAW_TABLE} WHERE ts >= ? ORDER BY ts LIMIT ?"
+)
+
+_SPAN_SQL = {
+    "aggregated_data_v1": f"SELECT MIN({_MS_EXPR.format(col='bucket_start')}), "
+                          f"MAX({_MS_EXPR.format(col='bucket_start')}) FROM aggregated_data_v1",
+    "raw_data_v1": f"SELECT MIN({_MS_EXPR.format(col='timestamp')}), "
+                   f"MAX({_MS_EXPR.format(col='timestamp')}) FROM raw_data_v1",
+    UNPARTITIONED_RAW_TABLE: f"SELECT MIN(ts), MAX(ts) FROM {UNPARTITIONED_RAW_TABLE}",
+}
+
+
+def _copy_chunk(conn, partitions, source, last, chunk_rows):
+    """Copy one chunk starting after ``last``. Returns the new position, or None when done.
+
+    The position is the v1 id, or the sample timestamp for the unpartitioned
+    table (rows sharing the boundary timestamp are copied again, harmlessly).
+    """
+    if source == "aggregated_data_v1":
+        max_id = conn.execute("SELECT MAX(id) FROM aggregated_data_v1").fetchone()[0] or 0
+        if last >= max_id:
+            return None
+        upper = min(last + chunk_rows, max_id)
+        conn.execute(_AGG_V1_COPY_SQL, (last, upper))
+        return upper
+
+    if source == "raw_data_v1":
+        rows = conn.execute(_RAW_V1_READ_SQL, (last, chunk_rows)).fetchall()
+    else:
+        rows = conn.execute(_RAW_V3_READ_SQL, (last, chunk_rows)).fetchall()
+        if rows and rows[-1][0] == last:
+            # Whole chunk shares one timestamp, take all of them and step past it
+            rows = conn.execute(f"SELECT ts, tubewell_id, ts, {', '.join(RAW_COLUMNS)} "
+                                f"FROM {UNPARTITIONED_RAW_TABLE} WHERE ts = ?", (last,)).fetchall()
+            partitions.insert_rows(conn, [row[1:] for row in rows], ignore_existing=True)
+            return last + 1
+    if not rows:
+        return None
+    partitions.insert_rows(conn, [row[1:] for row in rows], ignore_existing=True)
+    return rows[-1][0]
+
+
+# Column the old tables are emptied by, in chunks, before they are dropped
+_LEGACY_KEYS = {"aggregated_data_v1": "id", "raw_data_v1": "id", UNPARTITIONED_RAW_TABLE: "ts"}
+
+
+def _drop_legacy_table(conn, source, chunk_rows, pause):
+    """Delete the rows of ``source`` a chunk per transaction, then drop the empty table.
+
+    Dropping a large table in one go frees every page inside a single write
+    transaction, which holds the write lock long enough to stall ingest.
+    """
+    key = _LEGACY_KEYS[source]
+    while True:
+        with conn:
+            deleted = conn.execute(f"DELETE FROM {source} WHERE {key} IN "
+                                   f"(SELECT {key} FROM {source} ORDER BY {key} LIMIT ?)", (chunk_rows,)).rowcount
+        if not deleted:
+            break
+        if pause:
+            time.sleep(pause)
+    with conn:
+        conn.execute(f"DROP TABLE {source}")
+    print(f"[MIGRATE] {source}: dropped")
+
+
+def migrate(db_file, chunk_rows=5000, pause=0.05, drop_legacy=True):
+    """Copy rows from older layouts into the current tables in small transactions.
+
+    Each chunk commits its progress in ``schema_migrations`` so the migration
+    can be interrupted and resumed, and ``pause`` yields the write lock to the
+    live ingest writer between chunks. With ``drop_legacy`` a copied table is
+    then emptied the same way, chunk by chunk, and only dropped once empty; a
+    run interrupted while emptying finishes the job the next time.
+    """
+    # Both modules import this one
+    from partitions import RawPartitions
+    from rollups import rebuild_rollups
+
+    conn = open_wal_connection(db_file)
+    try:
+        create_schema(conn)
+        partitions = RawPartitions(db_file)
+        rebuild_span = None
+        if drop_legacy:
+            for (source,) in conn.execute("SELECT source FROM schema_migrations WHERE done = 1").fetchall():
+                if _columns(conn, source):
+                    _drop_legacy_table(conn, source, chunk_rows, pause)
+        for source in pending_migrations(conn):
+            last = conn.execute("SELECT last_rowid FROM schema_migrations WHERE source = ?", (source,)).fetchone()[0]
+            print(f"[MIGRATE] {source}: resuming at {last}")
+            started = time.time()
+            copied = 0
+            while True:
+                with conn:
+                    position = _copy_chunk(conn, partitions, source, last, chunk_rows)
+                    if position is None:
+                        break
+                    conn.execute("UPDATE schema_migrations SET last_rowid = ? WHERE source = ?", (position, source))
+                last = position
+                copied += 1
+                print(f"[MIGRATE] {source}: chunk {copied} done, at {last} ({time.time() - started:.1f}s)")
+                if pause:
+                    time.sleep(pause)
+
+            # The live aggregator's watermarks are already past the copied rows
+            span = conn.execute(_SPAN_SQL[source]).fetchone()
+            if span[0] is not None:
+                rebuild_span = (min(span[0], rebuild_span[0]), max(span[1], rebuild_span[1])) if rebuild_span else span
+
+            with conn:
+                conn.execute("UPDATE schema_migrations SET done = 1 WHERE source = ?", (source,))
+            print(f"[MIGRATE] {source}: complete")
+            if drop_legacy:
+                _drop_legacy_table(conn, source, chunk_rows, pause)
+
+        if rebuild_span:
+            print(f"[MIGRATE] Rebuilding rollups for {rebuild_span[0]}..{rebuild_span[1]}")
+            rebuild_rollups(conn, partitions, rebuild_span[0], rebuild_span[1])
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upgrade tubewell_data.db to the current schema")
+    parser.add_argument("command", choices=["migrate", "status"])
+    parser.add_argument("--db", default="tubewell_data.db")
+    parser.add_argument("--chunk-rows", type=int, default=5000)
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds to sleep between chunks")
+    parser.add_argument("--keep-legacy", action="store_true", help="keep the old tables after copying")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate(args.db, args.chunk_rows, args.pause, drop_legacy=not args.keep_legacy)
+    else:
+        conn = open_wal_connection(args.db)
+        create_schema(conn)
+        print(f"Schema version: {conn.execute('PRAGMA user_version').fetchone()[0]}")
+        print(f"Pending migrations: {pending_migrations(conn) or 'none'}")
+        conn.close()
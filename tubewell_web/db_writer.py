@@ -0,0 +1,183 @@
+import sqlite3
+import threading
+import time
+
+
+def open_wal_connection(db_file, timeout=30, check_same_thread=True):
+    """Open a connection with WAL journaling so readers are not blocked by the writer."""
+    conn = sqlite3.connect(db_file, timeout=timeout, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class BatchWriter:
+    """Single writer thread that group-commits queued rows to SQLite.
+
+    Rows are buffered in memory and flushed with ``executemany`` inside one
+    transaction once ``max_batch`` rows are pending or the oldest pending row
+    is ``max_latency`` seconds old, whichever comes first. ``on_batch`` is
+    called from the writer thread with (batch, seconds) after each commit,
+    ``batch`` being the list of (sql, params) just written.
+
+    If the batch transaction fails it is rolled back and each statement is
+    written again in a transaction of its own, then row by row for a
+    statement that still fails, so a bad row costs only itself; dropped
+    rows are logged and counted in ``rows_dropped``.
+    """
+
+    def __init__(self, db_file, max_batch=500, max_latency=1.0, max_pending=None, name="db_writer", on_batch=None):
+        self.db_file = db_file
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.max_pending = max_pending or max_batch * 20
+        self.name = name
+        self.on_batch = on_batch
+
+        self._pending = []          # list of (sql, params)
+        self._oldest = None         # monotonic time of the oldest pending row
+        self._writing = False       # a batch has been taken and is not committed yet
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+        # Counters exposed for monitoring
+        self.rows_written = 0
+        self.batches_written = 0
+        self.last_batch_size = 0
+        self.last_flush_seconds = 0.0
+        self.errors = 0
+        self.rows_dropped = 0
+
+    # -----------------------------
+    # Lifecycle
+    # -----------------------------
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """Flush everything still buffered and stop the writer thread."""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._thread = None
+
+    # -----------------------------
+    # Producer side
+    # -----------------------------
+    def submit(self, sql, params):
+        """Queue one row. Blocks only when ``max_pending`` rows are already waiting."""
+        with self._cond:
+            while len(self._pending) >= self.max_pending and not self._stopping:
+                self._cond.wait(0.1)
+            first = not self._pending
+            if first:
+                self._oldest = time.monotonic()
+            self._pending.append((sql, params))
+            if first or len(self._pending) >= self.max_batch:
+                self._cond.notify_all()  # Start the latency timer, or flush a full batch
+
+    def flush(self, timeout=None):
+        """Ask the writer to commit now and wait until every row queued so far is committed."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._writing:
+                self._oldest = 0  # Makes the current batch overdue
+                self._cond.notify_all()
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 0.1)
+        return True
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    # -----------------------------
+    # Writer thread
+    # -----------------------------
+    def _take_batch(self):
+        with self._cond:
+            while True:
+                if self._pending:
+                    if len(self._pending) >= self.max_batch or self._stopping:
+                        break
+                    wait = self._oldest + self.max_latency - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                elif self._stopping:
+                    return None
+                else:
+                    self._cond.wait()
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            self._oldest = time.monotonic() if self._pending else None
+            self._writing = True
+            return batch
+
+    def _write(self, conn, batch):
+        # Group rows by statement across the batch, each group keeping its rows in submission order,
+        # so each statement is one executemany
+        groups = {}
+        for sql, params in batch:
+            groups.setdefault(sql, []).append(params)
+
+        started = time.perf_counter()
+        try:
+            with conn:
+                for sql, rows in groups.items():
+                    conn.executemany(sql, rows)
+            written = len(batch)
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"[{self.name}] Batch of {len(batch)} rows failed ({e}); writing its statements one by one")
+            written = sum(self._write_group(conn, sql, rows) for sql, rows in groups.items())
+        self.last_flush_seconds = time.perf_counter() - started
+        self.last_batch_size = len(batch)
+        self.rows_written += written
+        self.batches_written += 1
+        if self.on_batch is not None:
+            self.on_batch(batch, self.last_flush_seconds)
+
+    def _write_group(self, conn, sql, rows):
+        """Write one statement's rows in their own transaction, else one row at a time; returns rows written."""
+        try:
+            with conn:
+                conn.executemany(sql, rows)
+            return len(rows)
+        except sqlite3.Error:
+            pass
+        written = 0
+        for params in rows:
+            try:
+                with conn:
+                    conn.execute(sql, params)
+                written += 1
+            except sqlite3.Error as e:
+                self.rows_dropped += 1
+                print(f"[{self.name}] Dropped row {params!r} of {' '.join(sql.split())[:80]}: {e}")
+        return written
+
+    def _run(self):
+        conn = open_wal_connection(self.db_file)
+        try:
+            while True:
+                batch = self._take_batch()
+                if batch is None:
+                    break
+                self._write(conn, batch)
+                with self._cond:
+                    self._writing = False
+                    self._cond.notify_all()  # Wake producers waiting on max_pending / flush()
+        finally:
+            conn.close()
+            print(f"[{self.name}] Stopped after writing {self.rows_written} rows in {self.batches_written} batches")
@@ -0,0 +1,220 @@
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from db_schema import now_ms
+from db_writer import open_wal_connection
+
+Device = namedtuple("Device", "tubewell_id dev_id name on_command off_command slave_address feeder")
+
+_COLUMNS = "tubewell_id, dev_id, name, on_command, off_command, slave_address, feeder"
+
+
+class DeviceRegistry:
+    """PLC devices known to the system, persisted in the ``devices`` table.
+
+    The table is read once at startup into two dicts, so resolving a devId
+    on the ingest path is a single dict lookup. Registration writes through
+    to SQLite; a new device gets the next free tubewell id (max + 1).
+    Processes that do not register devices themselves call ``reload`` to
+    see those another process added. ``version`` is bumped on every change.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._by_id = {}
+        self._by_dev_id = {}
+        self._lock = threading.Lock()
+        self.version = 0
+        self.reload()
+
+    def reload(self):
+        """Read the devices table again; returns the number of devices that were not known before."""
+        by_id, by_dev_id = {}, {}
+        conn = open_wal_connection(self.db_file)
+        try:
+            for row in conn.execute(f"SELECT {_COLUMNS} FROM devices"):
+                device = Device(*row)
+                by_id[device.tubewell_id] = device
+                by_dev_id[device.dev_id] = device.tubewell_id
+        finally:
+            conn.close()
+        with self._lock:
+            added = len(by_id.keys() - self._by_id.keys())
+            if by_id != self._by_id:
+                self._by_id, self._by_dev_id = by_id, by_dev_id
+                self.version += 1
+        return added
+
+    def _add(self, device):
+        self._by_id[device.tubewell_id] = device
+        self._by_dev_id[device.dev_id] = device.tubewell_id
+        self.version += 1
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, tubewell_id):
+        return tubewell_id in self._by_id
+
+    def __iter__(self):
+        return iter(sorted(self._by_id))
+
+    def lookup(self, dev_id):
+        """Tubewell id for ``dev_id``, or None if the device is not registered."""
+        return self._by_dev_id.get(dev_id)
+
+    def get(self, tubewell_id):
+        return self._by_id.get(tubewell_id)
+
+    def devices(self):
+        return [self._by_id[i] for i in sorted(self._by_id)]
+
+    def in_feeder(self, feeder):
+        """Devices on ``feeder``, by tubewell id."""
+        return [device for device in self.devices() if device.feeder == feeder]
+
+    def register(self, dev_id, name=None, on_command=None, off_command=None, tubewell_id=None,
+                 slave_address=None, feeder=None):
+        """Add ``dev_id`` (or update the given fields of an existing one) and return its Device."""
+        with self._lock:
+            existing = self._by_dev_id.get(dev_id)
+            conn = open_wal_connection(self.db_file)
+            try:
+                with conn:
+                    if existing is not None:
+                        current = self._by_id[existing]
+                        device = current._replace(
+                            name=name if name is not None else current.name,
+                            on_command=on_command if on_command is not None else current.on_command,
+                            off_command=off_command if off_command is not None else current.off_command,
+                            slave_address=slave_address if slave_address is not None else current.slave_address,
+                            feeder=feeder if feeder is not None else current.feeder,
+                        )
+                        conn.execute("UPDATE devices SET name = ?, on_command = ?, off_command = ?, slave_address = ?, "
+                                     "feeder = ? WHERE tubewell_id = ?",
+                                     (device.name, device.on_command, device.off_command, device.slave_address,
+                                      device.feeder, existing))
+                    else:
+                        if tubewell_id is None:
+                            tubewell_id = conn.execute("SELECT COALESCE(MAX(tubewell_id) + 1, 0) FROM devices").fetchone()[0]
+                        device = Device(tubewell_id, dev_id, name or f"Tubewell {tubewell_id + 1}", on_command, off_command,
+                                        slave_address, feeder)
+                        conn.execute(f"INSERT INTO devices ({_COLUMNS}, created_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                     device + (now_ms(),))
+            except sqlite3.IntegrityError:
+                # Registered by another process in the meantime; take its row
+                device = Device(*conn.execute(f"SELECT {_COLUMNS} FROM devices WHERE dev_id = ?", (dev_id,)).fetchone())
+            finally:
+                conn.close()
+            self._add(device)
+        return device
+
+    def seed(self, devices):
+        """Register (dev_id, tubewell_id, name, on_command, off_command) rows if the table is empty."""
+        if self._by_id:
+            return
+        for dev_id, tubewell_id, name, on_command, off_command in devices:
+            self.register(dev_id, name, on_command, off_command, tubewell_id=tubewell_id)
+        print(f"[DEVICES] Seeded registry with {len(devices)} devices")
+
+
+class LazyStates:
+    """Per-device state created on first use and dropped after ``idle_seconds``.
+
+    Membership follows the registry, so ``id in states`` means "is a known
+    tubewell" whether or not its state exists yet. Indexing creates the state
+    with ``factory(device)``; ``peek`` returns the existing state or a fresh,
+    unstored default so read-only callers do not allocate for silent devices.
+    ``touch`` marks activity; ``evict_idle`` drops what has not been touched.
+    Writers that replace a state go through ``update``; readers never lock.
+    ``on_update(tubewell_id, state)`` sees every stored state, in order, under
+    the lock.
+    """
+
+    def __init__(self, registry, factory, idle_seconds=None, on_update=None):
+        self.registry = registry
+        self.factory = factory
+        self.idle_seconds = idle_seconds
+        self.on_update = on_update
+        self._states = {}
+        self._touched = {}
+        self._lock = threading.RLock()
+
+    def __contains__(self, tubewell_id):
+        return tubewell_id in self.registry
+
+    def __len__(self):
+        return len(self._states)
+
+    def __getitem__(self, tubewell_id):
+        state = self._states.get(tubewell_id)
+        if state is None:
+            device = self.registry.get(tubewell_id)
+            if device is None:
+                raise KeyError(tubewell_id)
+            with self._lock:
+                state = self._states.get(tubewell_id)
+                if state is None:
+                    state = self._states[tubewell_id] = self.factory(device)
+                    self._touched[tubewell_id] = time.monotonic()
+        return state
+
+    def __setitem__(self, tubewell_id, state):
+        if tubewell_id not in self.registry:
+            raise KeyError(tubewell_id)
+        with self._lock:
+            self._states[tubewell_id] = state
+            self._touched[tubewell_id] = time.monotonic()
+            if self.on_update is not None:
+                self.on_update(tubewell_id, state)
+
+    def update(self, tubewell_id, change):
+        """Store ``change(current state)`` as the new state and mark it active; returns it."""
+        with self._lock:
+            state = change(self[tubewell_id])
+            self._states[tubewell_id] = state
+            self._touched[tubewell_id] = time.monotonic()
+            if self.on_update is not None:
+                self.on_update(tubewell_id, state)
+        return state
+
+    def peek(self, tubewell_id):
+        state = self._states.get(tubewell_id)
+        if state is None:
+            device = self.registry.get(tubewell_id)
+            if device is None:
+                raise KeyError(tubewell_id)
+            state = self.factory(device)
+        return state
+
+    def touch(self, tubewell_id):
+        self._touched[tubewell_id] = time.monotonic()
+
+    def items(self):
+        """(tubewell_id, state) for every state that currently exists."""
+        return sorted(self._states.items())
+
+    def all_items(self):
+        """(tubewell_id, state) for every registered device, existing or default."""
+        return [(i, self.peek(i)) for i in self.registry]
+
+    def evict_idle(self, on_evict=None):
+        """Drop states not touched for ``idle_seconds``; returns the evicted ids.
+
+        ``on_evict(tubewell_id, default_state)`` runs under the lock, so a
+        state that ``update`` stores at the same time lands after it and is
+        not overwritten by the eviction.
+        """
+        if not self.idle_seconds:
+            return []
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            idle = [i for i, touched in self._touched.items() if touched < cutoff]
+            for i in idle:
+                del self._touched[i]
+                self._states.pop(i, None)
+                if on_evict is not None:
+                    on_evict(i, self.peek(i))
+        return idle
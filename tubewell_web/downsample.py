@@ -0,0 +1,203 @@
+from db_schema import RAW_COLUMNS
+from rollups import RESOLUTION_MS
+
+# ?mode= values for max_points: the lowest and highest row per bucket, or Largest-Triangle-Three-Buckets
+DOWNSAMPLE_MODES = ("minmax", "lttb")
+
+
+# -----------------------------
+# Buckets
+# -----------------------------
+def bucket_width(start, end, max_points, mode):
+    """Width in ms of the time buckets that bring [start, end) down to about ``max_points``.
+
+    min/max keeps two points per bucket, LTTB one.
+    """
+    buckets = max(1, max_points // 2 if mode == "minmax" else max_points)
+    return max(1, -(-(end - start) // buckets))
+
+
+def _keep_extremes(groups, rows, highest):
+    """Fold (bucket, value, *row) rows into ``groups``, keeping per bucket the lowest (or ``highest``) value's row.
+
+    A bucket can come back from two raw partitions; the better of the two wins.
+    """
+    for bucket, value, *row in rows:
+        if value is None:
+            continue
+        current = groups.get(bucket)
+        if current is None or (value > current[0] if highest else value < current[0]):
+            groups[bucket] = (value, tuple(row))
+
+
+def _extreme_rows(lows, highs):
+    """Chart rows: each bucket's lowest and highest row, in time order; a row holding both appears once."""
+    rows = []
+    for bucket in sorted(lows.keys() | highs.keys()):
+        picked = [extreme[1] for extreme in (lows.get(bucket), highs.get(bucket)) if extreme is not None]
+        if len(picked) == 2 and picked[0] == picked[1]:
+            picked.pop()
+        rows.extend(sorted(picked, key=lambda row: row[0]))
+    return rows
+
+
+# -----------------------------
+# Largest-Triangle-Three-Buckets
+# -----------------------------
+def lttb_stream(rows, bucket_of, y_index, averages):
+    """Pick one row per bucket from time-ordered ``rows`` in a single pass.
+
+    ``bucket_of(row)`` gives the bucket a row falls in, and ``row[0]`` is its x.
+    ``averages`` maps each non-empty bucket to the (x, y) average of its
+    rows, which is the third corner of the triangle; the first corner is
+    the row picked for the previous bucket. The first and last rows are
+    always kept. Rows whose y is None are skipped.
+    """
+    order = sorted(averages)
+    following = dict(zip(order, order[1:]))
+    picked = []
+    anchor = None
+    bucket = best = target = None
+    best_area = -1.0
+    last = None
+    for row in rows:
+        y = row[y_index]
+        if y is None:
+            continue
+        last = row
+        if anchor is None:
+            picked.append(row)
+            anchor = row
+            bucket = bucket_of(row)
+            target = averages.get(following.get(bucket))
+            continue
+        b = bucket_of(row)
+        if b != bucket:
+            if best is not None:
+                picked.append(best)
+                anchor = best
+            bucket, best, best_area = b, None, -1.0
+            target = averages.get(following.get(b))
+        if target is None:
+            continue  # Last bucket: only its final row is kept, below
+        ax, ay = anchor[0], anchor[y_index]
+        area = abs((ax - target[0]) * (y - ay) - (ax - row[0]) * (target[1] - ay))
+        if area > best_area:
+            best, best_area = row, area
+    if best is not None and best is not last:
+        picked.append(best)
+    if last is not None and last is not anchor:
+        picked.append(last)
+    return picked
+
+
+def _lttb_averages(conn, sql, params):
+    return {bucket: (avg_x, avg_y) for bucket, avg_x, avg_y in conn.execute(sql, params) if avg_y is not None}
+
+
+# -----------------------------
+# Raw samples
+# -----------------------------
+def downsample_raw(conn, partitions, tubewell_id, start, end, max_points, mode="minmax", series=RAW_COLUMNS[0]):
+    """Raw samples of one well in [start, end) reduced to about ``max_points`` rows of (ts, *RAW_COLUMNS).
+
+    min/max keeps the samples holding the lowest and the highest ``series``
+    value of each bucket, whole rows as stored; SQLite finds them with a
+    MIN and a MAX GROUP BY per partition (a bare column next to a single
+    MIN or MAX comes from the row that produced it). LTTB gets the bucket
+    averages the same way and then streams the samples once.
+    """
+    width = bucket_width(start, end, max_points, mode)
+    params = {"id": tubewell_id, "start": start, "end": end, "width": width}
+    where = "tubewell_id = :id AND ts >= :start AND ts < :end"
+    tables = partitions.tables(conn, start, end)
+    if mode == "minmax":
+        lows, highs = {}, {}
+        for _, _, table in tables:
+            for agg, groups in (("MIN", lows), ("MAX", highs)):
+                _keep_extremes(groups, conn.execute(f'''
+                    SELECT (ts - :start) / :width AS bucket, {agg}({series}), ts, {", ".join(RAW_COLUMNS)}
+                    FROM {table} WHERE {where} GROUP BY bucket
+                ''', params), highest=agg == "MAX")
+        return _extreme_rows(lows, highs)
+
+    averages = {}
+    for _, _, table in tables:
+        averages.update(_lttb_averages(conn, f'''
+            SELECT (ts - :start) / :width AS bucket, AVG(ts), AVG({series})
+            FROM {table} WHERE {where} GROUP BY bucket
+        ''', params))
+
+    def rows():
+        for _, _, table in tables:
+            yield from conn.execute(f"SELECT ts, {', '.join(RAW_COLUMNS)} FROM {table} WHERE {where} ORDER BY ts", params)
+
+    return lttb_stream(rows(), lambda row: (row[0] - start) // width, 1 + RAW_COLUMNS.index(series), averages)
+
+
+# -----------------------------
+# Rollups
+# -----------------------------
+def downsample_rollups(conn, tubewell_id, resolution, start, end, max_points, mode="minmax", series=RAW_COLUMNS[0]):
+    """Rollup buckets of one well reduced to about ``max_points`` rows of (bucket_start, data_points, *values).
+
+    Values are the averages for LTTB. min/max keeps, per group of buckets,
+    the bucket with the lowest ``series`` minimum as a row of its minima
+    and the one with the highest maximum as a row of its maxima, so peaks
+    that the averages smooth away still show. Each row is one stored
+    bucket; when a bucket holds both extremes it gives both rows.
+    """
+    width = bucket_width(start, end, max_points, mode)
+    params = {"id": tubewell_id, "res": RESOLUTION_MS[resolution], "start": start, "end": end, "width": width}
+    where = "tubewell_id = :id AND resolution = :res AND bucket_start >= :start AND bucket_start < :end"
+    if mode == "minmax":
+        lows, highs = {}, {}
+        for agg, stat, groups in (("MIN", "min", lows), ("MAX", "max", highs)):
+            _keep_extremes(groups, conn.execute(f'''
+                SELECT (bucket_start - :start) / :width AS bucket, {agg}({series}_{stat}), bucket_start, data_points,
+                       {", ".join(f"{c}_{stat}" for c in RAW_COLUMNS)}
+                FROM aggregated_data WHERE {where} GROUP BY bucket
+            ''', params), highest=agg == "MAX")
+        return _extreme_rows(lows, highs)
+
+    averages = _lttb_averages(conn, f'''
+        SELECT (bucket_start - :start) / :width AS bucket, AVG(bucket_start), AVG({series}_avg)
+        FROM aggregated_data WHERE {where} GROUP BY bucket
+    ''', params)
+    rows = conn.execute(f'''
+        SELECT bucket_start, data_points, {", ".join(f"{c}_avg" for c in RAW_COLUMNS)}
+        FROM aggregated_data WHERE {where} ORDER BY bucket_start
+    ''', params)
+    return lttb_stream(rows, lambda row: (row[0] - start) // width, 2 + RAW_COLUMNS.index(series), averages)
+
+
+# -----------------------------
+# In-memory series
+# -----------------------------
+def downsample_lists(times, columns, max_points, mode="minmax", series=0):
+    """Reduce parallel lists (a shared time list and value lists) to about ``max_points``.
+
+    Returns (times, columns) in the same layout. Buckets are equal runs of
+    samples; min/max keeps the samples holding the lowest and the highest
+    value of ``columns[series]`` in each run, with every list's value at
+    those samples.
+    """
+    n = len(times)
+    if n <= max_points or max_points < 3:
+        return times, columns
+    if mode == "minmax":
+        step = -(-n // max(1, max_points // 2))
+        keep = []
+        for a in range(0, n, step):
+            part = columns[series][a:a + step]
+            keep.extend(sorted({a + part.index(min(part)), a + part.index(max(part))}))
+        return [times[i] for i in keep], [[column[i] for i in keep] for column in columns]
+
+    step = -(-n // max_points)
+    averages = {}
+    for a in range(0, n, step):
+        part = columns[series][a:a + step]
+        averages[a // step] = (sum(times[a:a + step]) / len(part), sum(part) / len(part))
+    picked = lttb_stream(zip(times, columns[series], range(n)), lambda row: row[2] // step, 1, averages)
+    keep = [i for _, _, i in picked]
+    return [times[i] for i in keep], [[column[i] for i in keep] for column in columns]
@@ -0,0 +1,201 @@
+import threading
+
+from db_schema import ENERGY_COLUMNS
+
+# Cumulative counters are stored at every boundary of this width (UTC aligned)
+ENERGY_BUCKET_MS = 15 * 60 * 1000
+
+# Samples further apart than this are not integrated across (device was off or offline)
+MAX_SAMPLE_GAP_MS = 5 * 60 * 1000
+
+_MS_PER_HOUR = 3600 * 1000
+_ZERO = (0.0,) * len(ENERGY_COLUMNS)
+
+ENERGY_COUNTER_SQL = (
+    f"INSERT OR REPLACE INTO energy_counters (tubewell_id, bucket_start, {', '.join(ENERGY_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * (len(ENERGY_COLUMNS) + 2))})"
+)
+
+_POWER_COLUMNS = tuple(f"power_{col}" for col in ENERGY_COLUMNS)
+_STATE_COLUMNS = ("tubewell_id", "ts") + _POWER_COLUMNS + ENERGY_COLUMNS
+_STATE_SQL = (
+    f"INSERT OR REPLACE INTO energy_state ({', '.join(_STATE_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(_STATE_COLUMNS))})"
+)
+
+# Newest counter at or before a time, one index seek per well
+_COUNTERS_AT_SQL = f'''
+    SELECT c.tubewell_id, c.bucket_start, {", ".join(f"c.{col}" for col in ENERGY_COLUMNS)}
+    FROM {{wells}} w
+    JOIN energy_counters c ON c.tubewell_id = w.tubewell_id AND c.bucket_start = (
+        SELECT MAX(bucket_start) FROM energy_counters
+        WHERE tubewell_id = w.tubewell_id AND bucket_start <= ?)
+'''
+
+
+def counters_at(conn, ts, ids=None):
+    """{tubewell_id: (bucket_start, *totals)} for the newest counter at or before ``ts``.
+
+    ``ids`` defaults to every registered device.
+    """
+    if ids is None:
+        wells, params = "devices", []
+    else:
+        params = list(dict.fromkeys(ids))
+        if not params:
+            return {}
+        wells = f"(SELECT column1 AS tubewell_id FROM (VALUES {', '.join(['(?)'] * len(params))}))"
+    rows = conn.execute(_COUNTERS_AT_SQL.format(wells=wells), params + [ts])
+    return {row[0]: row[1:] for row in rows}
+
+
+def stored_energy_between(conn, start, end, ids=None):
+    """{tubewell_id: totals} consumed in [start, end), from the database alone.
+
+    Like ``EnergyIntegrator.energy_between`` but for processes without the
+    live integrator (web workers): the upper end also considers the state
+    saved by the last checkpoint, so the open bucket counts up to then.
+    """
+    before = counters_at(conn, start, ids)
+    after = counters_at(conn, end, ids)
+    wanted = None if ids is None else set(ids)
+    for row in conn.execute(f"SELECT tubewell_id, ts, {', '.join(ENERGY_COLUMNS)} FROM energy_state WHERE ts <= ?",
+                            (end,)):
+        if (wanted is None or row[0] in wanted) and row[1] > after.get(row[0], (-1,))[0]:
+            after[row[0]] = row[1:]
+    result = {}
+    for tid in (set(before) | set(after) if ids is None else ids):
+        upper = after.get(tid, (None,) + _ZERO)[1:]
+        lower = before.get(tid, (None,) + _ZERO)[1:]
+        result[tid] = tuple(max(0.0, u - l) for u, l in zip(upper, lower))
+    return result
+
+
+def _trapezoid(p0, p1, span, part):
+    """Energy over the first ``part`` ms of a ``span`` ms segment whose power goes linearly p0 -> p1."""
+    p_end = p0 + (p1 - p0) * part / span
+    return (p0 + p_end) / 2 * part / _MS_PER_HOUR
+
+
+class EnergyIntegrator:
+    """Streaming kWh / kVARh counters per device and phase.
+
+    Every decoded sample adds the trapezoid between it and the previous
+    sample of the same device. Whenever a sample crosses a bucket boundary,
+    the cumulative totals at that exact boundary (the power is interpolated
+    linearly) are handed to ``on_counter(tubewell_id, bucket_start, totals)``
+    for storage. Energy over a range is then the difference of two stored
+    counters rather than a scan over raw samples.
+
+    Samples of one device must arrive in order from a single thread, which
+    the ingest pipeline guarantees; different devices may be added
+    concurrently.
+    """
+
+    def __init__(self, bucket_ms=ENERGY_BUCKET_MS, max_gap_ms=MAX_SAMPLE_GAP_MS, on_counter=None):
+        self.bucket_ms = bucket_ms
+        self.max_gap_ms = max_gap_ms
+        self.on_counter = on_counter
+        # tubewell_id -> (last sample ts, last power per column or None, totals); replaced, never mutated
+        self._devices = {}
+        self._lock = threading.Lock()
+        self.counters_emitted = 0
+
+    def __len__(self):
+        return len(self._devices)
+
+    def add(self, tubewell_id, active_power, reactive_power, ts):
+        """Integrate one sample; powers are (A, B, C) in kW / kVAR, ``ts`` in epoch ms."""
+        power = tuple(active_power) + tuple(reactive_power)
+        state = self._devices.get(tubewell_id)
+        if state is None:
+            with self._lock:
+                self._devices[tubewell_id] = (ts, power, _ZERO)
+            return
+        last_ts, last_power, totals = state
+        span = ts - last_ts
+        if span <= 0:
+            return  # Duplicate or out of order
+        integrate = last_power is not None and span <= self.max_gap_ms
+
+        boundary = last_ts - last_ts % self.bucket_ms + self.bucket_ms
+        while boundary <= ts:
+            if integrate:
+                part = boundary - last_ts
+                at_boundary = tuple(t + _trapezoid(p0, p1, span, part)
+                                    for t, p0, p1 in zip(totals, last_power, power))
+            else:
+                at_boundary = totals
+            if self.on_counter is not None:
+                self.on_counter(tubewell_id, boundary, at_boundary)
+            self.counters_emitted += 1
+            if not integrate:
+                break  # Nothing accrued across the gap; later boundaries would repeat this counter
+            boundary += self.bucket_ms
+
+        if integrate:
+            totals = tuple(t + (p0 + p1) / 2 * span / _MS_PER_HOUR for t, p0, p1 in zip(totals, last_power, power))
+        self._devices[tubewell_id] = (ts, power, totals)
+
+    def totals(self, tubewell_id):
+        """(ts of the last sample, totals) as integrated so far, or None for an unseen device."""
+        state = self._devices.get(tubewell_id)
+        return None if state is None else (state[0], state[2])
+
+    # -----------------------------
+    # Persistence
+    # -----------------------------
+    def checkpoint(self, conn):
+        """Save every device's running state so a restart continues the counters."""
+        with self._lock:
+            states = list(self._devices.items())
+        with conn:
+            conn.executemany(_STATE_SQL, [
+                (tid, ts, *(power or (None,) * len(ENERGY_COLUMNS)), *totals)
+                for tid, (ts, power, totals) in states
+            ])
+        return len(states)
+
+    def restore(self, conn):
+        """Load the running state saved by ``checkpoint``.
+
+        A counter row newer than the checkpoint (written before a crash) wins;
+        the segment across the restart is then simply not integrated.
+        """
+        restored = {}
+        for row in conn.execute(f"SELECT {', '.join(_STATE_COLUMNS)} FROM energy_state"):
+            power = row[2:2 + len(ENERGY_COLUMNS)]
+            restored[row[0]] = (row[1], None if power[0] is None else power, row[2 + len(ENERGY_COLUMNS):])
+        for tid, (bucket_start, *totals) in counters_at(conn, 2 ** 62).items():
+            state = restored.get(tid)
+            if state is None or bucket_start > state[0]:
+                restored[tid] = (bucket_start, None, tuple(totals))
+        with self._lock:
+            self._devices.update(restored)
+        return len(restored)
+
+    # -----------------------------
+    # Range queries
+    # -----------------------------
+    def energy_between(self, conn, start, end, ids=None):
+        """{tubewell_id: totals} consumed in [start, end), resolved to bucket boundaries.
+
+        Each end of the range is the newest stored counter at or before it;
+        when ``end`` is past a device's last sample its live totals are used,
+        so "today so far" includes the open bucket.
+        """
+        before = counters_at(conn, start, ids)
+        after = counters_at(conn, end, ids)
+        if ids is None:
+            with self._lock:
+                ids = set(before) | set(after) | set(self._devices)
+        result = {}
+        for tid in ids:
+            live = self.totals(tid)
+            if live is not None and end > live[0]:
+                upper = live[1]
+            else:
+                upper = after.get(tid, (None,) + _ZERO)[1:]
+            lower = before.get(tid, (None,) + _ZERO)[1:]
+            result[tid] = tuple(max(0.0, u - l) for u, l in zip(upper, lower))
+        return result
@@ -0,0 +1,152 @@
+"""Bulk export of raw samples.
+
+Streams raw_data partitions for a set of wells and a time range as CSV or
+as a sequence of binary column blocks (chart_format.encode_binary), gzip
+compressed by default. Rows are read with fetchmany from one cursor per
+partition, so memory stays flat whatever the range, and each partition is
+its own short read snapshot under WAL, so ingest keeps writing and the WAL
+can still be checkpointed while a long export runs.
+
+    python export.py --ids 0,1 --from 2026-01-01 --to 2026-12-31 --output fleet_2026.csv.gz
+    python export.py --metrics current,frequency --format columnar --output - > current.twc.gz
+"""
+import argparse
+import csv
+import io
+import sys
+import zlib
+
+from chart_format import BINARY_MIMETYPE, COMPRESS_LEVEL, encode_binary
+from db_schema import RAW_COLUMNS, RAW_COLUMN_KEYS, parse_time_param
+from db_writer import open_wal_connection
+from partitions import DAY_MS, RawPartitions
+
+EXPORT_FORMATS = ("csv", "columnar")
+EXPORT_COMPRESSION = ("gzip", "none")
+
+# Rows fetched from the cursor and encoded per chunk
+EXPORT_CHUNK_ROWS = 5000
+
+EXPORT_MIMETYPES = {"csv": "text/csv", "columnar": BINARY_MIMETYPE}
+EXPORT_EXTENSIONS = {"csv": "csv", "columnar": "twc"}
+
+
+def export_columns(metrics=None):
+    """RAW_COLUMNS selected by metric names ("current") or column names ("current_a"), in table order."""
+    if not metrics:
+        return RAW_COLUMNS
+    wanted = set(metrics)
+    unknown = wanted - set(RAW_COLUMNS) - {metric for metric, _ in RAW_COLUMN_KEYS}
+    if unknown:
+        raise ValueError(f"Unknown metrics {sorted(unknown)}")
+    return tuple(col for col, (metric, _) in zip(RAW_COLUMNS, RAW_COLUMN_KEYS) if col in wanted or metric in wanted)
+
+
+def iter_chunks(conn, partitions, ids, start, end, columns, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield lists of (tubewell_id, ts, *columns) rows in [start, end).
+
+    Rows come partition by partition, and within a partition ordered by
+    (tubewell_id, ts), which is the primary key order and needs no sort.
+    ``ids`` None exports every well.
+    """
+    params = [start, end]
+    where = "ts >= ? AND ts < ?"
+    if ids is not None:
+        ids = list(dict.fromkeys(ids))
+        where += f" AND tubewell_id IN ({', '.join('?' * len(ids))})"
+        params += ids
+    for _, _, table in partitions.tables(conn, start, end):
+        cursor = conn.execute(
+            f"SELECT tubewell_id, ts, {', '.join(columns)} FROM {table} WHERE {where} ORDER BY tubewell_id, ts",
+            params)
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+
+def encode_csv(chunks, columns):
+    """CSV bytes, one piece per chunk, header first."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(("tubewell_id", "ts") + tuple(columns))
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+def encode_columnar(chunks, columns):
+    """One self-describing encode_binary block per chunk, back to back."""
+    paths = [("tubewell_id",), ("ts",)] + [(col,) for col in columns]
+    typecodes = "qq" + "f" * len(columns)
+    for rows in chunks:
+        yield encode_binary(rows, paths, typecodes)
+
+
+def gzip_stream(pieces):
+    """Compress an iterable of bytes into one gzip member, piece by piece."""
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    for piece in pieces:
+        out = compressor.compress(piece)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def export_stream(db_file, partitions, ids, start, end, columns, fmt="csv", compression="gzip"):
+    """Generator of export bytes; opens its own connection, closed when the stream ends or is abandoned."""
+    conn = open_wal_connection(db_file)
+    chunks = iter_chunks(conn, partitions, ids, start, end, columns)
+    try:
+        pieces = encode_columnar(chunks, columns) if fmt == "columnar" else encode_csv(chunks, columns)
+        if compression == "gzip":
+            pieces = gzip_stream(pieces)
+        yield from pieces
+    finally:
+        chunks.close()  # Closes the open partition cursor before its connection
+        conn.close()
+
+
+def export_filename(start, end, fmt, compression):
+    suffix = ".gz" if compression == "gzip" else ""
+    return f"tubewell_export_{start}_{end}.{EXPORT_EXTENSIONS[fmt]}{suffix}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export raw samples from tubewell_data.db")
+    parser.add_argument("--db", default="tubewell_data.db")
+    parser.add_argument("--ids", help="comma separated tubewell ids (default: all)")
+    parser.add_argument("--from", dest="start", required=True, help="epoch ms, YYYY-MM-DD or ISO datetime")
+    parser.add_argument("--to", dest="end", required=True, help="exclusive; a plain date includes that day")
+    parser.add_argument("--metrics", help="comma separated metrics or columns (default: all)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--compression", choices=EXPORT_COMPRESSION, default="gzip")
+    parser.add_argument("--output", default="-", help="file to write, - for stdout")
+    args = parser.parse_args()
+
+    start = parse_time_param(args.start)
+    end = parse_time_param(args.end)
+    if len(args.end) == 10 and not args.end.isdigit():
+        end += DAY_MS
+    ids = [int(i) for i in args.ids.split(",") if i.strip()] if args.ids else None
+    columns = export_columns(args.metrics.split(",") if args.metrics else None)
+
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    written = 0
+    try:
+        for piece in export_stream(args.db, RawPartitions(args.db), ids, start, end, columns,
+                                   args.format, args.compression):
+            out.write(piece)
+            written += len(piece)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    print(f"[EXPORT] Wrote {written} bytes", file=sys.stderr)
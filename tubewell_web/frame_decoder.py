@@ -0,0 +1,111 @@
+import struct
+from collections import namedtuple
+
+# -----------------------------
+# Register map
+# -----------------------------
+# One entry per decoded field. ``phase`` is None for single-value metrics
+# (e.g. frequency). ``fmt`` is a struct format character, ``scale`` is applied
+# to the raw value and the result is rounded to ``ndigits``.
+Register = namedtuple("Register", "metric phase offset fmt scale ndigits")
+
+# Energy meter frame as published by the field PLCs (big-endian IEEE floats)
+DEFAULT_REGISTER_MAP = (
+    Register("voltage", "A", 13, "f", 1, 1),
+    Register("voltage", "B", 17, "f", 1, 1),
+    Register("voltage", "C", 21, "f", 1, 1),
+    Register("current", "A", 29, "f", 1, 2),
+    Register("current", "B", 33, "f", 1, 2),
+    Register("current", "C", 37, "f", 1, 2),
+    Register("active_power", "A", 49, "f", 1, 2),
+    Register("active_power", "B", 53, "f", 1, 2),
+    Register("active_power", "C", 57, "f", 1, 2),
+    Register("reactive_power", "A", 65, "f", 1, 2),
+    Register("reactive_power", "B", 69, "f", 1, 2),
+    Register("reactive_power", "C", 73, "f", 1, 2),
+    Register("power_factor", "A", 97, "f", 1, 3),
+    Register("power_factor", "B", 101, "f", 1, 3),
+    Register("power_factor", "C", 105, "f", 1, 3),
+    Register("frequency", None, 121, "f", 1, 2),
+)
+
+
+class FrameDecoder:
+    """Decode meter frames with a single precompiled struct built from a register map."""
+
+    def __init__(self, register_map=DEFAULT_REGISTER_MAP, byteorder=">"):
+        registers = sorted(register_map, key=lambda r: r.offset)
+        fmt = byteorder
+        pos = 0
+        for reg in registers:
+            if reg.offset < pos:
+                raise ValueError(f"Register {reg.metric}/{reg.phase} overlaps previous field at offset {reg.offset}")
+            if reg.offset > pos:
+                fmt += f"{reg.offset - pos}x"
+            fmt += reg.fmt
+            pos = reg.offset + struct.calcsize(byteorder + reg.fmt)
+
+        self._struct = struct.Struct(fmt)
+        self._fields = tuple((r.metric, r.phase, r.scale, r.ndigits) for r in registers)
+        self.min_length = self._struct.size
+
+        # Template used to build a fresh result dict per frame
+        self._layout = {}
+        for reg in registers:
+            if reg.phase is not None:
+                self._layout.setdefault(reg.metric, [])
+                self._layout[reg.metric].append(reg.phase)
+            else:
+                self._layout[reg.metric] = None
+
+    def decode(self, buf, offset=0):
+        """Decode one frame from ``buf`` starting at ``offset``. Returns None if too short."""
+        if len(buf) - offset < self.min_length:
+            return None
+        raw = self._struct.unpack_from(buf, offset)
+        result = {metric: ({} if phases is not None else 0) for metric, phases in self._layout.items()}
+        for (metric, phase, scale, ndigits), value in zip(self._fields, raw):
+            if scale != 1:
+                value = value * scale
+            if ndigits is not None:
+                value = round(value, ndigits)
+            if phase is None:
+                result[metric] = value
+            else:
+                result[metric][phase] = value
+        return result
+
+    def decode_hex(self, data_hex):
+        """Decode one hex-encoded frame (whitespace is ignored)."""
+        return self.decode(bytes.fromhex(data_hex))
+
+    def decode_many(self, frames_hex):
+        """Decode a batch of hex frames with one hex conversion; bad or short frames yield None."""
+        chunks = []
+        for data_hex in frames_hex:
+            chunk = "".join(data_hex.split())
+            if len(chunk) % 2:
+                chunk = ""  # Odd length cannot be valid hex, treat as empty frame
+            chunks.append(chunk)
+        try:
+            buf = bytes.fromhex("".join(chunks))
+        except ValueError:
+            # A corrupt frame somewhere in the batch, fall back to per-frame decoding
+            results = []
+            for chunk in chunks:
+                try:
+                    results.append(self.decode_hex(chunk))
+                except ValueError:
+                    results.append(None)
+            return results
+
+        results = []
+        offset = 0
+        for chunk in chunks:
+            size = len(chunk) // 2
+            if size < self.min_length:
+                results.append(None)
+            else:
+                results.append(self.decode(memoryview(buf)[offset:offset + size]))
+            offset += size
+        return results
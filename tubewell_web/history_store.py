@@ -0,0 +1,58 @@
+import json
+import os
+
+
+class HistoryJournal:
+    """Append-only JSON-lines journal of history points added since the last snapshot.
+
+    Each line is ``[seq, tubewell_id, time, values]``. Sequence numbers let a
+    loader skip records that are already contained in the snapshot, so the
+    journal can be truncated lazily after a compaction.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def append(self, records):
+        """Write a batch of records with a single write call."""
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records))
+        self._file.flush()
+
+    @property
+    def size(self):
+        if self._file is not None:
+            return self._file.tell()
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def truncate(self):
+        """Drop all records, called once their contents are safe in a snapshot."""
+        self.close()
+        self._file = open(self.path, "w", encoding="utf-8")
+
+    def replay(self, after_seq=0):
+        """Yield (seq, tubewell_id, time, values) for records newer than ``after_seq``."""
+        try:
+            f = open(self.path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    seq, tubewell_id, when, values = json.loads(line)
+                except ValueError:
+                    # Torn write from a crash, only possible on the last line
+                    print(f"[history] Ignoring damaged journal line in {self.path}")
+                    continue
+                if seq > after_seq:
+                    yield seq, tubewell_id, when, values
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,182 @@
+import queue
+import threading
+import time
+import zlib
+
+OVERFLOW_POLICIES = ("block", "drop_oldest")
+
+
+class IngestPipeline:
+    """Hand incoming messages from the network thread to a pool of worker threads.
+
+    ``submit`` only timestamps and enqueues, so the caller (paho's loop) is
+    back reading packets immediately. Every worker owns a bounded queue;
+    messages with the same ``key`` always land on the same worker, which keeps
+    frames of one device in arrival order. When a queue is full the
+    ``overflow`` policy either blocks the producer or discards the oldest
+    queued message.
+
+    ``mark`` and ``wait_for`` let another thread wait until everything
+    submitted up to a point has been handled (or dropped), without stopping
+    the producer.
+    """
+
+    def __init__(self, handler, workers=2, max_queue=10000, overflow="block", name="ingest"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}, not {overflow!r}")
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.name = name
+
+        per_worker = max(1, max_queue // self.workers)
+        self._queues = [queue.Queue(per_worker) for _ in range(self.workers)]
+        self._threads = []
+        self._next = 0
+        self._stats_lock = threading.Lock()
+        self._retired_changed = threading.Condition(self._stats_lock)
+        self._stopping = False
+        # Per worker: messages put on its queue, and those handled or dropped since
+        self._enqueued = [0] * self.workers
+        self._retired = [0] * self.workers
+
+        # Counters exposed for monitoring
+        self.submitted = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.queue_seconds = 0.0    # total time messages waited in a queue
+        self.handler_seconds = 0.0  # total time spent in the handler
+        self.max_queue_seconds = 0.0
+        self.last_queue_seconds = 0.0
+        self.last_handler_seconds = 0.0
+
+    @property
+    def depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self):
+        done = self.processed or 1
+        return {
+            "workers": self.workers,
+            "overflow": self.overflow,
+            "depth": self.depth,
+            "capacity": self.max_queue,
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "avg_queue_ms": round(self.queue_seconds / done * 1000, 3),
+            "max_queue_ms": round(self.max_queue_seconds * 1000, 3),
+            "last_queue_ms": round(self.last_queue_seconds * 1000, 3),
+            "avg_handler_ms": round(self.handler_seconds / done * 1000, 3),
+            "last_handler_ms": round(self.last_handler_seconds * 1000, 3),
+        }
+
+    # -----------------------------
+    # Lifecycle
+    # -----------------------------
+    def start(self):
+        if self._threads:
+            return
+        self._stopping = False
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, args=(i,), name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=10):
+        """Process everything already queued, then stop the workers."""
+        if not self._threads:
+            return
+        self._stopping = True
+        for q in self._queues:
+            q.put(None)
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0, deadline - time.monotonic()))
+        self._threads = []
+        print(f"[{self.name}] Stopped after {self.processed} messages ({self.dropped} dropped)")
+
+    # -----------------------------
+    # Producer side
+    # -----------------------------
+    def submit(self, item, key=None):
+        """Queue ``item`` for the handler; returns False if it could not be queued."""
+        if self._stopping:
+            return False
+        if key is None:
+            i = self._next % self.workers
+            self._next += 1
+        else:
+            i = zlib.crc32(key) % self.workers
+        q = self._queues[i]
+        entry = (time.monotonic(), item)
+        self.submitted += 1
+        with self._stats_lock:
+            self._enqueued[i] += 1
+        if self.overflow == "block":
+            q.put(entry)
+            return True
+        while True:
+            try:
+                q.put_nowait(entry)
+                return True
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                    q.task_done()
+                    with self._stats_lock:
+                        self.dropped += 1
+                        self._retired[i] += 1
+                        self._retired_changed.notify_all()
+                except queue.Empty:
+                    pass
+
+    def mark(self):
+        """Position of the queues now, for ``wait_for``."""
+        with self._stats_lock:
+            return list(self._enqueued)
+
+    def wait_for(self, mark, timeout=None):
+        """Wait until every message submitted before ``mark`` was handled or dropped.
+
+        Returns False if that did not happen within ``timeout`` seconds.
+        """
+        with self._retired_changed:
+            return self._retired_changed.wait_for(
+                lambda: all(retired >= marked for retired, marked in zip(self._retired, mark)), timeout)
+
+    # -----------------------------
+    # Worker side
+    # -----------------------------
+    def _run(self, i):
+        q = self._queues[i]
+        while True:
+            entry = q.get()
+            try:
+                if entry is None:
+                    return
+                queued_at, item = entry
+                started = time.monotonic()
+                try:
+                    self.handler(item)
+                    failed = 0
+                except Exception as e:
+                    failed = 1
+                    print(f"[{self.name}] Handler failed: {e}")
+                finished = time.monotonic()
+                with self._stats_lock:
+                    self.processed += 1
+                    self.errors += failed
+                    self.last_queue_seconds = started - queued_at
+                    self.last_handler_seconds = finished - started
+                    self.queue_seconds += self.last_queue_seconds
+                    self.handler_seconds += self.last_handler_seconds
+                    if self.last_queue_seconds > self.max_queue_seconds:
+                        self.max_queue_seconds = self.last_queue_seconds
+                    self._retired[i] += 1
+                    self._retired_changed.notify_all()
+            finally:
+                q.task_done()
@@ -0,0 +1,82 @@
+import time
+
+PHASES = ("A", "B", "C")
+PHASE_METRICS = ("voltage", "current", "active_power", "reactive_power", "power_factor")
+
+# Toggle events kept per tubewell (oldest are dropped)
+EVENTS_KEPT = 100
+
+_ZERO3 = (0, 0, 0)
+
+# Every field except ``name``, with its value for a tubewell that has not reported yet
+_DEFAULTS = {
+    "status": False,
+    "voltage": _ZERO3,
+    "current": _ZERO3,
+    "active_power": _ZERO3,
+    "reactive_power": _ZERO3,
+    "power_factor": _ZERO3,
+    "frequency": 0,
+    "total_runtime": 0,
+    "session_start": None,
+    "updated_ms": None,
+    "events": (),
+}
+
+
+class TubewellState:
+    """Immutable live state of one tubewell.
+
+    Ingest builds a new record for every decoded frame and publishes it with a
+    single reference assignment, so a reader that grabs the current record
+    sees all phases from the same frame without taking a lock. Three-phase
+    metrics are (A, B, C) tuples; ``events`` holds the toggle history.
+    """
+
+    __slots__ = ("name",) + tuple(_DEFAULTS)
+
+    def __init__(self, name, **fields):
+        object.__setattr__(self, "name", name)
+        for field, default in _DEFAULTS.items():
+            object.__setattr__(self, field, fields.pop(field, default))
+        if fields:
+            raise TypeError(f"Unknown TubewellState fields: {', '.join(fields)}")
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TubewellState is immutable, use replace()")
+
+    def __repr__(self):
+        return f"TubewellState({self.name!r}, status={self.status}, updated_ms={self.updated_ms})"
+
+    def replace(self, **changes):
+        fields = {field: getattr(self, field) for field in _DEFAULTS}
+        fields.update(changes)
+        return TubewellState(fields.pop("name", self.name), **fields)
+
+    def with_frame(self, values, ts):
+        """New state with a decoded frame (FrameDecoder.decode output) applied.
+
+        ``status`` is left alone; it follows the run sessions, see sessions.SessionTracker.
+        """
+        changes = {"updated_ms": ts}
+        for metric, value in values.items():
+            changes[metric] = tuple(value[p] for p in PHASES) if isinstance(value, dict) else value
+        return self.replace(**changes)
+
+    def with_event(self, **event):
+        return self.replace(events=(self.events + (event,))[-EVENTS_KEPT:])
+
+    def phases(self, metric):
+        """One three-phase metric as {"A": .., "B": .., "C": ..}."""
+        return dict(zip(PHASES, getattr(self, metric)))
+
+    def runtime(self, now=None):
+        """Total runtime in seconds, including the running session."""
+        if self.status and self.session_start:
+            return self.total_runtime + int((now or time.time()) - self.session_start)
+        return self.total_runtime
+
+    def sample(self):
+        """Values in db_schema.RAW_COLUMNS order."""
+        return (self.voltage + self.current + self.active_power + self.reactive_power
+                + self.power_factor + (self.frequency,))
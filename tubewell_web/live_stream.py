@@ -0,0 +1,120 @@
+import json
+import queue
+import threading
+
+
+def _diff(old, new):
+    """Keys of ``new`` whose values differ from ``old``; nested dicts are compared per key."""
+    changes = {}
+    for key, value in new.items():
+        prev = old.get(key)
+        if isinstance(value, dict) and isinstance(prev, dict):
+            nested = {k: v for k, v in value.items() if prev.get(k) != v}
+            if nested:
+                changes[key] = nested
+        elif value != prev:
+            changes[key] = value
+    return changes
+
+
+def _event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class Subscriber:
+    def __init__(self, ids, maxsize):
+        self.ids = ids  # set of tubewell ids, or None for all of them
+        self.queue = queue.Queue(maxsize)
+        self.closed = False
+
+
+class LiveBroadcaster:
+    """Fan live tubewell updates out to Server-Sent Events subscribers.
+
+    ``publish`` remembers the last state sent for each tubewell and only
+    forwards the values that changed, encoded once and shared by every
+    subscriber. Each subscriber has a bounded queue; one that falls
+    ``max_queue`` events behind is dropped and left to reconnect, so a slow
+    browser never holds up the MQTT thread or grows memory. ``version`` is
+    bumped on every publish that changed something.
+    """
+
+    def __init__(self, max_queue=64, keepalive=15):
+        self.max_queue = max_queue
+        self.keepalive = keepalive
+        self._subscribers = set()
+        self._last = {}
+        self._lock = threading.Lock()
+        self.version = 0
+        self.events_published = 0
+        self.subscribers_dropped = 0
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def subscribe(self, ids=None):
+        sub = Subscriber(ids, self.max_queue)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        sub.closed = True
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def publish(self, tubewell_id, state):
+        """Send the parts of ``state`` that changed since the last publish for this tubewell."""
+        with self._lock:
+            changes = _diff(self._last.get(tubewell_id, {}), state)
+            if not changes:
+                return
+            self._last[tubewell_id] = {k: dict(v) if isinstance(v, dict) else v for k, v in state.items()}
+            self.version += 1
+            changes["id"] = tubewell_id
+            dropped = self._fan_out(tubewell_id, _event("update", changes))
+        if dropped:
+            print(f"[STREAM] Dropped {len(dropped)} slow subscriber(s)")
+
+    def notify(self, tubewell_id, name, data):
+        """Send a one-off ``name`` event (e.g. an alert) about ``tubewell_id``; it is not diffed or remembered."""
+        with self._lock:
+            dropped = self._fan_out(tubewell_id, _event(name, dict(data, id=tubewell_id)))
+        if dropped:
+            print(f"[STREAM] Dropped {len(dropped)} slow subscriber(s)")
+
+    def _fan_out(self, tubewell_id, message):
+        """Queue ``message`` for every subscriber of ``tubewell_id``; called with the lock held."""
+        self.events_published += 1
+        dropped = []
+        for sub in self._subscribers:
+            if sub.ids is not None and tubewell_id not in sub.ids:
+                continue
+            try:
+                sub.queue.put_nowait(message)
+            except queue.Full:
+                dropped.append(sub)
+        for sub in dropped:
+            sub.closed = True
+            self._subscribers.discard(sub)
+        self.subscribers_dropped += len(dropped)
+        return dropped
+
+    def stream(self, sub, snapshots):
+        """Generate the SSE body: one ``snapshot`` event per tubewell, then ``update`` (and ``notify``) events."""
+        try:
+            yield "retry: 3000\n\n"
+            for tubewell_id, state in snapshots:
+                yield _event("snapshot", dict(state, id=tubewell_id))
+            while not sub.closed:
+                try:
+                    message = sub.queue.get(timeout=self.keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if sub.closed:
+                    break
+                yield message
+        finally:
+            self.unsubscribe(sub)
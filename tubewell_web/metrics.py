@@ -0,0 +1,262 @@
+import bisect
+import itertools
+import threading
+import time
+import weakref
+
+# Latency buckets in seconds, from sub-millisecond decode times up to slow queries
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class _Holder:
+    """Owner of one thread's cells; it goes away with the thread's locals."""
+
+    __slots__ = ("cells", "__weakref__")
+
+    def __init__(self, cells):
+        self.cells = cells
+
+
+class _Cells:
+    """Per-thread accumulators.
+
+    Each thread gets its own list on first use and is the only writer to it,
+    so updates need no lock. A scrape sums the lists of every live thread
+    plus ``_base``; when a thread exits its list is folded into ``_base``, so
+    a server that starts a thread per request does not pile up lists. A
+    value being added concurrently shows up in the next scrape instead.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._live = {}  # token -> cells of a running thread
+        self._base = [0] * size  # totals of threads that have exited
+        self._tokens = itertools.count()
+        self._lock = threading.Lock()
+
+    def get(self):
+        try:
+            return self._local.holder.cells
+        except AttributeError:
+            cells = [0] * self._size
+            holder = self._local.holder = _Holder(cells)
+            token = next(self._tokens)
+            with self._lock:
+                self._live[token] = cells
+            weakref.finalize(holder, self._retire, token)
+            return cells
+
+    def _retire(self, token):
+        with self._lock:
+            cells = self._live.pop(token)
+            for i, value in enumerate(cells):
+                self._base[i] += value
+
+    def totals(self):
+        with self._lock:
+            all_cells = list(self._live.values())
+            totals = list(self._base)
+        for cells in all_cells:
+            for i in range(self._size):
+                totals[i] += cells[i]
+        return totals
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        self._function = None
+
+    def labels(self, *values):
+        """Child metric for one combination of label values (created on first use)."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def set_function(self, function):
+        """Read the value from ``function()`` at scrape time instead (unlabelled metrics only)."""
+        self._function = function
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if self._function is not None:
+            lines.append(f"{self.name} {_format_value(self._function())}")
+            return lines
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("_cells",)
+
+    def __init__(self):
+        self._cells = _Cells(1)
+
+    def inc(self, amount=1):
+        self._cells.get()[0] += amount
+
+    @property
+    def value(self):
+        return self._cells.totals()[0]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _render_child(self, key, child):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"]
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def _render_child(self, key, child):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"]
+
+
+class _HistogramChild:
+    __slots__ = ("_buckets", "_cells")
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        # One cell per bucket, one for +Inf, then the running sum
+        self._cells = _Cells(len(buckets) + 2)
+
+    def observe(self, value):
+        cells = self._cells.get()
+        cells[bisect.bisect_left(self._buckets, value)] += 1
+        cells[-1] += value
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("_child", "_started")
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._started)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        """Context manager observing the duration of its block in seconds."""
+        return self.labels().time()
+
+    def _render_child(self, key, child):
+        totals = child._cells.totals()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), totals):
+            cumulative += count
+            le = 'le="' + _format_value(float(bound)) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(totals[-1])}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named counters, gauges and histograms rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
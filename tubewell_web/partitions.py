@@ -0,0 +1,148 @@
+import calendar
+import re
+import threading
+import time
+
+from db_schema import RAW_INSERT_SQL, create_raw_table
+from db_writer import open_wal_connection
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+_TABLE_RE = re.compile(r"^raw_data_(\d{8})$")
+
+
+class RawPartitions:
+    """Route raw samples to one table per time partition.
+
+    Partitions are named ``raw_data_YYYYMMDD`` after their (UTC) start day and
+    cover ``days`` days each. The width is stored in the database on first use
+    so every process, and the migration tool, agrees on it. Retention drops
+    whole partitions instead of deleting rows.
+    """
+
+    def __init__(self, db_file, days=1):
+        self.db_file = db_file
+        conn = open_wal_connection(db_file)
+        try:
+            with conn:
+                row = conn.execute("SELECT value FROM storage_settings WHERE key = 'raw_partition_days'").fetchone()
+                if row is None:
+                    conn.execute("INSERT INTO storage_settings (key, value) VALUES ('raw_partition_days', ?)", (days,))
+                elif int(row[0]) != days:
+                    print(f"[PARTITIONS] Database uses {row[0]}-day partitions, ignoring configured {days}")
+                    days = int(row[0])
+        finally:
+            conn.close()
+        self.days = days
+        self.width = days * DAY_MS
+        self._known = set()
+        self._lock = threading.Lock()
+
+    # -----------------------------
+    # Naming
+    # -----------------------------
+    def partition_start(self, ts):
+        return ts - ts % self.width
+
+    def table_for(self, ts):
+        return "raw_data_" + time.strftime("%Y%m%d", time.gmtime(self.partition_start(ts) // 1000))
+
+    def tables(self, conn, start=None, end=None):
+        """List (partition_start, partition_end, table) overlapping [start, end), oldest first."""
+        result = []
+        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'raw_data_%'"):
+            match = _TABLE_RE.match(name)
+            if not match:
+                continue
+            p_start = calendar.timegm(time.strptime(match.group(1), "%Y%m%d")) * 1000
+            p_end = p_start + self.width
+            if (start is None or p_end > start) and (end is None or p_start < end):
+                result.append((p_start, p_end, name))
+        result.sort()
+        return result
+
+    # -----------------------------
+    # Writing
+    # -----------------------------
+    def ensure(self, table, conn=None):
+        """Create ``table`` if this process has not seen it yet."""
+        if table in self._known:
+            return
+        with self._lock:
+            if table in self._known:
+                return
+            if conn is None:
+                own = open_wal_connection(self.db_file)
+                try:
+                    with own:
+                        create_raw_table(own, table)
+                finally:
+                    own.close()
+            else:
+                create_raw_table(conn, table)
+            self._known.add(table)
+
+    def insert_sql(self, ts):
+        """INSERT statement for the partition holding ``ts``, creating it on first use."""
+        table = self.table_for(ts)
+        self.ensure(table)
+        return RAW_INSERT_SQL.format(table=table)
+
+    def insert_rows(self, conn, rows, ignore_existing=False):
+        """Insert (tubewell_id, ts, *RAW_COLUMNS) rows on ``conn``, grouped per partition.
+
+        With ``ignore_existing`` rows whose key is already stored are skipped
+        instead of failing the insert.
+        """
+        groups = {}
+        for row in rows:
+            groups.setdefault(self.table_for(row[1]), []).append(row)
+        for table, group in groups.items():
+            create_raw_table(conn, table)
+            sql = RAW_INSERT_SQL.format(table=table)
+            if ignore_existing:
+                sql = sql.replace("INSERT", "INSERT OR IGNORE", 1)
+            conn.executemany(sql, group)
+
+    # -----------------------------
+    # Reading
+    # -----------------------------
+    def select(self, conn, sql, params, start=None, end=None, newest_first=False, limit=None):
+        """Run ``sql`` (with a ``{table}`` placeholder) against each partition in range.
+
+        Rows are concatenated partition by partition, so per-partition ORDER BY
+        gives a globally ordered result. With ``limit`` later partitions are
+        skipped once enough rows have been collected.
+        """
+        tables = self.tables(conn, start, end)
+        if newest_first:
+            tables.reverse()
+        rows = []
+        for _, _, table in tables:
+            rows.extend(conn.execute(sql.format(table=table), params).fetchall())
+            if limit is not None and len(rows) >= limit:
+                return rows[:limit]
+        return rows
+
+    def newest_ts(self, conn, since=0):
+        """Timestamp of the newest sample at or after ``since``, or None."""
+        for _, _, table in reversed(self.tables(conn, since)):
+            ts = conn.execute(f"SELECT MAX(ts) FROM {table} WHERE ts >= ?", (since,)).fetchone()[0]
+            if ts is not None:
+                return ts
+        return None
+
+    # -----------------------------
+    # Retention
+    # -----------------------------
+    def expire(self, conn, cutoff):
+        """Drop every partition that ends at or before ``cutoff``. Returns dropped table names."""
+        dropped = []
+        with conn:
+            for _, p_end, table in self.tables(conn, end=cutoff):
+                if p_end <= cutoff:
+                    conn.execute(f"DROP TABLE {table}")
+                    dropped.append(table)
+        with self._lock:
+            self._known.difference_update(dropped)
+        return dropped
@@ -0,0 +1,82 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """LRU cache of encoded response bodies, bounded by their total size.
+
+    Entries are either final (their data can no longer change) or tied to
+    the current aggregation ``watermark``; ``advance`` moves the watermark
+    and drops every non-final entry, which is the only invalidation there
+    is. Callers should put the watermark they read into the key of a
+    non-final entry, so a body built just before the watermark moved is
+    never served under the new one. Each body is stored with a strong ETag
+    (a hash of its bytes) and the response headers that describe it.
+    """
+
+    def __init__(self, max_bytes, watermark=0):
+        self.max_bytes = max_bytes
+        self.watermark = watermark
+        self._entries = OrderedDict()  # key -> (body, etag, headers, final), least recently used first
+        self._lock = threading.Lock()
+        self.size = 0
+
+        # Counters exposed for monitoring
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """(body, etag, headers) for ``key``, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return entry[:3]
+
+    def put(self, key, body, final, headers=None):
+        """Store ``body`` (bytes) and return (body, etag, headers); bodies over the budget are not kept."""
+        etag = hashlib.sha1(body).hexdigest()
+        headers = headers or {}
+        if len(body) > self.max_bytes:
+            return body, etag, headers
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._entries[key] = (body, etag, headers, final)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (evicted, _, _, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+        return body, etag, headers
+
+    def advance(self, watermark):
+        """Move to a new aggregation watermark, dropping entries that were not final."""
+        with self._lock:
+            if watermark == self.watermark:
+                return 0
+            self.watermark = watermark
+            stale = [key for key, (_, _, _, final) in self._entries.items() if not final]
+            for key in stale:
+                self.size -= len(self._entries.pop(key)[0])
+        return len(stale)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "watermark": self.watermark,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
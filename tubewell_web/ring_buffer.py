@@ -0,0 +1,74 @@
+from array import array
+
+
+class HistoryRing:
+    """Fixed-capacity columnar ring buffer of timestamped samples.
+
+    Timestamps (epoch ms) and every value column live in their own
+    preallocated typed array, so an append is O(1), nothing is copied when old
+    samples fall off and memory stays bounded by ``capacity``. Readers get
+    memoryview slices over the arrays; callers must not hold them across an
+    ``append`` from another thread without a lock.
+    """
+
+    def __init__(self, columns, capacity=500, typecode="f", digits=None):
+        self.columns = tuple(columns)
+        self.capacity = capacity
+        self.digits = tuple(digits) if digits is not None else None
+        self.ts = array("q", bytes(8 * capacity))
+        self.data = tuple(array(typecode, bytes(array(typecode).itemsize * capacity)) for _ in self.columns)
+        self._next = 0   # slot the next sample is written to
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, ts, values):
+        """Store one sample; ``values`` follow the order of ``columns``."""
+        i = self._next
+        self.ts[i] = ts
+        for column, value in zip(self.data, values):
+            column[i] = value
+        self._next = (i + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def last_ts(self):
+        return self.ts[self._next - 1] if self._count else None
+
+    def segments(self, last=None):
+        """Chronological (start, stop) index ranges of the newest ``last`` samples (at most two)."""
+        n = self._count if last is None else min(last, self._count)
+        if n <= 0:
+            return []
+        start = (self._next - n) % self.capacity
+        if start + n <= self.capacity:
+            return [(start, start + n)]
+        return [(start, self.capacity), (0, start + n - self.capacity)]
+
+    def view(self, column=None, last=None):
+        """Zero-copy memoryview slices over the timestamps, or over one value column."""
+        arr = self.ts if column is None else self.data[self.columns.index(column)]
+        mv = memoryview(arr)
+        return [mv[a:b] for a, b in self.segments(last)]
+
+    def to_lists(self, last=None):
+        """Copy the newest ``last`` samples out as {"time": [...], column: [...]}."""
+        result = {"time": [t for part in self.view(None, last) for t in part.tolist()]}
+        for idx, name in enumerate(self.columns):
+            values = [v for part in self.view(name, last) for v in part.tolist()]
+            ndigits = self.digits[idx] if self.digits is not None else None
+            if ndigits == 0:
+                values = [int(round(v)) for v in values]
+            elif ndigits is not None:
+                # float32 storage, round back to the precision the value was decoded with
+                values = [round(v, ndigits) for v in values]
+            result[name] = values
+        return result
+
+    def load_lists(self, lists):
+        """Append samples previously produced by ``to_lists``; missing columns read as 0."""
+        times = lists.get("time", [])
+        columns = [lists.get(name) or [0] * len(times) for name in self.columns]
+        for i, ts in enumerate(times):
+            self.append(ts, [column[i] for column in columns])
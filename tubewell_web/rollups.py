@@ -0,0 +1,141 @@
+from db_schema import RAW_COLUMNS, ROLLUP_STATS
+
+# -----------------------------
+# Rollup hierarchy
+# -----------------------------
+# (name, bucket width in ms), finest first. Each level is built from the one
+# before it, the first one from the raw partitions. Day buckets are aligned to
+# UTC. Raw partitions are whole days, so no bucket spans two partitions.
+RESOLUTIONS = (
+    ("1m", 60 * 1000),
+    ("15m", 15 * 60 * 1000),
+    ("1h", 60 * 60 * 1000),
+    ("1d", 24 * 60 * 60 * 1000),
+)
+RESOLUTION_MS = dict(RESOLUTIONS)
+
+# A chart range uses the coarsest resolution that still yields this many buckets
+MIN_CHART_POINTS = 96
+
+_TARGETS = ", ".join(f"{col}_{stat}" for col in RAW_COLUMNS for stat in ROLLUP_STATS)
+
+_FROM_RAW_SQL = f'''
+    INSERT OR REPLACE INTO aggregated_data
+    (tubewell_id, resolution, bucket_start, data_points, last_ts, {_TARGETS})
+    SELECT g.tubewell_id, :res, g.bucket, g.n, g.last_ts,
+           {", ".join(f"g.{c}_avg, g.{c}_min, g.{c}_max, r.{c}" for c in RAW_COLUMNS)}
+    FROM (
+        SELECT tubewell_id, ts - ts % :res AS bucket, COUNT(*) AS n, MAX(ts) AS last_ts,
+               {", ".join(f"AVG({c}) AS {c}_avg, MIN({c}) AS {c}_min, MAX({c}) AS {c}_max" for c in RAW_COLUMNS)}
+        FROM {{table}}
+        WHERE ts >= :start AND ts < :end
+        GROUP BY tubewell_id, bucket
+    ) g
+    JOIN {{table}} r ON r.tubewell_id = g.tubewell_id AND r.ts = g.last_ts
+'''
+
+# Averages are re-weighted by the number of samples behind each finer bucket
+_FROM_FINER_SQL = f'''
+    INSERT OR REPLACE INTO aggregated_data
+    (tubewell_id, resolution, bucket_start, data_points, last_ts, {_TARGETS})
+    SELECT g.tubewell_id, :res, g.bucket, g.n, g.last_ts,
+           {", ".join(f"g.{c}_avg, g.{c}_min, g.{c}_max, f.{c}_last" for c in RAW_COLUMNS)}
+    FROM (
+        SELECT tubewell_id, bucket_start - bucket_start % :res AS bucket,
+               SUM(data_points) AS n, MAX(last_ts) AS last_ts,
+               {", ".join(
+                   f"SUM({c}_avg * data_points) / SUM(CASE WHEN {c}_avg IS NOT NULL THEN data_points END) AS {c}_avg, "
+                   f"MIN({c}_min) AS {c}_min, MAX({c}_max) AS {c}_max" for c in RAW_COLUMNS)}
+        FROM aggregated_data
+        WHERE resolution = :src AND bucket_start >= :start AND bucket_start < :end
+        GROUP BY tubewell_id, bucket
+    ) g
+    LEFT JOIN aggregated_data f ON f.tubewell_id = g.tubewell_id AND f.resolution = :src
+        AND f.bucket_start = g.last_ts - g.last_ts % :src
+'''
+
+
+def _roll_level(conn, partitions, level, start, end):
+    """Recompute every bucket of ``level`` that starts in [start, end)."""
+    res = RESOLUTIONS[level][1]
+    params = {"res": res, "start": start - start % res, "end": end}
+    if level == 0:
+        rows = 0
+        for _, _, table in partitions.tables(conn, params["start"], end):
+            rows += conn.execute(_FROM_RAW_SQL.format(table=table), params).rowcount
+        return rows
+    params["src"] = RESOLUTIONS[level - 1][1]
+    return conn.execute(_FROM_FINER_SQL, params).rowcount
+
+
+def run_rollups(conn, partitions, final_before=None):
+    """Incrementally bring every resolution up to date. Returns rows written.
+
+    Each level keeps a watermark at the start of its newest (possibly still
+    open) bucket; that bucket and anything newer is recomputed on each run.
+    ``final_before`` is the time before which every raw sample is known to be
+    stored: no watermark moves past it, and a coarser level's watermark never
+    passes the one of the level it is built from. Without it the newest
+    sample is taken as the limit.
+    """
+    watermarks = dict(conn.execute("SELECT resolution, watermark FROM rollup_state"))
+    total = 0
+    bound = final_before
+    with conn:
+        for level, (name, res) in enumerate(RESOLUTIONS):
+            start = watermarks.get(res, 0)
+            if level == 0:
+                newest = partitions.newest_ts(conn, start)
+            else:
+                newest = conn.execute(
+                    "SELECT MAX(bucket_start) FROM aggregated_data WHERE resolution = ? AND bucket_start >= ?",
+                    (RESOLUTIONS[level - 1][1], start)).fetchone()[0]
+            if newest is None:
+                bound = start
+                continue
+            rows = _roll_level(conn, partitions, level, start, newest + 1)
+            total += rows
+            limit = newest if bound is None else min(newest, bound)
+            bound = max(start, limit - limit % res)
+            conn.execute("INSERT OR REPLACE INTO rollup_state (resolution, watermark) VALUES (?, ?)",
+                         (res, bound))
+            print(f"[AGGREGATION] {name}: {rows} buckets from {start}")
+    return total
+
+
+def rebuild_rollups(conn, partitions, start, end):
+    """Recompute all resolutions for [start, end], e.g. after back-filling raw data."""
+    total = 0
+    with conn:
+        for level, (name, res) in enumerate(RESOLUTIONS):
+            total += _roll_level(conn, partitions, level, start, end - end % res + res)
+    return total
+
+
+def rollup_watermark(conn):
+    """Start of the newest finest-level bucket; everything before it is final."""
+    row = conn.execute("SELECT watermark FROM rollup_state WHERE resolution = ?", (RESOLUTIONS[0][1],)).fetchone()
+    return row[0] if row else 0
+
+
+def choose_resolution(start, end, min_points=MIN_CHART_POINTS):
+    """Pick the coarsest resolution giving at least ``min_points`` buckets in [start, end)."""
+    span = end - start
+    for name, res in reversed(RESOLUTIONS):
+        if span // res >= min_points:
+            return name
+    return RESOLUTIONS[0][0]
+
+
+def query_rollups(conn, tubewell_id, resolution, start, end, stats=("avg",)):
+    """Fetch rollup rows for one well as (bucket_start, data_points, *values).
+
+    Values are ordered by RAW_COLUMNS, then by ``stats`` within each column.
+    """
+    columns = ", ".join(f"{col}_{stat}" for col in RAW_COLUMNS for stat in stats)
+    return conn.execute(f'''
+        SELECT bucket_start, data_points, {columns}
+        FROM aggregated_data
+        WHERE tubewell_id = ? AND resolution = ? AND bucket_start >= ? AND bucket_start < ?
+        ORDER BY bucket_start
+    ''', (tubewell_id, RESOLUTION_MS[resolution], start, end)).fetchall()
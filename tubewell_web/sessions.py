@@ -0,0 +1,169 @@
+import threading
+from collections import namedtuple
+
+from partitions import DAY_MS
+
+# A pump counts as running while any phase draws at least this many amps
+RUN_CURRENT_THRESHOLD = 0.5
+
+# A running pump that sends no frame for this long stopped at its last frame
+SESSION_STOP_GAP_MS = 60 * 1000
+
+SESSION_UPSERT_SQL = "INSERT OR REPLACE INTO sessions (tubewell_id, start_ms, end_ms, last_ms) VALUES (?, ?, ?, ?)"
+
+# end_ms is None while the session is still open
+Session = namedtuple("Session", "tubewell_id start_ms end_ms last_ms")
+
+
+class SessionTracker:
+    """Run/stop sessions inferred from telemetry.
+
+    A session opens on the first frame whose current crosses
+    ``current_threshold`` and closes on the first frame below it, or at the
+    last running frame when nothing arrives for ``stop_gap_ms``. Every
+    opened or closed session is passed to ``on_change(session)`` so it can be
+    written to the ``sessions`` table as it happens. Closed runtime per well
+    is kept in memory, so live state never has to sum the table.
+    """
+
+    def __init__(self, current_threshold=RUN_CURRENT_THRESHOLD, stop_gap_ms=SESSION_STOP_GAP_MS, on_change=None):
+        self.current_threshold = current_threshold
+        self.stop_gap_ms = stop_gap_ms
+        self.on_change = on_change
+        self._open = {}        # tubewell_id -> (start_ms, last running frame ms)
+        self._runtime_ms = {}  # tubewell_id -> total ms of closed sessions
+        self._lock = threading.Lock()
+
+    def _close(self, tubewell_id, start_ms, end_ms):
+        self._runtime_ms[tubewell_id] = self._runtime_ms.get(tubewell_id, 0) + end_ms - start_ms
+        return Session(tubewell_id, start_ms, end_ms, end_ms)
+
+    def observe(self, tubewell_id, current, ts):
+        """Feed the phase currents of one frame; returns the sessions it closed or opened, in order."""
+        running = max(current) >= self.current_threshold
+        changes = []
+        with self._lock:
+            session = self._open.get(tubewell_id)
+            if session is not None:
+                start_ms, last_ms = session
+                if ts - last_ms > self.stop_gap_ms:
+                    changes.append(self._close(tubewell_id, start_ms, last_ms))
+                    session = None
+                elif not running:
+                    changes.append(self._close(tubewell_id, start_ms, ts))
+                    session = None
+            if running:
+                if session is None:
+                    session = (ts, ts)
+                    changes.append(Session(tubewell_id, ts, None, ts))
+                else:
+                    session = (session[0], ts)
+                self._open[tubewell_id] = session
+            else:
+                self._open.pop(tubewell_id, None)
+        if self.on_change is not None:
+            for change in changes:
+                self.on_change(change)
+        return changes
+
+    def close_stale(self, now):
+        """Close sessions whose last running frame is older than ``stop_gap_ms``; returns them."""
+        closed = []
+        with self._lock:
+            for tubewell_id, (start_ms, last_ms) in list(self._open.items()):
+                if now - last_ms > self.stop_gap_ms:
+                    del self._open[tubewell_id]
+                    closed.append(self._close(tubewell_id, start_ms, last_ms))
+        if self.on_change is not None:
+            for change in closed:
+                self.on_change(change)
+        return closed
+
+    def running(self):
+        """{tubewell_id: start_ms} of every open session."""
+        with self._lock:
+            return {tid: start_ms for tid, (start_ms, _) in self._open.items()}
+
+    def state_fields(self, tubewell_id):
+        """status / session_start / total_runtime (seconds) for a TubewellState."""
+        session = self._open.get(tubewell_id)
+        return {
+            "status": session is not None,
+            "session_start": session[0] / 1000 if session else None,
+            "total_runtime": self._runtime_ms.get(tubewell_id, 0) // 1000,
+        }
+
+    # -----------------------------
+    # Persistence
+    # -----------------------------
+    def checkpoint(self, conn):
+        """Record the last running frame of open sessions, so a restart knows where they stood."""
+        with self._lock:
+            rows = [(tid, start_ms, None, last_ms) for tid, (start_ms, last_ms) in self._open.items()]
+        with conn:
+            conn.executemany(SESSION_UPSERT_SQL, rows)
+        return len(rows)
+
+    def restore(self, conn):
+        """Load open sessions and closed runtime totals from the sessions table."""
+        with self._lock:
+            self._runtime_ms = dict(conn.execute(
+                "SELECT tubewell_id, SUM(end_ms - start_ms) FROM sessions WHERE end_ms IS NOT NULL GROUP BY tubewell_id"))
+            self._open = {tid: (start_ms, last_ms) for tid, start_ms, last_ms in conn.execute(
+                "SELECT tubewell_id, start_ms, last_ms FROM sessions WHERE end_ms IS NULL")}
+        return len(self._open)
+
+
+# -----------------------------
+# Queries
+# -----------------------------
+def _id_filter(ids):
+    if ids is None:
+        return "", []
+    ids = list(dict.fromkeys(ids))
+    return f" AND tubewell_id IN ({', '.join('?' * len(ids))})", ids
+
+
+def sessions_between(conn, start, end, ids=None):
+    """Sessions overlapping [start, end), oldest first; open ones have end_ms None.
+
+    Both halves are range seeks on the end_ms index (open sessions have a
+    NULL end_ms and sort first), so older history is never read.
+    """
+    where, params = _id_filter(ids)
+    rows = conn.execute(f'''
+        SELECT tubewell_id, start_ms, end_ms, last_ms FROM sessions
+        WHERE end_ms > ? AND start_ms < ?{where}
+        UNION ALL
+        SELECT tubewell_id, start_ms, end_ms, last_ms FROM sessions
+        WHERE end_ms IS NULL AND start_ms < ?{where}
+        ORDER BY start_ms
+    ''', [start, end] + params + [end] + params)
+    return [Session(*row) for row in rows]
+
+
+def running_sessions(conn, ids=None):
+    """Open sessions, i.e. the wells running now."""
+    where, params = _id_filter(ids)
+    rows = conn.execute(f"SELECT tubewell_id, start_ms, end_ms, last_ms FROM sessions WHERE end_ms IS NULL{where}",
+                        params)
+    return [Session(*row) for row in rows]
+
+
+def runtime_by_day(conn, start, end, now, ids=None):
+    """{tubewell_id: {day_start_ms: runtime seconds}} for UTC days in [start, end).
+
+    Open sessions count up to ``now``.
+    """
+    start -= start % DAY_MS
+    result = {}
+    for session in sessions_between(conn, start, end, ids):
+        begin = max(session.start_ms, start)
+        finish = min(session.end_ms if session.end_ms is not None else max(now, session.last_ms), end)
+        days = result.setdefault(session.tubewell_id, {})
+        while begin < finish:
+            day = begin - begin % DAY_MS
+            part_end = min(day + DAY_MS, finish)
+            days[day] = days.get(day, 0) + (part_end - begin) / 1000
+            begin = part_end
+    return result
@@ -0,0 +1,317 @@
+"""Live tubewell state shared between processes through a memory-mapped file.
+
+The ingest process (the only one with an MQTT subscription) writes every
+TubewellState it publishes into a fixed-size slot of this table; any number
+of web worker processes map the same file read-only and decode a slot per
+request, with no IPC and no lock.
+
+Each slot is guarded by a sequence number, seqlock style: the writer makes
+it odd, copies the new body in and makes it even again, together with a
+CRC-32 of the body. A reader copies the slot and keeps the copy only if the
+sequence number was even and unchanged across the copy and the CRC matches;
+otherwise it tries again. Python cannot issue memory barriers, and the CRC
+is what stops a torn copy from being accepted on weakly ordered CPUs.
+
+    header (HEADER_SIZE bytes): magic, layout version, slot count, slot size,
+                                events per slot, boot ms, rollup watermark,
+                                table version (bumped on every slot write),
+                                slots in use (highest written id + 1)
+    slot i (slot size bytes):   seq, crc32, fixed fields, last events
+"""
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from live_state import EVENTS_KEPT, TubewellState
+
+MAGIC = b"TWSTATE\x00"
+LAYOUT_VERSION = 3
+
+# magic, layout version, slots, slot size, events per slot, boot_ms, watermark, table version, slots in use
+HEADER = struct.Struct("<8sIIIIqqqq")
+HEADER_SIZE = 64
+_BOOT_OFFSET = 24
+_WATERMARK_OFFSET = 32
+_VERSION_OFFSET = 40
+_USED_OFFSET = 48
+
+# seq, crc32 of the rest of the slot
+SLOT_GUARD = struct.Struct("<II")
+# present, status, event count, updated_ms (-1: never), session_start (NaN: none), total_runtime,
+# voltage, current, active_power, reactive_power, power_factor (A, B, C each), frequency, name
+SLOT_FIELDS = struct.Struct("<BBHqdq16d64s")
+# timestamp, action, source, runtime (-1: none)
+EVENT = struct.Struct("<qBBxxi")
+
+EVENT_ACTIONS = ("OFF", "ON")
+EVENT_SOURCES = ("telemetry", "command")
+
+# A reader gives up on a slot that changed under it this many times in a row
+READ_RETRIES = 1000
+
+
+def slot_size(events=EVENTS_KEPT):
+    """Bytes per slot, rounded up to a cache line so writers of two slots never share one."""
+    size = SLOT_GUARD.size + SLOT_FIELDS.size + EVENT.size * events
+    return -(-size // 64) * 64
+
+
+def _encode_events(events):
+    out = bytearray()
+    for event in events:
+        out += EVENT.pack(event["timestamp"], EVENT_ACTIONS.index(event["action"]),
+                          EVENT_SOURCES.index(event["source"]), event.get("runtime", -1))
+    return bytes(out)
+
+
+def _decode_events(data, count):
+    events = []
+    for timestamp, action, source, runtime in EVENT.iter_unpack(data[:count * EVENT.size]):
+        event = {"timestamp": timestamp, "action": EVENT_ACTIONS[action], "source": EVENT_SOURCES[source]}
+        if runtime >= 0:
+            event["runtime"] = runtime
+        events.append(event)
+    return tuple(events)
+
+
+class SharedStateTable:
+    """Fixed-layout table of live states, one slot per tubewell id, in a shared mmap.
+
+    Opened with ``writer=True`` by the single ingest process, which reuses
+    the file when it has at least ``slots`` slots of the same layout and
+    marks them empty for the new boot. Otherwise it builds a new file and
+    renames it over the old one, never resizing a file readers have mapped;
+    readers see ``replaced()`` and open it again. Everyone else opens it
+    read-only. Tubewell ids must be below ``slots``; scans stop at the
+    highest id written so far.
+    """
+
+    def __init__(self, path, slots=16384, writer=False):
+        self.path = path
+        self.writer = writer
+        self._seen = []  # slot seqs as of the previous changed()
+        self._events = {}  # writer: tubewell_id -> (events tuple, encoded bytes)
+        self._write_lock = threading.Lock()
+        if writer:
+            self._open_writer(slots)
+        else:
+            self._open_reader()
+
+    def _open_writer(self, slots):
+        self.slot_size, self.events = slot_size(), EVENTS_KEPT
+        header = b""
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                header = f.read(HEADER.size)
+                file_size = os.fstat(f.fileno()).st_size
+        if len(header) == HEADER.size:
+            magic, version, file_slots, file_slot_size, file_events = HEADER.unpack(header)[:5]
+            compatible = ((magic, version, file_slot_size, file_events) == (MAGIC, LAYOUT_VERSION, self.slot_size, self.events)
+                          and file_slots >= slots and file_size == HEADER_SIZE + file_slots * self.slot_size)
+        else:
+            compatible = False
+        if compatible:
+            self.slots = file_slots
+            self._map(self.path, os.O_RDWR)
+            for tubewell_id in range(self.used):
+                if self.present(tubewell_id):
+                    self._write_slot(tubewell_id, bytes(self.slot_size - SLOT_GUARD.size))
+        else:
+            self.slots = slots
+            tmp = self.path + ".new"
+            fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.ftruncate(fd, HEADER_SIZE + self.slots * self.slot_size)
+            finally:
+                os.close(fd)
+            os.replace(tmp, self.path)
+            self._map(self.path, os.O_RDWR)
+        HEADER.pack_into(self._mm, 0, MAGIC, LAYOUT_VERSION, self.slots, self.slot_size, self.events,
+                         int(time.time() * 1000), self.watermark if compatible else 0, 0,
+                         self.used if compatible else 0)
+
+    def _open_reader(self):
+        self._map(self.path, os.O_RDONLY)
+        magic, version, self.slots, self.slot_size, self.events = HEADER.unpack_from(self._mm, 0)[:5]
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            self._mm.close()
+            raise ValueError(f"{self.path} is not a shared state table of layout version {LAYOUT_VERSION}")
+
+    def _map(self, path, flags):
+        fd = os.open(path, flags)
+        try:
+            self._ino = os.fstat(fd).st_ino
+            self._mm = mmap.mmap(fd, 0, access=mmap.ACCESS_WRITE if flags == os.O_RDWR else mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+
+    def replaced(self):
+        """Whether the file at ``path`` is no longer the one mapped here (the ingest process rebuilt it)."""
+        try:
+            return os.stat(self.path).st_ino != self._ino
+        except FileNotFoundError:
+            return False
+
+    def close(self):
+        self._mm.close()
+
+    def _offset(self, tubewell_id):
+        if not 0 <= tubewell_id < self.slots:
+            raise IndexError(f"Tubewell id {tubewell_id} is outside the {self.slots} shared state slots")
+        return HEADER_SIZE + tubewell_id * self.slot_size
+
+    # -----------------------------
+    # Header
+    # -----------------------------
+    @property
+    def boot_ms(self):
+        """When the ingest process that writes the table started; changes with every ingest restart."""
+        return struct.unpack_from("<q", self._mm, _BOOT_OFFSET)[0]
+
+    @property
+    def version(self):
+        """Number of slot writes since boot_ms; the same in every process mapping the table."""
+        return struct.unpack_from("<q", self._mm, _VERSION_OFFSET)[0]
+
+    @property
+    def used(self):
+        """Highest tubewell id written since the file was created, plus one."""
+        return struct.unpack_from("<q", self._mm, _USED_OFFSET)[0]
+
+    @property
+    def watermark(self):
+        """Rollup watermark last published by the ingest process."""
+        return struct.unpack_from("<q", self._mm, _WATERMARK_OFFSET)[0]
+
+    def set_watermark(self, watermark):
+        struct.pack_into("<q", self._mm, _WATERMARK_OFFSET, watermark)
+
+    # -----------------------------
+    # Writer
+    # -----------------------------
+    def _write_slot(self, tubewell_id, body):
+        offset = self._offset(tubewell_id)
+        seq = SLOT_GUARD.unpack_from(self._mm, offset)[0] | 1  # odd: write in progress
+        SLOT_GUARD.pack_into(self._mm, offset, seq, 0)
+        self._mm[offset + SLOT_GUARD.size:offset + SLOT_GUARD.size + len(body)] = body
+        SLOT_GUARD.pack_into(self._mm, offset, (seq + 1) & 0xFFFFFFFF, zlib.crc32(body))
+
+    def write(self, tubewell_id, state):
+        """Publish ``state`` in the slot of ``tubewell_id``; the event list is encoded again only when it changed."""
+        cached = self._events.get(tubewell_id)
+        if cached is None or cached[0] is not state.events:
+            cached = self._events[tubewell_id] = (state.events, _encode_events(state.events[-self.events:]))
+        fields = SLOT_FIELDS.pack(
+            1, state.status, len(cached[1]) // EVENT.size,
+            -1 if state.updated_ms is None else state.updated_ms,
+            math.nan if state.session_start is None else state.session_start,
+            state.total_runtime,
+            *state.sample(),
+            state.name.encode()[:64],
+        )
+        body = fields + cached[1]
+        with self._write_lock:
+            self._write_slot(tubewell_id, body + bytes(self.slot_size - SLOT_GUARD.size - len(body)))
+            struct.pack_into("<q", self._mm, _VERSION_OFFSET, self.version + 1)
+            if tubewell_id >= self.used:
+                struct.pack_into("<q", self._mm, _USED_OFFSET, tubewell_id + 1)
+
+    # -----------------------------
+    # Readers
+    # -----------------------------
+    def present(self, tubewell_id):
+        """Whether the ingest process has published a state for ``tubewell_id`` (a single byte, no retry needed)."""
+        if not 0 <= tubewell_id < self.slots:
+            return False
+        return self._mm[HEADER_SIZE + tubewell_id * self.slot_size + SLOT_GUARD.size] == 1
+
+    def present_ids(self):
+        first = HEADER_SIZE + SLOT_GUARD.size
+        return [i for i in range(self.used) if self._mm[first + i * self.slot_size] == 1]
+
+    def read(self, tubewell_id):
+        """Consistent TubewellState of ``tubewell_id``, or None while its slot is empty."""
+        offset = self._offset(tubewell_id)
+        end = offset + self.slot_size
+        for attempt in range(READ_RETRIES):
+            data = self._mm[offset:end]
+            seq, crc = SLOT_GUARD.unpack_from(data)
+            # A slot never written since the file was created is all zeros, guard included
+            if not seq & 1 and SLOT_GUARD.unpack_from(self._mm, offset)[0] == seq \
+                    and (zlib.crc32(data[SLOT_GUARD.size:]) == crc or seq == crc == 0):
+                return self._decode(data)
+            if attempt % 100 == 99:
+                time.sleep(0)
+        raise RuntimeError(f"Shared state slot {tubewell_id} kept changing while it was read")
+
+    def _decode(self, data):
+        fields = SLOT_FIELDS.unpack_from(data, SLOT_GUARD.size)
+        present, status, event_count, updated_ms, session_start, total_runtime = fields[:6]
+        if not present:
+            return None
+        values, name = fields[6:22], fields[22]
+        return TubewellState(
+            name.rstrip(b"\x00").decode(errors="ignore"),
+            status=bool(status),
+            voltage=values[0:3],
+            current=values[3:6],
+            active_power=values[6:9],
+            reactive_power=values[9:12],
+            power_factor=values[12:15],
+            frequency=values[15],
+            total_runtime=total_runtime,
+            session_start=None if math.isnan(session_start) else session_start,
+            updated_ms=None if updated_ms < 0 else updated_ms,
+            events=_decode_events(data[SLOT_GUARD.size + SLOT_FIELDS.size:], event_count),
+        )
+
+    def changed(self):
+        """Tubewell ids whose slot was written since the previous call (all present ones on the first)."""
+        # One strided slice picks every slot's seq word; only equality matters, so byte order does not
+        words = memoryview(self._mm).cast("I")
+        try:
+            seqs = words[HEADER_SIZE // 4:(HEADER_SIZE + self.used * self.slot_size) // 4:self.slot_size // 4].tolist()
+        finally:
+            words.release()
+        seen, self._seen = self._seen, seqs
+        if seqs == seen:
+            return []
+        return [i for i, seq in enumerate(seqs) if seq != (seen[i] if i < len(seen) else 0)]
+
+
+class SharedStates:
+    """Read-only stand-in for devices.LazyStates in a web worker, backed by a SharedStateTable.
+
+    Membership is "has a slot published by the ingest process", which covers
+    every registered device since ingest publishes them all at startup.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def __contains__(self, tubewell_id):
+        return self.table.present(tubewell_id)
+
+    def __len__(self):
+        return len(self.table.present_ids())
+
+    def peek(self, tubewell_id):
+        state = self.table.read(tubewell_id)
+        if state is None:
+            raise KeyError(tubewell_id)
+        return state
+
+    __getitem__ = peek
+
+    def all_items(self):
+        items = ((i, self.table.read(i)) for i in self.table.present_ids())
+        return [(i, state) for i, state in items if state is not None]
+
+    items = all_items
+
+    def update(self, tubewell_id, change):
+        raise RuntimeError("Live state is read-only in a web worker; it is written by the ingest process")
@@ -0,0 +1,108 @@
+import unittest
+
+from alerts import DEFAULT_ALERT_RULES, Alert, AlertEngine, compile_rules, metric_extractor
+
+
+def frame(voltage=(230, 230, 230), current=(4, 4, 4), power_factor=(0.9, 0.9, 0.9)):
+    """Decoded frame dict as returned by FrameDecoder.decode."""
+    phases = lambda values: dict(zip("ABC", values))
+    return {
+        "voltage": phases(voltage),
+        "current": phases(current),
+        "active_power": phases((1.0, 1.5, 2.0)),
+        "reactive_power": phases((0.1, 0.1, 0.1)),
+        "power_factor": phases(power_factor),
+        "frequency": 50.0,
+    }
+
+
+class RuleTest(unittest.TestCase):
+    def test_default_rules_compile(self):
+        rules = compile_rules(DEFAULT_ALERT_RULES)
+        self.assertEqual(len(rules), len(DEFAULT_ALERT_RULES))
+
+    def test_bad_rules(self):
+        for specs in (
+            [{"metric": "voltage_max", "threshold": 1}],
+            [{"name": "a", "metric": "voltage_max", "threshold": 1}, {"name": "a", "metric": "voltage_min", "threshold": 1}],
+            [{"name": "a", "metric": "voltage_max", "op": ">=", "threshold": 1}],
+            [{"name": "a", "metric": "voltage_max", "severity": "fatal", "threshold": 1}],
+            [{"name": "a", "metric": "voltage_median", "threshold": 1}],
+        ):
+            with self.assertRaises(ValueError):
+                compile_rules(specs)
+
+    def test_metric_extractor(self):
+        values = frame(voltage=(220, 230, 240), current=(3, 4, 5))
+        self.assertEqual(metric_extractor("voltage_b")(values), 230)
+        self.assertEqual(metric_extractor("voltage_max")(values), 240)
+        self.assertEqual(metric_extractor("current_avg")(values), 4)
+        self.assertAlmostEqual(metric_extractor("current_imbalance")(values), 0.25)
+        self.assertEqual(metric_extractor("active_power_total")(values), 4.5)
+        self.assertEqual(metric_extractor("frequency")(values), 50.0)
+
+
+class AlertEngineTest(unittest.TestCase):
+    def engine(self, *specs):
+        self.changes = []
+        return AlertEngine(compile_rules(specs), on_change=self.changes.append, max_gap_ms=60 * 1000, run_threshold=0.5)
+
+    def test_threshold_holds_for_s_then_clears(self):
+        engine = self.engine({"name": "hv", "metric": "voltage_max", "op": ">", "threshold": 260, "clear": 255,
+                              "for_s": 10})
+        self.assertEqual(engine.evaluate(1, frame(voltage=(265, 230, 230)), 0), [])
+        self.assertEqual(engine.evaluate(1, frame(voltage=(266, 230, 230)), 5000), [])
+        opened = engine.evaluate(1, frame(voltage=(270, 230, 230)), 10000)
+        self.assertEqual(opened, [Alert(1, "hv", 0, None, "warning", 270, 270)])
+        # Below the threshold but above clear: still firing, peak tracks the worst value
+        engine.evaluate(1, frame(voltage=(280, 230, 230)), 11000)
+        self.assertEqual(engine.evaluate(1, frame(voltage=(258, 230, 230)), 12000), [])
+        self.assertEqual(engine.open_alerts(), [Alert(1, "hv", 0, None, "warning", 270, 280)])
+        closed = engine.evaluate(1, frame(voltage=(250, 230, 230)), 13000)
+        self.assertEqual(closed, [Alert(1, "hv", 0, 13000, "warning", 270, 280)])
+        self.assertEqual(self.changes, opened + closed)
+        self.assertEqual(engine.open_alerts(), [])
+
+    def test_condition_must_hold_throughout(self):
+        engine = self.engine({"name": "hv", "metric": "voltage_max", "threshold": 260, "for_s": 10})
+        engine.evaluate(1, frame(voltage=(265, 230, 230)), 0)
+        engine.evaluate(1, frame(), 5000)
+        engine.evaluate(1, frame(voltage=(265, 230, 230)), 6000)
+        self.assertEqual(engine.evaluate(1, frame(voltage=(265, 230, 230)), 12000), [])
+        self.assertEqual(len(engine.evaluate(1, frame(voltage=(265, 230, 230)), 16000)), 1)
+
+    def test_gap_restarts_for_s(self):
+        engine = self.engine({"name": "hv", "metric": "voltage_max", "threshold": 260, "for_s": 100})
+        engine.evaluate(1, frame(voltage=(265, 230, 230)), 0)
+        engine.evaluate(1, frame(voltage=(265, 230, 230)), 50000)
+        self.assertEqual(engine.evaluate(1, frame(voltage=(265, 230, 230)), 120000), [])
+        self.assertEqual(engine.evaluate(1, frame(voltage=(265, 230, 230)), 170000), [])
+        self.assertEqual(len(engine.evaluate(1, frame(voltage=(265, 230, 230)), 220000)), 1)
+
+    def test_running_only(self):
+        engine = self.engine({"name": "lowpf", "metric": "power_factor_min", "op": "<", "threshold": 0.75,
+                              "running_only": True})
+        self.assertEqual(engine.evaluate(1, frame(current=(0, 0, 0), power_factor=(0, 0, 0)), 0), [])
+        self.assertEqual(len(engine.evaluate(1, frame(power_factor=(0.5, 0.9, 0.9)), 1000)), 1)
+        # The pump stopping closes it
+        self.assertEqual(engine.evaluate(1, frame(current=(0, 0, 0), power_factor=(0, 0, 0)), 2000)[0].end_ms, 2000)
+
+    def test_rate(self):
+        engine = self.engine({"name": "surge", "kind": "rate", "metric": "current_max", "threshold": 10,
+                              "severity": "info"})
+        self.assertEqual(engine.evaluate(1, frame(current=(4, 4, 4)), 0), [])
+        self.assertEqual(engine.evaluate(1, frame(current=(8, 4, 4)), 1000), [])
+        opened = engine.evaluate(1, frame(current=(20, 4, 4)), 2000)
+        self.assertEqual(opened, [Alert(1, "surge", 2000, None, "info", 12.0, 12.0)])
+        self.assertEqual(engine.evaluate(1, frame(current=(20, 4, 4)), 3000)[0].end_ms, 3000)
+
+    def test_devices_are_independent(self):
+        engine = self.engine({"name": "hv", "metric": "voltage_max", "threshold": 260})
+        engine.evaluate(1, frame(voltage=(265, 230, 230)), 0)
+        engine.evaluate(2, frame(), 0)
+        self.assertEqual([alert.tubewell_id for alert in engine.open_alerts()], [1])
+        self.assertEqual(engine.open_alerts(ids={2}), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import array
+import gzip
+import json
+import math
+import struct
+import sys
+import unittest
+
+from apptest import ingest, logged_in_client, started_app
+from chart_format import BINARY_MAGIC, BINARY_MIMETYPE, COMPRESS_MIN_BYTES, choose_encoding, encode_chart
+
+PATHS = [("timestamp",), ("voltage", "A"), ("frequency",), ("data_points",)]
+TYPECODES = "qffq"
+ROWS = [(1000, 230.5, 50.0, 3), (2000, None, 49.5, 1)]
+
+
+def decode_binary(body):
+    """{column name: list} of a TWC1 body, read the way the browser does."""
+    assert body[:4] == BINARY_MAGIC
+    (header_len,) = struct.unpack_from("<I", body, 4)
+    header = json.loads(body[8:8 + header_len])
+    offset = 8 + header_len
+    columns = {}
+    for column in header["columns"]:
+        typecode = "q" if column["type"] == "int64" else "f"
+        assert offset % 8 == 0
+        values = array.array(typecode)
+        values.frombytes(body[offset:offset + values.itemsize * header["rows"]])
+        if sys.byteorder != "little":
+            values.byteswap()
+        columns[column["name"]] = values.tolist()
+        offset += values.itemsize * header["rows"]
+    assert offset == len(body)
+    return columns
+
+
+class EncodeChartTest(unittest.TestCase):
+    def test_rows(self):
+        body, mimetype = encode_chart(ROWS, PATHS, TYPECODES, "rows")
+        self.assertEqual(mimetype, "application/json")
+        self.assertEqual(json.loads(body)[1], {"timestamp": 2000, "voltage": {"A": None}, "frequency": 49.5,
+                                               "data_points": 1})
+
+    def test_columnar(self):
+        body, _ = encode_chart(ROWS, PATHS, TYPECODES, "columnar")
+        self.assertEqual(json.loads(body), {"timestamp": [1000, 2000], "voltage": {"A": [230.5, None]},
+                                            "frequency": [50.0, 49.5], "data_points": [3, 1]})
+        self.assertEqual(json.loads(encode_chart([], PATHS, TYPECODES, "columnar")[0])["voltage"], {"A": []})
+
+    def test_binary(self):
+        body, mimetype = encode_chart(ROWS, PATHS, TYPECODES, "binary")
+        self.assertEqual(mimetype, BINARY_MIMETYPE)
+        columns = decode_binary(body)
+        # int64 columns first, then float32, each in path order
+        self.assertEqual(list(columns), ["timestamp", "data_points", "voltage.A", "frequency"])
+        self.assertEqual(columns["timestamp"], [1000, 2000])
+        self.assertEqual(columns["data_points"], [3, 1])
+        self.assertEqual(columns["voltage.A"][0], 230.5)
+        self.assertTrue(math.isnan(columns["voltage.A"][1]))
+        self.assertEqual(decode_binary(encode_chart([], PATHS, TYPECODES, "binary")[0])["frequency"], [])
+
+    def test_choose_encoding(self):
+        accepts = {"gzip": 1}
+        self.assertEqual(choose_encoding(accepts, COMPRESS_MIN_BYTES), "gzip")
+        self.assertIsNone(choose_encoding(accepts, COMPRESS_MIN_BYTES - 1))
+        self.assertIsNone(choose_encoding({"gzip": 0}, COMPRESS_MIN_BYTES))
+
+
+class BinaryRouteTest(unittest.TestCase):
+    def test_raw_binary(self):
+        appmod = started_app()
+        received_ms = appmod.now_ms() - 30000
+        for i in range(40):
+            ingest("device-8", received_ms + i * 10, current=float(i))
+        url = f"/api/tubewell/7/raw?format=binary&max_points=0&from={received_ms}&to={received_ms + 400}"
+        response = logged_in_client().get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual((response.status_code, response.mimetype), (200, BINARY_MIMETYPE))
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        columns = decode_binary(gzip.decompress(response.data))
+        self.assertEqual(columns["timestamp"], [received_ms + i * 10 for i in range(40)])
+        self.assertEqual(columns["current.B"], [float(i) for i in range(40)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+from commands import crc16, parse_rtu, pump_frame, write_register_frame
+
+
+class RtuFrameTest(unittest.TestCase):
+    def test_pump_frames(self):
+        self.assertEqual(pump_frame(3, "on"), "03060000000149E8")
+        self.assertEqual(pump_frame(3, "off"), "03060000000209E9")
+
+    def test_unknown_action(self):
+        with self.assertRaises(KeyError):
+            pump_frame(3, "toggle")
+
+    def test_crc16(self):
+        # Modbus check value for "123456789"
+        self.assertEqual(crc16(b"123456789"), 0x4B37)
+
+    def test_parse_rtu(self):
+        frame = write_register_frame(7, 0x0000, 1)
+        self.assertEqual(parse_rtu(frame), (7, 0x06, bytes.fromhex("00000001")))
+
+    def test_parse_rtu_rejects_bad_crc(self):
+        frame = bytearray(write_register_frame(7, 0x0000, 1))
+        frame[-1] ^= 0xFF
+        self.assertIsNone(parse_rtu(bytes(frame)))
+        self.assertIsNone(parse_rtu(b"\x07\x06"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from apptest import logged_in_client, quiet, started_app
+from comparison import MAX_COMPARISON_BUCKETS, compare_tubewells, comparison_grid
+from db_schema import RAW_COLUMNS, ROLLUP_STATS, create_schema, parse_time_param
+
+BASE_MS = parse_time_param("2023-06-01")
+MINUTE_MS = 60000
+
+
+def add_bucket(conn, tubewell_id, bucket_start, current, data_points=3):
+    """One 1m rollup row with every stat of every column at ``current``."""
+    cols = [f"{col}_{stat}" for col in RAW_COLUMNS for stat in ROLLUP_STATS]
+    conn.execute(f"INSERT INTO aggregated_data (tubewell_id, resolution, bucket_start, data_points, last_ts, "
+                 f"{', '.join(cols)}) VALUES (?, ?, ?, ?, ?{', ?' * len(cols)})",
+                 (tubewell_id, MINUTE_MS, bucket_start, data_points, bucket_start) + (current,) * len(cols))
+
+
+class CompareTubewellsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.conn = sqlite3.connect(os.path.join(self.dir, "tubewell_data.db"))
+        quiet(create_schema, self.conn)
+        with self.conn:
+            add_bucket(self.conn, 0, BASE_MS, 1.0)
+            add_bucket(self.conn, 0, BASE_MS + 2 * MINUTE_MS, 3.0)
+            add_bucket(self.conn, 1, BASE_MS + MINUTE_MS, 2.0, data_points=1)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.dir)
+
+    def compare(self, **kwargs):
+        return compare_tubewells(self.conn, [1, 0, 1], BASE_MS + 5, BASE_MS + 3 * MINUTE_MS, "1m",
+                                 ("current", "frequency"), **kwargs)
+
+    def test_shared_grid(self):
+        self.assertEqual(comparison_grid(BASE_MS + 5, BASE_MS + 3 * MINUTE_MS, "1m"),
+                         [BASE_MS, BASE_MS + MINUTE_MS, BASE_MS + 2 * MINUTE_MS])
+        result = self.compare()
+        self.assertEqual(result["time"], [BASE_MS, BASE_MS + MINUTE_MS, BASE_MS + 2 * MINUTE_MS])
+        self.assertEqual(list(result["tubewells"]), [0, 1])
+        well = result["tubewells"][0]
+        self.assertEqual(well["data_points"], [3, 0, 3])
+        self.assertEqual(well["metrics"], {"current": {"A": [1.0, None, 3.0], "B": [1.0, None, 3.0],
+                                                       "C": [1.0, None, 3.0]},
+                                           "frequency": [1.0, None, 3.0]})
+        self.assertEqual((well["available_start"], well["available_end"]), (BASE_MS, BASE_MS + 3 * MINUTE_MS))
+        self.assertEqual(result["tubewells"][1]["metrics"]["frequency"], [None, 2.0, None])
+
+    def test_fill(self):
+        self.assertEqual(self.compare(fill="previous")["tubewells"][1]["metrics"]["frequency"], [None, 2.0, 2.0])
+        self.assertEqual(self.compare(fill="zero")["tubewells"][0]["metrics"]["frequency"], [1.0, 0, 3.0])
+
+    def test_errors(self):
+        for kwargs in ({"stat": "median"}, {"fill": "linear"}):
+            with self.assertRaises(ValueError):
+                self.compare(**kwargs)
+        with self.assertRaises(ValueError):
+            compare_tubewells(self.conn, [0], BASE_MS, BASE_MS + (MAX_COMPARISON_BUCKETS + 1) * MINUTE_MS, "1m")
+
+    def test_no_wells(self):
+        self.assertEqual(compare_tubewells(self.conn, [], BASE_MS, BASE_MS + MINUTE_MS, "1m")["tubewells"], {})
+
+
+class ComparisonRouteTest(unittest.TestCase):
+    def test_comparison(self):
+        appmod = started_app()
+        conn = sqlite3.connect(appmod.DB_FILE)
+        with conn:
+            add_bucket(conn, 5, BASE_MS, 4.0)
+        conn.close()
+        response = logged_in_client().get(f"/api/comparison?ids=4,5&from={BASE_MS}&to={BASE_MS + 2 * MINUTE_MS}"
+                                          f"&resolution=1m&metrics=current")
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual(body["time"], [BASE_MS, BASE_MS + MINUTE_MS])
+        self.assertEqual((body["available_start"], body["available_end"]), (BASE_MS, BASE_MS + MINUTE_MS))
+        well = body["tubewells"]["5"]
+        self.assertEqual((well["id"], well["name"], well["metrics"]["current"]["A"]), (5, "Tubewell 6", [4.0, None]))
+        self.assertEqual(body["tubewells"]["4"]["data_points"], [0, 0])
+
+    def test_bad_requests(self):
+        client = logged_in_client()
+        self.assertEqual(client.get("/api/comparison?ids=0&metrics=colour").status_code, 400)
+        self.assertEqual(client.get("/api/comparison?ids=0&resolution=2m").status_code, 400)
+        self.assertEqual(client.get("/api/comparison?ids=0&fill=linear").status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from apptest import ingest, quiet, raw_rows, started_app
+from db_schema import (LEGACY_RAW_COLUMNS, RAW_COLUMNS, UNPARTITIONED_RAW_TABLE, _columns, create_schema, migrate,
+                       parse_time_param, pending_migrations)
+from partitions import RawPartitions
+
+DAY_MS = 24 * 3600 * 1000
+BASE_MS = parse_time_param("2024-03-01")
+
+
+def create_v1_tables(conn, samples):
+    """v1 layout: AUTOINCREMENT ids and text timestamps; ``samples`` are (tubewell_id, ms, value)."""
+    cols = ", ".join(f"{col} REAL" for col in LEGACY_RAW_COLUMNS)
+    conn.execute(f"CREATE TABLE raw_data (id INTEGER PRIMARY KEY AUTOINCREMENT, tubewell_id INTEGER, "
+                 f"timestamp TEXT, {cols})")
+    for tubewell_id, ms, value in samples:
+        conn.execute(f"INSERT INTO raw_data (tubewell_id, timestamp, {', '.join(LEGACY_RAW_COLUMNS)}) "
+                     f"VALUES (?, strftime('%Y-%m-%d %H:%M:%f', ? / 1000.0, 'unixepoch'), "
+                     f"{', '.join('?' * len(LEGACY_RAW_COLUMNS))})",
+                     (tubewell_id, ms) + (value,) * len(LEGACY_RAW_COLUMNS))
+
+
+def create_v3_table(conn, samples):
+    """The unpartitioned raw_data of schema v2/v3."""
+    conn.execute(f"CREATE TABLE raw_data (tubewell_id INTEGER NOT NULL, ts INTEGER NOT NULL, "
+                 f"{', '.join(f'{col} REAL' for col in RAW_COLUMNS)}, PRIMARY KEY (tubewell_id, ts)) WITHOUT ROWID")
+    conn.executemany(f"INSERT INTO raw_data VALUES ({', '.join('?' * (len(RAW_COLUMNS) + 2))})",
+                     [(tubewell_id, ms) + (value,) * len(RAW_COLUMNS) for tubewell_id, ms, value in samples])
+
+
+class MigrateTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.dir, "tubewell_data.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def legacy_db(self, create, samples):
+        conn = sqlite3.connect(self.db_file)
+        with conn:
+            create(conn, samples)
+        conn.close()
+
+    def stored(self):
+        conn = sqlite3.connect(self.db_file)
+        try:
+            return RawPartitions(self.db_file).select(
+                conn, "SELECT tubewell_id, ts, voltage_a FROM {table} ORDER BY ts, tubewell_id", ())
+        finally:
+            conn.close()
+
+    def test_v1_rows_are_copied_and_rolled_up(self):
+        samples = [(i % 2, BASE_MS + i * 20000, float(i)) for i in range(10)]
+        self.legacy_db(create_v1_tables, samples)
+        quiet(migrate, self.db_file, chunk_rows=3, pause=0)
+        self.assertEqual(self.stored(), [(i % 2, BASE_MS + i * 20000, float(i)) for i in range(10)])
+        conn = sqlite3.connect(self.db_file)
+        self.assertEqual(_columns(conn, "raw_data_v1"), [])
+        self.assertEqual(pending_migrations(conn), [])
+        # Minute buckets of well 0 hold samples 0 and 2, 4, then 6 and 8
+        rows = conn.execute("SELECT bucket_start, voltage_a_avg FROM aggregated_data "
+                            "WHERE tubewell_id = 0 AND resolution = 60000 ORDER BY bucket_start").fetchall()
+        self.assertEqual(rows, [(BASE_MS, 1.0), (BASE_MS + 60000, 4.0), (BASE_MS + 120000, 7.0)])
+        conn.close()
+
+    def test_v3_rows_sharing_a_timestamp(self):
+        samples = [(i, BASE_MS + DAY_MS * (i // 4), float(i)) for i in range(8)]
+        self.legacy_db(create_v3_table, samples)
+        quiet(migrate, self.db_file, chunk_rows=2, pause=0)
+        self.assertEqual(self.stored(), [(i, ms, value) for i, ms, value in samples])
+
+    def test_keep_legacy(self):
+        self.legacy_db(create_v3_table, [(0, BASE_MS, 1.0)])
+        quiet(migrate, self.db_file, pause=0, drop_legacy=False)
+        conn = sqlite3.connect(self.db_file)
+        self.assertEqual(conn.execute(f"SELECT COUNT(*) FROM {UNPARTITIONED_RAW_TABLE}").fetchone()[0], 1)
+        conn.close()
+        # A later run that drops the copied tables finishes the job
+        quiet(migrate, self.db_file, pause=0)
+        conn = sqlite3.connect(self.db_file)
+        self.assertEqual(_columns(conn, UNPARTITIONED_RAW_TABLE), [])
+        conn.close()
+        self.assertEqual(self.stored(), [(0, BASE_MS, 1.0)])
+
+    def test_existing_samples_are_kept(self):
+        self.legacy_db(create_v3_table, [(0, BASE_MS, 1.0)])
+        conn = sqlite3.connect(self.db_file)
+        quiet(create_schema, conn)
+        with conn:
+            RawPartitions(self.db_file).insert_rows(conn, [(0, BASE_MS) + (2.0,) * len(RAW_COLUMNS)])
+            with self.assertRaises(sqlite3.IntegrityError):
+                RawPartitions(self.db_file).insert_rows(conn, [(0, BASE_MS) + (3.0,) * len(RAW_COLUMNS)])
+        conn.close()
+        quiet(migrate, self.db_file, pause=0)
+        self.assertEqual(self.stored(), [(0, BASE_MS, 2.0)])
+
+
+class SameMillisecondTest(unittest.TestCase):
+    def test_burst_frames_are_all_stored(self):
+        appmod = started_app()
+        received_ms = appmod.now_ms() - 60000
+        for i in range(5):
+            ingest("device-2", received_ms, current=float(i + 1))
+        rows = raw_rows(1, received_ms - 1000, received_ms + 1000)
+        self.assertEqual(rows, [(received_ms + i, float(i + 1)) for i in range(5)])
+        # A later frame stamped before the burst still goes after it
+        ingest("device-2", received_ms - 10, current=9.0)
+        self.assertEqual(raw_rows(1, received_ms - 1000, received_ms + 1000)[-1], (received_ms + 5, 9.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
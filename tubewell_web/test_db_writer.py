@@ -0,0 +1,108 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from apptest import quiet
+from db_writer import BatchWriter, open_wal_connection
+
+INSERT_SQL = "INSERT INTO samples (id, value) VALUES (?, ?)"
+
+
+class SlowWriter(BatchWriter):
+    """Takes a while to commit each batch."""
+
+    def _write(self, conn, batch):
+        time.sleep(0.05)
+        super()._write(conn, batch)
+
+
+class BatchWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.dir, "writer.db")
+        conn = open_wal_connection(self.db_file)
+        conn.execute("CREATE TABLE samples (id INTEGER PRIMARY KEY, value REAL NOT NULL)")
+        conn.close()
+        self.batches = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def writer(self, **kwargs):
+        writer = BatchWriter(self.db_file, on_batch=lambda batch, seconds: self.batches.append(len(batch)), **kwargs)
+        writer.start()
+        self.addCleanup(quiet, writer.stop)
+        return writer
+
+    def stored(self):
+        conn = sqlite3.connect(self.db_file)
+        try:
+            return conn.execute("SELECT id, value FROM samples ORDER BY id").fetchall()
+        finally:
+            conn.close()
+
+    def test_full_batches_commit_without_waiting(self):
+        writer = self.writer(max_batch=10, max_latency=60)
+        for i in range(25):
+            writer.submit(INSERT_SQL, (i, float(i)))
+        self.assertTrue(writer.flush(timeout=10))
+        self.assertEqual(self.stored(), [(i, float(i)) for i in range(25)])
+        self.assertEqual(self.batches, [10, 10, 5])
+        self.assertEqual((writer.rows_written, writer.batches_written, writer.pending), (25, 3, 0))
+
+    def test_latency_bounds_a_partial_batch(self):
+        writer = self.writer(max_batch=100, max_latency=0.05)
+        written = threading.Event()
+        writer.on_batch = lambda batch, seconds: written.set()
+        writer.submit(INSERT_SQL, (1, 1.0))
+        self.assertTrue(written.wait(5))
+        self.assertEqual(self.stored(), [(1, 1.0)])
+
+    def test_flush_waits_for_the_batch_being_written(self):
+        writer = SlowWriter(self.db_file, max_batch=100, max_latency=0)
+        writer.start()
+        self.addCleanup(quiet, writer.stop)
+        writer.submit(INSERT_SQL, (1, 1.0))
+        time.sleep(0.01)  # The writer has taken the row and is committing it
+        self.assertEqual(writer.pending, 0)
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(self.stored(), [(1, 1.0)])
+
+    def test_bad_row_costs_only_itself(self):
+        writer = self.writer(max_batch=5, max_latency=60)
+        for i, value in enumerate((1.0, 2.0, None, 4.0, 5.0)):
+            writer.submit(INSERT_SQL, (i, value))
+        quiet(writer.flush, timeout=10)
+        self.assertEqual(self.stored(), [(0, 1.0), (1, 2.0), (3, 4.0), (4, 5.0)])
+        self.assertEqual((writer.errors, writer.rows_dropped, writer.rows_written), (1, 1, 4))
+
+    def test_stop_writes_what_is_buffered(self):
+        writer = BatchWriter(self.db_file, max_batch=100, max_latency=60)
+        writer.start()
+        for i in range(3):
+            writer.submit(INSERT_SQL, (i, float(i)))
+        quiet(writer.stop)
+        self.assertEqual(len(self.stored()), 3)
+
+    def test_submit_blocks_at_max_pending(self):
+        writer = BatchWriter(self.db_file, max_batch=2, max_latency=60, max_pending=2)
+        writer.submit(INSERT_SQL, (0, 0.0))
+        writer.submit(INSERT_SQL, (1, 1.0))
+        third = threading.Thread(target=writer.submit, args=(INSERT_SQL, (2, 2.0)))
+        third.start()
+        third.join(0.1)
+        self.assertTrue(third.is_alive())
+        # The writer frees the buffer
+        writer.start()
+        third.join(5)
+        self.assertFalse(third.is_alive())
+        quiet(writer.stop)
+        self.assertEqual(len(self.stored()), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
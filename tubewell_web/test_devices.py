@@ -0,0 +1,122 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from apptest import quiet
+from db_schema import create_schema
+from devices import DeviceRegistry, LazyStates
+
+
+class DeviceRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.dir, "tubewell_data.db")
+        conn = sqlite3.connect(self.db_file)
+        quiet(create_schema, conn)
+        conn.close()
+        self.registry = DeviceRegistry(self.db_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_register_assigns_the_next_id(self):
+        first = self.registry.register("plc-a")
+        second = self.registry.register("plc-b", name="North well", slave_address=7)
+        self.assertEqual((first.tubewell_id, first.name), (0, "Tubewell 1"))
+        self.assertEqual((second.tubewell_id, second.name, second.slave_address), (1, "North well", 7))
+        self.assertEqual(self.registry.lookup("plc-b"), 1)
+        self.assertIsNone(self.registry.lookup("plc-c"))
+        self.assertEqual(list(self.registry), [0, 1])
+
+    def test_update_keeps_unset_fields(self):
+        self.registry.register("plc-a", name="North", on_command="01", feeder="F1")
+        device = self.registry.register("plc-a", off_command="02")
+        self.assertEqual((device.tubewell_id, device.name, device.on_command, device.off_command, device.feeder),
+                         (0, "North", "01", "02", "F1"))
+        self.assertEqual(self.registry.in_feeder("F1"), [device])
+
+    def test_reload_sees_other_processes(self):
+        other = DeviceRegistry(self.db_file)
+        other.register("plc-a")
+        other.register("plc-b")
+        self.assertNotIn(1, self.registry)
+        version = self.registry.version
+        self.assertEqual(self.registry.reload(), 2)
+        self.assertEqual(self.registry.get(1).dev_id, "plc-b")
+        self.assertGreater(self.registry.version, version)
+        # Nothing new: the version stays
+        version = self.registry.version
+        self.assertEqual(self.registry.reload(), 0)
+        self.assertEqual(self.registry.version, version)
+
+    def test_seed_only_fills_an_empty_table(self):
+        quiet(self.registry.seed, [("plc-a", 5, "Five", None, None)])
+        quiet(self.registry.seed, [("plc-b", 6, "Six", None, None)])
+        self.assertEqual([d.tubewell_id for d in self.registry.devices()], [5])
+
+
+class FakeRegistry(dict):
+    """Stands in for DeviceRegistry: tubewell_id -> device."""
+    def __iter__(self):
+        return iter(sorted(self.keys()))
+
+
+class LazyStatesTest(unittest.TestCase):
+    def setUp(self):
+        self.updates = []
+        self.states = LazyStates(FakeRegistry({0: "device 0", 1: "device 1"}), lambda device: f"default {device}",
+                                 idle_seconds=0.05, on_update=lambda i, state: self.updates.append((i, state)))
+
+    def test_created_on_first_use(self):
+        self.assertEqual(self.states.peek(1), "default device 1")
+        self.assertEqual(len(self.states), 0)
+        self.assertEqual(self.states[1], "default device 1")
+        self.assertEqual(len(self.states), 1)
+        self.assertIn(0, self.states)
+        self.assertNotIn(2, self.states)
+        with self.assertRaises(KeyError):
+            self.states.peek(2)
+        self.assertEqual(self.states.all_items(), [(0, "default device 0"), (1, "default device 1")])
+
+    def test_update(self):
+        self.states.update(0, lambda state: state + " +1")
+        self.states.update(0, lambda state: state + " +2")
+        self.assertEqual(self.states.items(), [(0, "default device 0 +1 +2")])
+        self.assertEqual(self.updates, [(0, "default device 0 +1"), (0, "default device 0 +1 +2")])
+
+    def test_evict_idle(self):
+        self.states.update(0, lambda state: "running")
+        time.sleep(0.06)
+        self.states.update(1, lambda state: "running")
+        evicted = []
+        self.assertEqual(self.states.evict_idle(on_evict=lambda i, state: evicted.append((i, state))), [0])
+        self.assertEqual(evicted, [(0, "default device 0")])
+        self.assertEqual(self.states.items(), [(1, "running")])
+
+    def test_frame_during_eviction_is_kept(self):
+        self.states.update(0, lambda state: "old")
+        time.sleep(0.06)
+        blocked = []
+
+        def on_evict(tubewell_id, state):
+            # A frame for the device arrives while the eviction is publishing
+            frame = threading.Thread(target=self.states.update, args=(tubewell_id, lambda state: "new"))
+            frame.start()
+            frame.join(0.05)
+            blocked.append(frame.is_alive())
+            self.updates.append((tubewell_id, state))
+            self.frame = frame
+
+        self.states.evict_idle(on_evict=on_evict)
+        self.frame.join()
+        self.assertEqual(blocked, [True])
+        self.assertEqual(self.states.peek(0), "new")
+        self.assertEqual(self.updates[-2:], [(0, "default device 0"), (0, "new")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from db_schema import RAW_COLUMNS, create_schema
+from downsample import bucket_width, downsample_lists, downsample_raw, downsample_rollups, lttb_stream
+from partitions import RawPartitions
+from rollups import rebuild_rollups
+
+
+class BucketWidthTest(unittest.TestCase):
+    def test_bucket_width(self):
+        self.assertEqual(bucket_width(0, 1000, 10, "lttb"), 100)
+        self.assertEqual(bucket_width(0, 1000, 10, "minmax"), 200)
+        self.assertEqual(bucket_width(0, 1001, 10, "lttb"), 101)
+        self.assertEqual(bucket_width(0, 5, 1000, "lttb"), 1)
+
+
+class MinMaxTest(unittest.TestCase):
+    def test_keeps_real_rows(self):
+        times = list(range(100))
+        values = [(i * 37) % 100 for i in range(100)]
+        out_times, (out_values, out_index) = downsample_lists(times, [values, times], 10)
+        self.assertEqual(len(out_times), 10)
+        self.assertEqual(out_times, sorted(out_times))
+        # Every output row is a real sample: all lists are taken at the same index
+        self.assertEqual(out_index, out_times)
+        self.assertEqual(out_values, [values[t] for t in out_times])
+        for k, a in enumerate(range(0, 100, 20)):
+            self.assertEqual(sorted(out_values[2 * k:2 * k + 2]), [min(values[a:a + 20]), max(values[a:a + 20])])
+
+    def test_series_picks_the_rows(self):
+        times = list(range(10))
+        flat, spiky = [1] * 10, [0, 0, 0, 9, 0, 0, 0, 0, -4, 0]
+        out_times, _ = downsample_lists(times, [flat, spiky], 4, series=1)
+        self.assertEqual(out_times, [0, 3, 5, 8])
+
+    def test_short_input_is_untouched(self):
+        times, columns = [1, 2, 3], [[4, 5, 6]]
+        self.assertEqual(downsample_lists(times, columns, 10), (times, columns))
+
+
+class SqlMinMaxTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        db_file = os.path.join(self.dir, "tubewell_data.db")
+        self.conn = sqlite3.connect(db_file)
+        create_schema(self.conn)
+        self.partitions = RawPartitions(db_file)
+        # One sample a second for 20 minutes; current_a rises slowly, with one spike and one dip
+        self.rows = {}
+        for s in range(1200):
+            values = [230.0 + (s % 7)] * len(RAW_COLUMNS)
+            values[RAW_COLUMNS.index("current_a")] = {300: 50.0, 900: -1.0}.get(s, 4.0 + s / 10000)
+            self.rows[s * 1000] = tuple(values)
+        with self.conn:
+            self.partitions.insert_rows(self.conn, [(0, ts) + values for ts, values in self.rows.items()])
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.dir)
+
+    def test_raw_rows_are_stored_samples(self):
+        out = downsample_raw(self.conn, self.partitions, 0, 0, 1200 * 1000, 20, series="current_a")
+        self.assertLessEqual(len(out), 20)
+        self.assertEqual([row[0] for row in out], sorted(row[0] for row in out))
+        for ts, *values in out:
+            self.assertEqual(tuple(values), self.rows[ts])
+        self.assertIn(300 * 1000, [row[0] for row in out])
+        self.assertIn(900 * 1000, [row[0] for row in out])
+
+    def test_rollup_rows_are_stored_buckets(self):
+        rebuild_rollups(self.conn, self.partitions, 0, 1200 * 1000)
+        out = downsample_rollups(self.conn, 0, "1m", 0, 1200 * 1000, 4, series="current_a")
+        current = 2 + RAW_COLUMNS.index("current_a")
+        # Two groups of ten minute buckets; each gives the minima of its lowest bucket and the maxima of its highest
+        self.assertEqual([(row[0], row[1], row[current]) for row in out],
+                         [(0, 60, 4.0), (300000, 60, 50.0), (900000, 60, -1.0), (1140000, 60, 4.0 + 1199 / 10000)])
+        voltage = 2 + RAW_COLUMNS.index("voltage_a")
+        self.assertEqual([row[voltage] for row in out], [230.0, 236.0, 230.0, 236.0])
+
+
+class LttbTest(unittest.TestCase):
+    def test_keeps_ends_and_spike(self):
+        times = list(range(100))
+        values = [0.0] * 100
+        values[53] = 10.0
+        values[71] = -5.0
+        out_times, (out_values,) = downsample_lists(times, [values], 10, mode="lttb")
+        # One row per bucket, plus the first row kept alongside the first bucket's pick
+        self.assertLessEqual(len(out_times), 11)
+        self.assertEqual((out_times[0], out_times[-1]), (0, 99))
+        self.assertIn(53, out_times)
+        self.assertIn(71, out_times)
+        self.assertEqual(out_times, sorted(out_times))
+        self.assertEqual(out_values, [values[t] for t in out_times])
+
+    def test_stream_picks_largest_triangle(self):
+        rows = [(0, 0.0), (1, 1.0), (2, 5.0), (3, 1.0), (4, 0.0)]
+        bucket_of = lambda row: 0 if row[0] == 0 else (1 if row[0] < 4 else 2)
+        averages = {0: (0, 0.0), 1: (2, 7 / 3), 2: (4, 0.0)}
+        self.assertEqual(lttb_stream(rows, bucket_of, 1, averages), [(0, 0.0), (2, 5.0), (4, 0.0)])
+
+    def test_stream_skips_missing_values(self):
+        rows = [(0, None), (1, 1.0), (2, None), (3, 2.0)]
+        picked = lttb_stream(rows, lambda row: row[0] // 2, 1, {0: (1, 1.0), 1: (3, 2.0)})
+        self.assertEqual(picked, [(1, 1.0), (3, 2.0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import sqlite3
+import unittest
+
+from db_schema import create_schema
+from energy import ENERGY_COUNTER_SQL, EnergyIntegrator, stored_energy_between
+
+MINUTE_MS = 60 * 1000
+ZERO3 = (0.0, 0.0, 0.0)
+
+
+class EnergyIntegratorTest(unittest.TestCase):
+    def setUp(self):
+        self.counters = []
+        self.integrator = EnergyIntegrator(bucket_ms=15 * MINUTE_MS, max_gap_ms=5 * MINUTE_MS,
+                                           on_counter=lambda *counter: self.counters.append(counter))
+
+    def test_first_sample_only_sets_the_start(self):
+        self.integrator.add(1, (2.0, 0, 0), ZERO3, 14 * MINUTE_MS)
+        self.assertEqual(self.integrator.totals(1), (14 * MINUTE_MS, (0.0,) * 6))
+        self.assertIsNone(self.integrator.totals(2))
+        self.assertEqual(self.counters, [])
+
+    def test_trapezoid(self):
+        self.integrator.add(1, (2.0, 0, 1.0), (0, 0.5, 0), 1 * MINUTE_MS)
+        self.integrator.add(1, (4.0, 0, 1.0), (0, 1.5, 0), 4 * MINUTE_MS)
+        ts, totals = self.integrator.totals(1)
+        self.assertEqual(ts, 4 * MINUTE_MS)
+        # 3 minutes at an average of 3 kW, 1 kW and 1 kVAR
+        for total, expected in zip(totals, (0.15, 0.0, 0.05, 0.0, 0.05, 0.0)):
+            self.assertAlmostEqual(total, expected)
+
+    def test_counter_at_bucket_boundary(self):
+        self.integrator.add(1, (2.0, 0, 0), ZERO3, 14 * MINUTE_MS)
+        self.integrator.add(1, (4.0, 0, 0), ZERO3, 16 * MINUTE_MS)
+        self.assertEqual(len(self.counters), 1)
+        tubewell_id, boundary, totals = self.counters[0]
+        self.assertEqual((tubewell_id, boundary), (1, 15 * MINUTE_MS))
+        # Power interpolated to 3 kW at the boundary: one minute averaging 2.5 kW
+        self.assertAlmostEqual(totals[0], 2.5 / 60)
+        self.assertAlmostEqual(self.integrator.totals(1)[1][0], 0.1)
+
+    def test_counters_across_several_buckets(self):
+        self.integrator.add(1, (1.0, 0, 0), ZERO3, 0)
+        for minute in range(1, 46):
+            self.integrator.add(1, (1.0, 0, 0), ZERO3, minute * MINUTE_MS)
+        self.assertEqual([c[1] for c in self.counters], [15 * MINUTE_MS, 30 * MINUTE_MS, 45 * MINUTE_MS])
+        for (_, boundary, totals) in self.counters:
+            self.assertAlmostEqual(totals[0], boundary / (60 * MINUTE_MS))
+
+    def test_gap_is_not_integrated(self):
+        self.integrator.add(1, (2.0, 0, 0), ZERO3, 14 * MINUTE_MS)
+        self.integrator.add(1, (4.0, 0, 0), ZERO3, 16 * MINUTE_MS)
+        before = self.integrator.totals(1)[1]
+        # 40 minutes of silence crosses two boundaries; only the first gets a (flat) counter
+        self.integrator.add(1, (4.0, 0, 0), ZERO3, 56 * MINUTE_MS)
+        self.assertEqual([c[1] for c in self.counters], [15 * MINUTE_MS, 30 * MINUTE_MS])
+        self.assertEqual(self.counters[-1][2], before)
+        self.assertEqual(self.integrator.totals(1), (56 * MINUTE_MS, before))
+        self.integrator.add(1, (4.0, 0, 0), ZERO3, 59 * MINUTE_MS)
+        self.assertAlmostEqual(self.integrator.totals(1)[1][0], before[0] + 0.2)
+
+    def test_out_of_order_sample_is_ignored(self):
+        self.integrator.add(1, (2.0, 0, 0), ZERO3, 10 * MINUTE_MS)
+        self.integrator.add(1, (2.0, 0, 0), ZERO3, 12 * MINUTE_MS)
+        self.integrator.add(1, (9.0, 0, 0), ZERO3, 11 * MINUTE_MS)
+        self.integrator.add(1, (9.0, 0, 0), ZERO3, 12 * MINUTE_MS)
+        self.assertEqual(self.integrator.totals(1)[0], 12 * MINUTE_MS)
+        self.assertAlmostEqual(self.integrator.totals(1)[1][0], 2 * 2 / 60)
+
+
+class StoredEnergyTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        create_schema(self.conn)
+        self.integrator = EnergyIntegrator(bucket_ms=15 * MINUTE_MS, on_counter=self.store_counter)
+        # 1 kW on phase A from minute 0 to 40, checkpointed at minute 40
+        for minute in range(41):
+            self.integrator.add(1, (1.0, 0, 0), ZERO3, minute * MINUTE_MS)
+        self.integrator.checkpoint(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def store_counter(self, tubewell_id, bucket_start, totals):
+        with self.conn:
+            self.conn.execute(ENERGY_COUNTER_SQL, (tubewell_id, bucket_start) + totals)
+
+    def test_between_counters(self):
+        energy = stored_energy_between(self.conn, 15 * MINUTE_MS, 30 * MINUTE_MS, [1, 2])
+        self.assertAlmostEqual(energy[1][0], 0.25)
+        self.assertEqual(energy[2], (0.0,) * 6)
+
+    def test_open_bucket_up_to_the_checkpoint(self):
+        energy = stored_energy_between(self.conn, 15 * MINUTE_MS, 60 * MINUTE_MS, [1])
+        self.assertAlmostEqual(energy[1][0], 25 / 60)
+        # Samples after the checkpoint are only known to the live integrator
+        self.integrator.add(1, (1.0, 0, 0), ZERO3, 42 * MINUTE_MS)
+        live = self.integrator.energy_between(self.conn, 15 * MINUTE_MS, 60 * MINUTE_MS, [1])
+        self.assertAlmostEqual(live[1][0], 27 / 60)
+        self.assertAlmostEqual(stored_energy_between(self.conn, 15 * MINUTE_MS, 60 * MINUTE_MS, [1])[1][0], 25 / 60)
+        # A checkpoint newer than the end of the range is not used
+        self.assertAlmostEqual(stored_energy_between(self.conn, 0, 35 * MINUTE_MS, [1])[1][0], 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
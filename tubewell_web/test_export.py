@@ -0,0 +1,125 @@
+import gc
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import unittest
+
+from apptest import ingest, logged_in_client, quiet, started_app
+from db_schema import RAW_COLUMNS, create_schema, parse_time_param
+from export import export_columns, export_stream, iter_chunks
+from partitions import DAY_MS, RawPartitions
+from test_chart_format import decode_binary
+
+BASE_MS = parse_time_param("2024-05-01")
+
+
+def split_blocks(body):
+    """The encode_binary blocks of a columnar export."""
+    blocks = []
+    while body:
+        (header_len,) = struct.unpack_from("<I", body, 4)
+        header = json.loads(body[8:8 + header_len])
+        size = 8 + header_len + sum((8 if c["type"] == "int64" else 4) * header["rows"] for c in header["columns"])
+        blocks.append(decode_binary(body[:size]))
+        body = body[size:]
+    return blocks
+
+
+class ExportStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.dir, "tubewell_data.db")
+        conn = sqlite3.connect(self.db_file)
+        quiet(create_schema, conn)
+        self.partitions = RawPartitions(self.db_file)
+        # Two wells, two samples each on two days
+        rows = [(tubewell_id, BASE_MS + day * DAY_MS + i * 1000) + (float(day * 10 + i),) * len(RAW_COLUMNS)
+                for day in range(2) for tubewell_id in (1, 0) for i in range(2)]
+        with conn:
+            self.partitions.insert_rows(conn, rows)
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def export(self, ids=None, columns=("current_a",), **kwargs):
+        return b"".join(export_stream(self.db_file, self.partitions, ids, BASE_MS, BASE_MS + 2 * DAY_MS, columns,
+                                      **kwargs))
+
+    def test_export_columns(self):
+        self.assertEqual(export_columns(), RAW_COLUMNS)
+        self.assertEqual(export_columns(["frequency", "current"]), ("current_a", "current_b", "current_c", "frequency"))
+        self.assertEqual(export_columns(["voltage_b"]), ("voltage_b",))
+        with self.assertRaises(ValueError):
+            export_columns(["colour"])
+
+    def test_chunks_follow_the_key_order(self):
+        conn = sqlite3.connect(self.db_file)
+        try:
+            chunks = list(iter_chunks(conn, self.partitions, [1], BASE_MS, BASE_MS + 2 * DAY_MS, ("current_a",),
+                                      chunk_rows=1))
+        finally:
+            conn.close()
+        self.assertEqual(chunks, [[(1, BASE_MS, 0.0)], [(1, BASE_MS + 1000, 1.0)],
+                                  [(1, BASE_MS + DAY_MS, 10.0)], [(1, BASE_MS + DAY_MS + 1000, 11.0)]])
+
+    def test_csv(self):
+        lines = gzip.decompress(self.export(ids=[0])).decode().splitlines()
+        self.assertEqual(lines[0], "tubewell_id,ts,current_a")
+        self.assertEqual(lines[1:], [f"0,{BASE_MS},0.0", f"0,{BASE_MS + 1000},1.0",
+                                     f"0,{BASE_MS + DAY_MS},10.0", f"0,{BASE_MS + DAY_MS + 1000},11.0"])
+        self.assertEqual(len(self.export(compression="none").decode().splitlines()), 9)
+
+    def test_columnar(self):
+        blocks = split_blocks(self.export(fmt="columnar", compression="none"))
+        # One block per partition, both wells in each
+        self.assertEqual([block["tubewell_id"] for block in blocks], [[0, 0, 1, 1], [0, 0, 1, 1]])
+        self.assertEqual(blocks[1]["current_a"], [10.0, 11.0, 10.0, 11.0])
+
+    def test_abandoned_stream(self):
+        stream = export_stream(self.db_file, self.partitions, None, BASE_MS, BASE_MS + 2 * DAY_MS, RAW_COLUMNS,
+                               compression="none")
+        self.assertTrue(next(stream).startswith(b"tubewell_id,ts,"))
+        unraisable = []
+        hook, sys.unraisablehook = sys.unraisablehook, unraisable.append
+        try:
+            stream.close()
+            gc.collect()
+        finally:
+            sys.unraisablehook = hook
+        self.assertEqual(unraisable, [])
+        # The read snapshot is gone: a writer can checkpoint the whole WAL
+        conn = sqlite3.connect(self.db_file)
+        self.assertEqual(conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0], 0)
+        conn.close()
+
+
+class ExportRouteTest(unittest.TestCase):
+    def test_export(self):
+        appmod = started_app()
+        received_ms = appmod.now_ms() - 20000
+        for i in range(3):
+            ingest("device-10", received_ms + i, current=float(i))
+        response = quiet(logged_in_client().get, f"/api/export?ids=9&from={received_ms}&to={received_ms + 100}"
+                                                 f"&metrics=current_a,frequency&compression=none")
+        self.assertEqual((response.status_code, response.mimetype), (200, "text/csv"))
+        self.assertIn("attachment; filename=tubewell_export_", response.headers["Content-Disposition"])
+        self.assertEqual(response.get_data(True).splitlines(),
+                         ["tubewell_id,ts,current_a,frequency"] + [f"9,{received_ms + i},{float(i)},50.0" for i in range(3)])
+
+    def test_errors(self):
+        client = logged_in_client()
+        self.assertEqual(client.get("/api/export?metrics=colour").status_code, 400)
+        self.assertEqual(client.get("/api/export?format=xlsx").status_code, 400)
+        self.assertEqual(client.get("/api/export?compression=zip").status_code, 400)
+        self.assertEqual(client.get("/api/export?ids=999").status_code, 404)
+        self.assertEqual(started_app().app.test_client().get("/api/export").status_code, 302)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import struct
+import unittest
+
+from frame_decoder import DEFAULT_REGISTER_MAP, FrameDecoder, Register
+
+
+def build_frame(values, size=200):
+    """Frame with ``values[(metric, phase)]`` packed at the offsets of the default register map."""
+    buf = bytearray(size)
+    for reg in DEFAULT_REGISTER_MAP:
+        struct.pack_into(">" + reg.fmt, buf, reg.offset, values.get((reg.metric, reg.phase), 0))
+    return bytes(buf)
+
+
+class FrameDecoderTest(unittest.TestCase):
+    def setUp(self):
+        self.decoder = FrameDecoder()
+
+    def test_register_offsets(self):
+        values = {(reg.metric, reg.phase): i + 1.5 for i, reg in enumerate(DEFAULT_REGISTER_MAP)}
+        result = self.decoder.decode(build_frame(values))
+        self.assertEqual(result["voltage"], {"A": 1.5, "B": 2.5, "C": 3.5})
+        self.assertEqual(result["current"], {"A": 4.5, "B": 5.5, "C": 6.5})
+        self.assertEqual(result["active_power"], {"A": 7.5, "B": 8.5, "C": 9.5})
+        self.assertEqual(result["reactive_power"], {"A": 10.5, "B": 11.5, "C": 12.5})
+        self.assertEqual(result["power_factor"], {"A": 13.5, "B": 14.5, "C": 15.5})
+        self.assertEqual(result["frequency"], 16.5)
+
+    def test_rounding(self):
+        result = self.decoder.decode(build_frame({("voltage", "A"): 229.96, ("power_factor", "A"): 0.98765}))
+        self.assertEqual(result["voltage"]["A"], 230.0)
+        self.assertEqual(result["power_factor"]["A"], 0.988)
+
+    def test_min_length(self):
+        # The last field is the frequency float at offset 121
+        self.assertEqual(self.decoder.min_length, 125)
+        frame = build_frame({("frequency", None): 50.0})
+        self.assertEqual(self.decoder.decode(frame[:125])["frequency"], 50.0)
+        self.assertIsNone(self.decoder.decode(frame[:124]))
+        self.assertIsNone(self.decoder.decode(frame, offset=len(frame) - 124))
+
+    def test_decode_hex(self):
+        frame = build_frame({("current", "B"): 3.25})
+        hex_frame = " ".join(frame[i:i + 16].hex() for i in range(0, len(frame), 16))
+        self.assertEqual(self.decoder.decode_hex(hex_frame)["current"]["B"], 3.25)
+
+    def test_decode_many_rejects_bad_frames(self):
+        good = build_frame({("frequency", None): 49.9}).hex()
+        short = good[:248]
+        results = self.decoder.decode_many([good, short, good + "0", "zz" * 125, good])
+        self.assertEqual([r and r["frequency"] for r in results], [49.9, None, None, None, 49.9])
+
+    def test_overlapping_registers(self):
+        registers = (Register("voltage", "A", 0, "f", 1, 1), Register("voltage", "B", 2, "f", 1, 1))
+        with self.assertRaises(ValueError):
+            FrameDecoder(registers)
+
+    def test_scale(self):
+        decoder = FrameDecoder((Register("frequency", None, 0, "H", 0.01, 2),))
+        self.assertEqual(decoder.decode(struct.pack(">H", 5012)), {"frequency": 50.12})
+
+
+if __name__ == "__main__":
+    unittest.main()
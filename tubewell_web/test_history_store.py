@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from apptest import quiet
+from history_store import HistoryJournal
+
+
+class HistoryJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "history.journal")
+        self.journal = HistoryJournal(self.path)
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.dir)
+
+    def test_replay_after_a_snapshot(self):
+        self.assertEqual(list(self.journal.replay()), [])
+        self.assertEqual(self.journal.size, 0)
+        self.journal.append([[1, 0, 1000, [1.5]], [2, 1, 1000, [2.5]]])
+        self.journal.append([[3, 0, 2000, [3.5]]])
+        self.assertEqual(self.journal.size, os.path.getsize(self.path))
+        # A fresh reader, as after a restart
+        self.assertEqual(list(HistoryJournal(self.path).replay(after_seq=1)), [(2, 1, 1000, [2.5]), (3, 0, 2000, [3.5])])
+
+    def test_truncate(self):
+        self.journal.append([[1, 0, 1000, [1.5]]])
+        self.journal.truncate()
+        self.assertEqual(self.journal.size, 0)
+        self.journal.append([[2, 0, 2000, [2.5]]])
+        self.assertEqual(list(self.journal.replay()), [(2, 0, 2000, [2.5])])
+
+    def test_torn_last_line(self):
+        self.journal.append([[1, 0, 1000, [1.5]]])
+        self.journal.close()
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write('[2,0,20')
+        self.assertEqual(quiet(list, self.journal.replay()), [(1, 0, 1000, [1.5])])
+
+
+if __name__ == "__main__":
+    unittest.main()
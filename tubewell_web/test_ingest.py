@@ -0,0 +1,101 @@
+import collections
+import threading
+import unittest
+
+from apptest import quiet
+from ingest import IngestPipeline
+
+
+class MarkTest(unittest.TestCase):
+    def test_wait_for_queued_messages(self):
+        release = threading.Event()
+        handled = []
+
+        def handler(item):
+            release.wait()
+            handled.append(item)
+
+        pipeline = IngestPipeline(handler, workers=2, name="test")
+        pipeline.start()
+        try:
+            for i in range(6):
+                pipeline.submit(i, key=b"%d" % i)
+            mark = pipeline.mark()
+            self.assertFalse(pipeline.wait_for(mark, timeout=0.05))
+            release.set()
+            self.assertTrue(pipeline.wait_for(mark, timeout=5))
+            self.assertEqual(sorted(handled), list(range(6)))
+            # Nothing was queued since
+            self.assertTrue(pipeline.wait_for(pipeline.mark(), timeout=0))
+        finally:
+            release.set()
+            quiet(pipeline.stop)
+
+
+class OrderingTest(unittest.TestCase):
+    def test_same_key_keeps_arrival_order(self):
+        handled = collections.defaultdict(list)
+        pipeline = IngestPipeline(lambda item: handled[item[0]].append(item[1]), workers=4, name="test")
+        pipeline.start()
+        try:
+            for i in range(200):
+                device = b"device-%d" % (i % 5)
+                pipeline.submit((device, i), key=device)
+            self.assertTrue(pipeline.wait_for(pipeline.mark(), timeout=5))
+        finally:
+            quiet(pipeline.stop)
+        for n in range(5):
+            self.assertEqual(handled[b"device-%d" % n], list(range(n, 200, 5)))
+        self.assertEqual((pipeline.submitted, pipeline.processed, pipeline.dropped), (200, 200, 0))
+
+    def test_handler_errors_are_counted(self):
+        def handler(item):
+            if item == 1:
+                raise ValueError("bad frame")
+
+        pipeline = IngestPipeline(handler, workers=1, name="test")
+        pipeline.start()
+        for i in range(3):
+            pipeline.submit(i)
+        quiet(pipeline.stop)
+        self.assertEqual((pipeline.processed, pipeline.errors), (3, 1))
+
+    def test_unknown_overflow_policy(self):
+        with self.assertRaises(ValueError):
+            IngestPipeline(print, overflow="drop_newest")
+
+
+class OverflowTest(unittest.TestCase):
+    def test_drop_oldest(self):
+        handled = []
+        pipeline = IngestPipeline(handled.append, workers=1, max_queue=3, overflow="drop_oldest", name="test")
+        for i in range(5):
+            self.assertTrue(pipeline.submit(i))
+        self.assertEqual((pipeline.depth, pipeline.dropped), (3, 2))
+        pipeline.start()
+        quiet(pipeline.stop)
+        self.assertEqual(handled, [2, 3, 4])
+        # Dropped messages count as retired for wait_for
+        self.assertTrue(pipeline.wait_for([5], timeout=0))
+
+    def test_block_waits_for_room(self):
+        pipeline = IngestPipeline(lambda item: None, workers=1, max_queue=1, name="test")
+        pipeline.submit(0)
+        second = threading.Thread(target=pipeline.submit, args=(1,))
+        second.start()
+        second.join(0.05)
+        self.assertTrue(second.is_alive())
+        pipeline.start()
+        second.join(5)
+        quiet(pipeline.stop)
+        self.assertEqual((pipeline.processed, pipeline.dropped), (2, 0))
+
+    def test_submit_after_stop(self):
+        pipeline = IngestPipeline(lambda item: None, name="test")
+        pipeline.start()
+        quiet(pipeline.stop)
+        self.assertFalse(pipeline.submit(0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+import textwrap
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Runs in a fresh interpreter: a stopped app cannot be started again in the same process
+SCRIPT = textwrap.dedent("""
+    import apptest
+    apptest.CONFIG.update(AGGREGATION_INTERVAL=0.02, DEVICE_EVICT_INTERVAL=0.02, SESSION_SWEEP_INTERVAL=0.02,
+                          COMMAND_SWEEP_INTERVAL=0.02, HISTORY_COMPACT_INTERVAL=0.02)
+    app = apptest.started_app()
+    assert app.start() is app.app, "start() is idempotent"
+    try:
+        app.create_app({})
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("create_app() after start()")
+    loops = sorted(t.name for t in app._background_threads)
+    assert loops == ["aggregator", "command_sweeper", "device_evictor", "history_compactor", "session_sweeper"], loops
+
+    writer_stop = app.db_writer.stop
+    still_running = []
+    def stop_writer(*args, **kwargs):
+        still_running.append([t.name for t in app._background_threads if t.is_alive()])
+        return writer_stop(*args, **kwargs)
+    app.db_writer.stop = stop_writer
+
+    received_ms = app.now_ms()
+    apptest.quiet(app.ingest_pipeline.submit, apptest.message("device-1", received_ms), key=b"device-1")
+    apptest.quiet(app.stop)
+    assert still_running == [[]], f"writer stopped while {still_running} still ran"
+    print("WRITER_STOPPED")
+    assert apptest.raw_rows(0) == [(received_ms, 4.0)], apptest.raw_rows(0)
+    try:
+        app.start()
+    except RuntimeError:
+        print("STOPPED")
+""")
+
+
+class LifecycleTest(unittest.TestCase):
+    def test_start_and_stop(self):
+        result = subprocess.run([sys.executable, "-c", SCRIPT], cwd=HERE, capture_output=True, text=True, timeout=120)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.split(), ["WRITER_STOPPED", "STOPPED"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+from db_schema import RAW_COLUMNS
+from live_state import EVENTS_KEPT, TubewellState
+
+
+def decoded(voltage=(230.0, 231.0, 232.0), current=(4.0, 4.5, 5.0)):
+    """Decoded frame dict as returned by FrameDecoder.decode."""
+    phases = lambda values: dict(zip("ABC", values))
+    return {
+        "voltage": phases(voltage),
+        "current": phases(current),
+        "active_power": phases((1.0, 1.5, 2.0)),
+        "reactive_power": phases((0.1, 0.2, 0.3)),
+        "power_factor": phases((0.9, 0.91, 0.92)),
+        "frequency": 50.0,
+    }
+
+
+class TubewellStateTest(unittest.TestCase):
+    def test_defaults(self):
+        state = TubewellState("Tubewell 1")
+        self.assertEqual((state.status, state.voltage, state.updated_ms, state.events), (False, (0, 0, 0), None, ()))
+        with self.assertRaises(TypeError):
+            TubewellState("Tubewell 1", colour="red")
+
+    def test_immutable(self):
+        state = TubewellState("Tubewell 1")
+        with self.assertRaises(AttributeError):
+            state.status = True
+        running = state.replace(status=True, name="North")
+        self.assertEqual((state.status, state.name, running.status, running.name), (False, "Tubewell 1", True, "North"))
+
+    def test_with_frame(self):
+        state = TubewellState("Tubewell 1", status=True).with_frame(decoded(), 1000)
+        self.assertEqual((state.status, state.updated_ms, state.frequency), (True, 1000, 50.0))
+        self.assertEqual(state.phases("current"), {"A": 4.0, "B": 4.5, "C": 5.0})
+        sample = state.sample()
+        self.assertEqual(len(sample), len(RAW_COLUMNS))
+        self.assertEqual(sample[:3], (230.0, 231.0, 232.0))
+        self.assertEqual(sample[-1], 50.0)
+
+    def test_events_are_bounded(self):
+        state = TubewellState("Tubewell 1")
+        for i in range(EVENTS_KEPT + 5):
+            state = state.with_event(status=bool(i % 2), time=i)
+        self.assertEqual(len(state.events), EVENTS_KEPT)
+        self.assertEqual(state.events[0], {"status": True, "time": 5})
+
+    def test_runtime(self):
+        state = TubewellState("Tubewell 1", total_runtime=100)
+        self.assertEqual(state.runtime(now=5000), 100)
+        running = state.replace(status=True, session_start=4000)
+        self.assertEqual(running.runtime(now=4060.5), 160)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import json
+import unittest
+
+from apptest import quiet
+from live_stream import LiveBroadcaster
+
+
+def parse(message):
+    """(event name, data) of one SSE message."""
+    name, data = message.strip().split("\n")
+    return name[len("event: "):], json.loads(data[len("data: "):])
+
+
+class LiveBroadcasterTest(unittest.TestCase):
+    def setUp(self):
+        self.broadcaster = LiveBroadcaster(max_queue=2, keepalive=0.01)
+
+    def test_only_changes_are_sent(self):
+        sub = self.broadcaster.subscribe()
+        self.broadcaster.publish(0, {"status": "OFF", "voltage": {"A": 230, "B": 231}})
+        self.broadcaster.publish(0, {"status": "OFF", "voltage": {"A": 230, "B": 232}})
+        self.broadcaster.publish(0, {"status": "OFF", "voltage": {"A": 230, "B": 232}})
+        self.assertEqual(parse(sub.queue.get_nowait()),
+                         ("update", {"status": "OFF", "voltage": {"A": 230, "B": 231}, "id": 0}))
+        self.assertEqual(parse(sub.queue.get_nowait()), ("update", {"voltage": {"B": 232}, "id": 0}))
+        self.assertTrue(sub.queue.empty())
+        self.assertEqual(self.broadcaster.version, 2)
+
+    def test_subscribers_filter_by_id(self):
+        one = self.broadcaster.subscribe({1})
+        everyone = self.broadcaster.subscribe()
+        self.broadcaster.publish(0, {"status": "ON"})
+        self.broadcaster.notify(1, "alert", {"rule": "overvoltage"})
+        self.assertEqual([parse(one.queue.get_nowait())], [("alert", {"rule": "overvoltage", "id": 1})])
+        self.assertEqual(everyone.queue.qsize(), 2)
+
+    def test_slow_subscriber_is_dropped(self):
+        slow = self.broadcaster.subscribe()
+        for i in range(3):
+            quiet(self.broadcaster.publish, 0, {"current": i})
+        self.assertTrue(slow.closed)
+        self.assertEqual((self.broadcaster.subscriber_count, self.broadcaster.subscribers_dropped), (0, 1))
+
+    def test_stream(self):
+        sub = self.broadcaster.subscribe()
+        body = self.broadcaster.stream(sub, [(0, {"status": "OFF"})])
+        self.assertEqual(next(body), "retry: 3000\n\n")
+        self.assertEqual(parse(next(body)), ("snapshot", {"status": "OFF", "id": 0}))
+        self.assertEqual(next(body), ": keepalive\n\n")
+        self.broadcaster.publish(0, {"status": "ON"})
+        self.assertEqual(parse(next(body)), ("update", {"status": "ON", "id": 0}))
+        body.close()
+        self.assertEqual(self.broadcaster.subscriber_count, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import gc
+import threading
+import unittest
+
+from apptest import ingest, started_app
+from metrics import MetricsRegistry
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_render(self):
+        requests = self.registry.counter("requests_total", "Requests", ("route",))
+        depth = self.registry.gauge("queue_depth", "Queued items")
+        latency = self.registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+        requests.labels("/a").inc()
+        requests.labels("/a").inc(2)
+        requests.labels('/"b"').inc()
+        depth.set_function(lambda: 7)
+        for value in (0.05, 0.5, 5):
+            latency.observe(value)
+        self.assertEqual(self.registry.render().splitlines(), [
+            "# HELP requests_total Requests",
+            "# TYPE requests_total counter",
+            'requests_total{route="/\\"b\\""} 1',
+            'requests_total{route="/a"} 3',
+            "# HELP queue_depth Queued items",
+            "# TYPE queue_depth gauge",
+            "queue_depth 7",
+            "# HELP latency_seconds Latency",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{le="0.1"} 1',
+            'latency_seconds_bucket{le="1"} 2',
+            'latency_seconds_bucket{le="+Inf"} 3',
+            "latency_seconds_sum 5.55",
+            "latency_seconds_count 3",
+        ])
+
+    def test_errors(self):
+        self.registry.counter("a_total", "A")
+        with self.assertRaises(ValueError):
+            self.registry.gauge("a_total", "A again")
+        with self.assertRaises(ValueError):
+            self.registry.counter("b_total", "B", ("route",)).labels()
+
+    def test_threads_keep_their_counts_after_exiting(self):
+        counter = self.registry.counter("hits_total", "Hits")
+
+        def hit():
+            for _ in range(1000):
+                counter.inc()
+
+        threads = [threading.Thread(target=hit) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        del threads, t
+        gc.collect()
+        counter.inc()
+        self.assertEqual(counter.labels().value, 8001)
+
+
+class MetricsRouteTest(unittest.TestCase):
+    def test_scrape_counts_frames(self):
+        appmod = started_app()
+        client = appmod.app.test_client()
+        before = appmod.MQTT_PARSED.labels("device-3").value
+        ingest("device-3", appmod.now_ms())
+        response = client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'tubewell_mqtt_messages_parsed_total{{device="device-3"}} {before + 1}', response.get_data(True))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from apptest import quiet
+from db_schema import RAW_COLUMNS, create_schema, parse_time_param
+from partitions import DAY_MS, RawPartitions
+
+BASE_MS = parse_time_param("2024-03-01")
+
+
+def row(tubewell_id, ts, value=1.0):
+    return (tubewell_id, ts) + (value,) * len(RAW_COLUMNS)
+
+
+class RawPartitionsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.dir, "tubewell_data.db")
+        self.conn = sqlite3.connect(self.db_file)
+        quiet(create_schema, self.conn)
+        self.partitions = RawPartitions(self.db_file)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.dir)
+
+    def insert(self, rows):
+        with self.conn:
+            self.partitions.insert_rows(self.conn, rows)
+
+    def test_rows_go_to_their_day(self):
+        self.insert([row(0, BASE_MS + 1000), row(0, BASE_MS + DAY_MS - 1), row(0, BASE_MS + DAY_MS)])
+        self.assertEqual(self.partitions.table_for(BASE_MS + DAY_MS - 1), "raw_data_20240301")
+        self.assertEqual([table for _, _, table in self.partitions.tables(self.conn)],
+                         ["raw_data_20240301", "raw_data_20240302"])
+        self.assertEqual([table for _, _, table in self.partitions.tables(self.conn, BASE_MS + DAY_MS)],
+                         ["raw_data_20240302"])
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM raw_data_20240301").fetchone()[0], 2)
+
+    def test_select_across_partitions(self):
+        self.insert([row(0, BASE_MS + day * DAY_MS + 5) for day in range(3)])
+        sql = "SELECT ts FROM {table} ORDER BY ts"
+        self.assertEqual(self.partitions.select(self.conn, sql, ()), [(BASE_MS + day * DAY_MS + 5,) for day in range(3)])
+        self.assertEqual(self.partitions.select(self.conn, sql, (), newest_first=True, limit=2),
+                         [(BASE_MS + 2 * DAY_MS + 5,), (BASE_MS + DAY_MS + 5,)])
+        self.assertEqual(self.partitions.newest_ts(self.conn), BASE_MS + 2 * DAY_MS + 5)
+        self.assertIsNone(self.partitions.newest_ts(self.conn, BASE_MS + 3 * DAY_MS))
+
+    def test_duplicate_keys(self):
+        self.insert([row(0, BASE_MS, 1.0)])
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.insert([row(0, BASE_MS, 2.0)])
+        with self.conn:
+            self.partitions.insert_rows(self.conn, [row(0, BASE_MS, 3.0), row(1, BASE_MS, 3.0)], ignore_existing=True)
+        self.assertEqual(self.conn.execute("SELECT tubewell_id, voltage_a FROM raw_data_20240301 ORDER BY 1").fetchall(),
+                         [(0, 1.0), (1, 3.0)])
+
+    def test_expire_drops_whole_partitions(self):
+        self.insert([row(0, BASE_MS + day * DAY_MS) for day in range(3)])
+        self.assertEqual(self.partitions.expire(self.conn, BASE_MS + DAY_MS + 1), ["raw_data_20240301"])
+        self.assertEqual(len(self.partitions.tables(self.conn)), 2)
+        # A sample for a dropped day recreates its table
+        self.conn.execute(self.partitions.insert_sql(BASE_MS), row(0, BASE_MS))
+        self.assertEqual(len(self.partitions.tables(self.conn)), 3)
+
+    def test_width_is_stored(self):
+        self.assertEqual(quiet(RawPartitions, self.db_file, days=7).days, 1)
+        self.insert([row(0, BASE_MS + 3 * DAY_MS)])
+        self.assertEqual(self.partitions.partition_start(BASE_MS + 3 * DAY_MS + 5), BASE_MS + 3 * DAY_MS)
+
+
+if __name__ == "__main__":
+    unittest.main()
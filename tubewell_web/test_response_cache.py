@@ -0,0 +1,62 @@
+import sqlite3
+import unittest
+
+from apptest import logged_in_client, started_app
+from response_cache import ResponseCache
+from test_comparison import BASE_MS, MINUTE_MS, add_bucket
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def test_hit_and_miss(self):
+        cache = ResponseCache(100)
+        self.assertIsNone(cache.get("a"))
+        body, etag, headers = cache.put("a", b"body", final=True, headers={"Content-Type": "text/plain"})
+        self.assertEqual(cache.get("a"), (b"body", etag, {"Content-Type": "text/plain"}))
+        self.assertEqual(cache.put("b", b"body", final=True)[1], etag)
+        self.assertEqual((cache.hits, cache.misses, cache.size, len(cache)), (1, 1, 8, 2))
+
+    def test_least_recently_used_goes_first(self):
+        cache = ResponseCache(10)
+        cache.put("a", b"aaaa", final=True)
+        cache.put("b", b"bbbb", final=True)
+        cache.get("a")
+        cache.put("c", b"cccc", final=True)
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertEqual((cache.size, cache.evictions), (8, 1))
+        # Too big to keep, still returned with its ETag
+        body, etag, _ = cache.put("d", b"d" * 11, final=True)
+        self.assertEqual((body, len(etag)), (b"d" * 11, 40))
+        self.assertIsNone(cache.get("d"))
+
+    def test_advance_drops_open_entries(self):
+        cache = ResponseCache(100, watermark=5)
+        cache.put("closed", b"1", final=True)
+        cache.put(("open", 5), b"2", final=False)
+        self.assertEqual(cache.advance(5), 0)
+        self.assertEqual(cache.advance(9), 1)
+        self.assertIsNone(cache.get(("open", 5)))
+        self.assertIsNotNone(cache.get("closed"))
+        self.assertEqual(cache.stats()["watermark"], 9)
+
+
+class AggregatedCacheRouteTest(unittest.TestCase):
+    def test_repeat_requests_are_served_from_the_cache(self):
+        appmod = started_app()
+        conn = sqlite3.connect(appmod.DB_FILE)
+        with conn:
+            add_bucket(conn, 6, BASE_MS, 2.5)
+        conn.close()
+        client = logged_in_client()
+        url = f"/api/tubewell/6/aggregated?from={BASE_MS}&to={BASE_MS + 10 * MINUTE_MS}&resolution=1m"
+        first = client.get(url)
+        self.assertEqual((first.status_code, first.headers["X-Cache"]), (200, "MISS"))
+        self.assertEqual(first.get_json()[0]["current"]["A"], 2.5)
+        second = client.get(url)
+        self.assertEqual((second.headers["X-Cache"], second.data), ("HIT", first.data))
+        etag = first.headers["ETag"]
+        self.assertEqual(client.get(url, headers={"If-None-Match": etag}).status_code, 304)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+from ring_buffer import HistoryRing
+
+
+class HistoryRingTest(unittest.TestCase):
+    def test_wraps_at_capacity(self):
+        ring = HistoryRing(("a", "b"), capacity=4)
+        self.assertEqual((len(ring), ring.last_ts(), ring.segments()), (0, None, []))
+        for i in range(6):
+            ring.append(1000 + i, [i, -i])
+        self.assertEqual((len(ring), ring.last_ts()), (4, 1005))
+        self.assertEqual(ring.segments(), [(2, 4), (0, 2)])
+        self.assertEqual(ring.to_lists(), {"time": [1002, 1003, 1004, 1005], "a": [2, 3, 4, 5], "b": [-2, -3, -4, -5]})
+        self.assertEqual(ring.to_lists(last=2), {"time": [1004, 1005], "a": [4, 5], "b": [-4, -5]})
+
+    def test_views_share_the_arrays(self):
+        ring = HistoryRing(("a",), capacity=3)
+        for i in range(3):
+            ring.append(i, [i])
+        (view,) = ring.view("a")
+        ring.append(3, [7])
+        self.assertEqual(view[0], 7)
+
+    def test_digits_undo_float32_storage(self):
+        ring = HistoryRing(("voltage", "runtime"), capacity=2, digits=(1, 0))
+        ring.append(0, [230.1, 59.999])
+        self.assertNotEqual(ring.data[0][0], 230.1)
+        self.assertEqual(ring.to_lists(), {"time": [0], "voltage": [230.1], "runtime": [60]})
+
+    def test_load_lists(self):
+        ring = HistoryRing(("a", "b"), capacity=3)
+        ring.load_lists({"time": [1, 2, 3, 4], "a": [1, 2, 3, 4]})
+        self.assertEqual(ring.to_lists(), {"time": [2, 3, 4], "a": [2, 3, 4], "b": [0, 0, 0]})
+
+
+if __name__ == "__main__":
+    unittest.main()
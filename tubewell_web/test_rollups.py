@@ -0,0 +1,100 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from apptest import quiet
+from db_schema import RAW_COLUMNS, create_schema, parse_time_param
+from partitions import RawPartitions
+from rollups import RESOLUTION_MS, choose_resolution, query_rollups, rebuild_rollups, rollup_watermark, run_rollups
+
+BASE_MS = parse_time_param("2024-03-01")
+MINUTE = RESOLUTION_MS["1m"]
+
+
+def sample(tubewell_id, ts, value):
+    return (tubewell_id, ts) + (value,) * len(RAW_COLUMNS)
+
+
+class RollupTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        db_file = os.path.join(self.dir, "tubewell_data.db")
+        self.conn = sqlite3.connect(db_file)
+        create_schema(self.conn)
+        self.partitions = RawPartitions(db_file)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.dir)
+
+    def insert(self, *rows):
+        with self.conn:
+            self.partitions.insert_rows(self.conn, rows)
+
+    def roll(self, final_before=None):
+        return quiet(run_rollups, self.conn, self.partitions, final_before)
+
+    def watermarks(self):
+        return dict(self.conn.execute("SELECT resolution, watermark FROM rollup_state"))
+
+    def minutes(self, tubewell_id=0):
+        rows = query_rollups(self.conn, tubewell_id, "1m", 0, 2 ** 62, stats=("avg", "min", "max", "last"))
+        return [(row[0], row[1]) + row[2:6] for row in rows]
+
+    def test_stats(self):
+        self.insert(sample(0, BASE_MS + 1000, 1.0), sample(0, BASE_MS + 5000, 5.0), sample(0, BASE_MS + 3000, 3.0),
+                    sample(0, BASE_MS + MINUTE, 7.0), sample(1, BASE_MS, 9.0))
+        self.roll()
+        self.assertEqual(self.minutes(), [(BASE_MS, 3, 3.0, 1.0, 5.0, 5.0), (BASE_MS + MINUTE, 1, 7.0, 7.0, 7.0, 7.0)])
+        # Coarser levels re-weight the averages by sample count
+        hour = query_rollups(self.conn, 0, "1h", 0, 2 ** 62, stats=("avg", "min", "max", "last"))
+        self.assertEqual([row[:6] for row in hour], [(BASE_MS, 4, 4.0, 1.0, 7.0, 7.0)])
+
+    def test_open_bucket_is_recomputed(self):
+        self.insert(sample(0, BASE_MS, 1.0), sample(0, BASE_MS + MINUTE + 10, 2.0))
+        self.roll()
+        self.assertEqual(rollup_watermark(self.conn), BASE_MS + MINUTE)
+        self.insert(sample(0, BASE_MS + MINUTE + 20, 4.0))
+        self.roll()
+        self.assertEqual(self.minutes()[-1][:3], (BASE_MS + MINUTE, 2, 3.0))
+
+    def test_watermarks_stay_behind_final_before(self):
+        self.insert(sample(0, BASE_MS + 10, 1.0), sample(0, BASE_MS + 5 * MINUTE, 2.0))
+        self.roll(final_before=BASE_MS + 2 * MINUTE + 30000)
+        self.assertEqual(rollup_watermark(self.conn), BASE_MS + 2 * MINUTE)
+        # A sample that was still queued lands behind the newest one, but not behind the watermark
+        self.insert(sample(0, BASE_MS + 3 * MINUTE, 3.0))
+        self.roll(final_before=BASE_MS + 10 * MINUTE)
+        self.assertEqual([row[:2] for row in self.minutes()], [(BASE_MS, 1), (BASE_MS + 3 * MINUTE, 1),
+                                                               (BASE_MS + 5 * MINUTE, 1)])
+
+    def test_coarser_watermarks_follow_finer_ones(self):
+        self.insert(sample(0, BASE_MS, 1.0), sample(0, BASE_MS + 2 * RESOLUTION_MS["1d"], 2.0))
+        self.roll(final_before=BASE_MS + 20 * MINUTE)
+        watermarks = self.watermarks()
+        self.assertEqual(watermarks[MINUTE], BASE_MS + 20 * MINUTE)
+        self.assertEqual(watermarks[RESOLUTION_MS["15m"]], BASE_MS + 15 * MINUTE)
+        self.assertEqual(watermarks[RESOLUTION_MS["1h"]], BASE_MS)
+        self.assertEqual(watermarks[RESOLUTION_MS["1d"]], BASE_MS)
+        # Nothing is known to be stored: no watermark moves
+        self.roll(final_before=0)
+        self.assertEqual(self.watermarks(), watermarks)
+
+    def test_rebuild(self):
+        self.insert(sample(0, BASE_MS, 1.0))
+        self.roll()
+        self.insert(sample(0, BASE_MS - 3 * MINUTE, 5.0))
+        rebuild_rollups(self.conn, self.partitions, BASE_MS - 3 * MINUTE, BASE_MS)
+        self.assertEqual([row[:3] for row in self.minutes()], [(BASE_MS - 3 * MINUTE, 1, 5.0), (BASE_MS, 1, 1.0)])
+
+    def test_choose_resolution(self):
+        self.assertEqual(choose_resolution(0, RESOLUTION_MS["1h"]), "1m")
+        self.assertEqual(choose_resolution(0, RESOLUTION_MS["1d"]), "15m")
+        self.assertEqual(choose_resolution(0, 7 * RESOLUTION_MS["1d"]), "1h")
+        self.assertEqual(choose_resolution(0, 365 * RESOLUTION_MS["1d"]), "1d")
+
+
+if __name__ == "__main__":
+    unittest.main()
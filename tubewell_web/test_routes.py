@@ -0,0 +1,150 @@
+import json
+import unittest
+
+from apptest import ingest, logged_in_client, quiet, started_app
+from db_schema import parse_time_param
+
+DAY_MS = 24 * 3600 * 1000
+MARCH_1 = parse_time_param("2024-03-01")
+
+
+class RangeParamsTest(unittest.TestCase):
+    def setUp(self):
+        self.client = logged_in_client()
+
+    def get(self, url):
+        return quiet(self.client.get, url)
+
+    def test_plain_date_to_includes_the_day(self):
+        for url in ("/api/sessions", "/api/energy", "/api/comparison?ids=0"):
+            body = self.get(url + ("&" if "?" in url else "?") + "from=2024-03-01&to=2024-03-01").get_json()
+            self.assertEqual((body["from"], body["to"]), (MARCH_1, MARCH_1 + DAY_MS), url)
+        body = self.get("/api/sessions?to=2024-03-01T06:00:00").get_json()
+        self.assertEqual((body["from"], body["to"]), (MARCH_1 - DAY_MS + 6 * 3600000, MARCH_1 + 6 * 3600000))
+
+    def test_default_spans(self):
+        body = self.get("/api/energy?to=1709290800000").get_json()  # 2024-03-01 11:00
+        self.assertEqual(body["from"], MARCH_1)
+        body = self.get("/api/sessions?to=1709290800000").get_json()
+        self.assertEqual(body["from"], 1709290800000 - DAY_MS)
+
+    def test_date(self):
+        body = self.get("/api/sessions?date=2024-03-01").get_json()
+        self.assertEqual((body["from"], body["to"]), (MARCH_1, MARCH_1 + DAY_MS))
+        self.assertEqual(self.get("/api/tubewell/0/aggregated?date=2024-03-01").status_code, 200)
+
+    def test_errors(self):
+        routes = ("/api/alerts", "/api/tubewell/0/raw", "/api/tubewell/0/aggregated", "/api/export", "/api/energy",
+                  "/api/sessions", "/api/sessions/daily", "/api/comparison")
+        for route in routes:
+            for query, status in (("from=2024-03-05&to=2024-03-01", 400), ("to=yesterday", 400),
+                                  ("from=2024-03-01&to=2024-03-01T00:00:00", 400)):
+                self.assertEqual(self.get(f"{route}?{query}").status_code, status, f"{route}?{query}")
+        for route in ("/api/alerts", "/api/export", "/api/energy", "/api/sessions", "/api/sessions/daily",
+                      "/api/comparison"):
+            self.assertEqual(self.get(f"{route}?ids=1,x").status_code, 400, route)
+            response = self.get(f"{route}?ids=1,999")
+            self.assertEqual(response.status_code, 404, route)
+            self.assertEqual(response.get_json(), {"error": "Unknown tubewell ids: [999]"})
+
+
+class FleetSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.client = logged_in_client()
+
+    def snapshot(self, etag=None):
+        headers = {"If-None-Match": etag} if etag else {}
+        return quiet(self.client.get, "/api/fleet/snapshot", headers=headers)
+
+    def assertChanged(self, etag):
+        response = self.snapshot(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        return response
+
+    def test_not_modified_until_something_changes(self):
+        response = self.snapshot()
+        etag = response.headers["ETag"]
+        self.assertEqual(response.headers["Cache-Control"], "no-cache")
+        self.assertEqual(self.snapshot(etag).status_code, 304)
+
+        ingest("device-4", started_app().now_ms(), current=3.0)
+        response = self.assertChanged(etag)
+        entry = response.get_json()["tubewells"]["3"]
+        self.assertEqual((entry["id"], entry["status"], entry["current"]["A"]), (3, "ON", 3.0))
+        self.assertGreater(entry["session_start"], 0)
+        self.assertNotIn("total_runtime", entry)
+        self.assertEqual(self.snapshot(response.headers["ETag"]).status_code, 304)
+
+    def test_registering_a_device_changes_the_snapshot(self):
+        etag = self.snapshot().headers["ETag"]
+        response = quiet(self.client.post, "/api/devices", json={"dev_id": "snapshot-test", "name": "Snapshot"})
+        device_id = response.get_json()["id"]
+        body = self.assertChanged(etag).get_json()
+        self.assertEqual(body["tubewells"][str(device_id)]["name"], "Snapshot")
+        self.assertEqual(body["tubewells"][str(device_id)]["session_start"], None)
+
+
+class RawRouteTest(unittest.TestCase):
+    def test_minmax_keeps_the_spike(self):
+        appmod = started_app()
+        received_ms = appmod.now_ms() - 50000
+        for i in range(60):
+            ingest("device-12", received_ms + i * 100, current=40.0 if i == 37 else 4.0, voltage=230.0 + i % 3)
+        url = f"/api/tubewell/11/raw?from={received_ms}&to={received_ms + 6000}&format=columnar"
+        full = logged_in_client().get(url + "&max_points=0").get_json()
+        self.assertEqual(len(full["timestamp"]), 60)
+        body = logged_in_client().get(url + "&max_points=10&series=current_a").get_json()
+        self.assertLessEqual(len(body["timestamp"]), 10)
+        self.assertEqual(max(body["current"]["A"]), 40.0)
+        # Every point is a stored sample, whole
+        samples = {ts: i for i, ts in enumerate(full["timestamp"])}
+        for j, ts in enumerate(body["timestamp"]):
+            self.assertEqual(body["voltage"]["B"][j], full["voltage"]["B"][samples[ts]])
+
+    def test_bad_downsampling(self):
+        client = logged_in_client()
+        for query in ("max_points=-1", "mode=average", "series=colour"):
+            self.assertEqual(client.get(f"/api/tubewell/0/raw?{query}").status_code, 400, query)
+        self.assertEqual(client.get("/api/tubewell/999/raw").status_code, 404)
+
+
+class HistoryRouteTest(unittest.TestCase):
+    def test_history_columns(self):
+        appmod = started_app()
+        received_ms = appmod.now_ms() - 40000
+        for i in range(5):
+            ingest("device-13", received_ms + i * 1000, current=float(i), voltage=231.5)
+        client = logged_in_client()
+        body = client.get("/api/tubewell/12/history?points=3").get_json()
+        self.assertEqual(body["time"], [received_ms + i * 1000 for i in (2, 3, 4)])
+        self.assertEqual(body["current"]["C"], [2.0, 3.0, 4.0])
+        self.assertEqual(body["voltage"]["A"], [231.5] * 3)
+        self.assertEqual(len(body["runtime"]), 3)
+        downsampled = client.get("/api/tubewell/12/history?max_points=3&series=current_a").get_json()
+        self.assertLessEqual(len(downsampled["time"]), 3)
+        self.assertEqual(client.get("/api/tubewell/999/history").status_code, 404)
+        self.assertEqual(appmod.app.test_client().get("/api/tubewell/12/history").status_code, 302)
+
+
+class StreamRouteTest(unittest.TestCase):
+    def test_snapshot_then_updates(self):
+        appmod = started_app()
+        response = appmod.app.test_client().get("/api/stream?ids=13", buffered=False)
+        self.assertEqual((response.status_code, response.mimetype), (200, "text/event-stream"))
+        body = response.response
+        self.assertEqual(next(body), b"retry: 3000\n\n")
+        event, data = next(body).decode().strip().split("\n")
+        self.assertEqual((event, json.loads(data[len("data: "):])["id"]), ("event: snapshot", 13))
+        # Other wells are filtered out
+        ingest("device-1", appmod.now_ms(), current=1.5)
+        ingest("device-14", appmod.now_ms(), current=6.5)
+        event, data = next(body).decode().strip().split("\n")
+        update = json.loads(data[len("data: "):])
+        self.assertEqual((event, update["id"], update["current"]["A"]), ("event: update", 13, 6.5))
+        response.close()
+        self.assertEqual(quiet(appmod.app.test_client().get, "/api/stream?ids=x").status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from sessions import Session, SessionTracker
+
+RUNNING = (0.0, 4.0, 0.2)
+STOPPED = (0.1, 0.0, 0.2)
+
+
+class SessionTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.changes = []
+        self.tracker = SessionTracker(current_threshold=0.5, stop_gap_ms=60 * 1000, on_change=self.changes.append)
+
+    def test_open_and_close(self):
+        self.assertEqual(self.tracker.observe(1, STOPPED, 1000), [])
+        self.assertEqual(self.tracker.observe(1, RUNNING, 2000), [Session(1, 2000, None, 2000)])
+        self.assertEqual(self.tracker.observe(1, RUNNING, 3000), [])
+        self.assertEqual(self.tracker.running(), {1: 2000})
+        self.assertEqual(self.tracker.observe(1, STOPPED, 10000), [Session(1, 2000, 10000, 10000)])
+        self.assertEqual(self.tracker.running(), {})
+        self.assertEqual(self.changes, [Session(1, 2000, None, 2000), Session(1, 2000, 10000, 10000)])
+
+    def test_threshold_is_inclusive(self):
+        self.assertEqual(len(self.tracker.observe(1, (0.5, 0, 0), 1000)), 1)
+        self.assertEqual(len(self.tracker.observe(2, (0.49, 0, 0), 1000)), 0)
+
+    def test_gap_closes_at_last_running_frame(self):
+        self.tracker.observe(1, RUNNING, 0)
+        self.tracker.observe(1, RUNNING, 30000)
+        changes = self.tracker.observe(1, RUNNING, 100000)
+        self.assertEqual(changes, [Session(1, 0, 30000, 30000), Session(1, 100000, None, 100000)])
+
+    def test_close_stale(self):
+        self.tracker.observe(1, RUNNING, 0)
+        self.tracker.observe(2, RUNNING, 50000)
+        self.assertEqual(self.tracker.close_stale(100000), [Session(1, 0, 0, 0)])
+        self.assertEqual(self.tracker.running(), {2: 50000})
+
+    def test_state_fields(self):
+        self.assertEqual(self.tracker.state_fields(1), {"status": False, "session_start": None, "total_runtime": 0})
+        self.tracker.observe(1, RUNNING, 0)
+        self.tracker.observe(1, RUNNING, 50000)
+        self.tracker.observe(1, STOPPED, 90500)
+        self.tracker.observe(1, RUNNING, 100000)
+        self.assertEqual(self.tracker.state_fields(1), {"status": True, "session_start": 100.0, "total_runtime": 90})
+
+
+if __name__ == "__main__":
+    unittest.main()
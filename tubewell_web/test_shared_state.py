@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from live_state import TubewellState
+from shared_state import HEADER_SIZE, SLOT_GUARD, SharedStates, SharedStateTable
+
+
+def state(name="Tubewell 1", **fields):
+    fields.setdefault("voltage", (230.5, 231.0, 229.5))
+    fields.setdefault("current", (4.25, 4.5, 4.0))
+    fields.setdefault("frequency", 50.0)
+    return TubewellState(name, **fields)
+
+
+class SharedStateTableTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "live.state")
+        self.writer = SharedStateTable(self.path, slots=8, writer=True)
+        self.reader = SharedStateTable(self.path)
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+        shutil.rmtree(self.dir)
+
+    def seq(self, tubewell_id):
+        return SLOT_GUARD.unpack_from(self.writer._mm, HEADER_SIZE + tubewell_id * self.writer.slot_size)[0]
+
+    def test_round_trip(self):
+        events = ({"timestamp": 100, "action": "ON", "source": "command"},
+                  {"timestamp": 200, "action": "OFF", "source": "telemetry", "runtime": 100})
+        written = state(status=True, session_start=150.5, total_runtime=42, updated_ms=1234, events=events)
+        self.writer.write(3, written)
+        read = self.reader.read(3)
+        for field in ("name", "status", "voltage", "current", "frequency", "session_start", "total_runtime",
+                      "updated_ms", "events"):
+            self.assertEqual(getattr(read, field), getattr(written, field), field)
+        self.assertEqual(self.seq(3), 2)
+
+    def test_empty_slot(self):
+        self.assertIsNone(self.reader.read(2))
+        self.assertFalse(self.reader.present(2))
+        self.assertFalse(self.reader.present(100))
+        with self.assertRaises(IndexError):
+            self.writer.write(8, state())
+
+    def test_header(self):
+        self.writer.write(0, state())
+        self.writer.write(5, state())
+        self.writer.set_watermark(777)
+        self.assertEqual((self.reader.version, self.reader.used, self.reader.watermark), (2, 6, 777))
+        self.assertEqual(self.reader.boot_ms, self.writer.boot_ms)
+        self.assertEqual(self.reader.present_ids(), [0, 5])
+
+    def test_changed(self):
+        self.writer.write(1, state())
+        self.writer.write(4, state())
+        self.assertEqual(self.reader.changed(), [1, 4])
+        self.assertEqual(self.reader.changed(), [])
+        self.writer.write(4, state(frequency=49.0))
+        self.assertEqual(self.reader.changed(), [4])
+
+    def test_write_in_progress_is_not_read(self):
+        self.writer.write(1, state())
+        offset = HEADER_SIZE + self.writer.slot_size
+        seq, crc = SLOT_GUARD.unpack_from(self.writer._mm, offset)
+        SLOT_GUARD.pack_into(self.writer._mm, offset, seq | 1, crc)
+        with self.assertRaises(RuntimeError):
+            self.reader.read(1)
+        SLOT_GUARD.pack_into(self.writer._mm, offset, seq, crc ^ 1)
+        with self.assertRaises(RuntimeError):
+            self.reader.read(1)
+        SLOT_GUARD.pack_into(self.writer._mm, offset, seq, crc)
+        self.assertEqual(self.reader.read(1).frequency, 50.0)
+
+    def test_seq_wraps(self):
+        offset = HEADER_SIZE + 2 * self.writer.slot_size
+        SLOT_GUARD.pack_into(self.writer._mm, offset, 0xFFFFFFFE, 0)
+        self.writer.write(2, state(frequency=49.5))
+        self.assertEqual(self.seq(2), 0)
+        self.assertEqual(self.reader.read(2).frequency, 49.5)
+
+    def test_concurrent_reads_are_consistent(self):
+        stop = threading.Event()
+
+        def write():
+            i = 0
+            while not stop.is_set():
+                i += 1
+                self.writer.write(0, state(voltage=(i, i, i), current=(i, i, i), updated_ms=i))
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            for _ in range(2000):
+                read = self.reader.read(0)
+                if read is not None:
+                    self.assertEqual(read.voltage, (read.updated_ms,) * 3)
+                    self.assertEqual(read.current, read.voltage)
+        finally:
+            stop.set()
+            writer.join()
+
+    def test_reopen(self):
+        self.writer.write(6, state())
+        boot_ms = self.writer.boot_ms
+        # A writer asking for no more slots reuses the file and empties it
+        again = SharedStateTable(self.path, slots=4, writer=True)
+        self.assertFalse(self.reader.replaced())
+        self.assertIsNone(self.reader.read(6))
+        self.assertGreaterEqual(self.reader.boot_ms, boot_ms)
+        again.close()
+        # A bigger table is built aside and renamed over it
+        bigger = SharedStateTable(self.path, slots=16, writer=True)
+        self.assertTrue(self.reader.replaced())
+        self.assertEqual(SharedStateTable(self.path).slots, 16)
+        bigger.close()
+
+
+class SharedStatesTest(unittest.TestCase):
+    def test_adapter(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = SharedStateTable(os.path.join(tmp, "live.state"), slots=4, writer=True)
+            states = SharedStates(SharedStateTable(writer.path))
+            writer.write(2, state("Tubewell 3"))
+            self.assertIn(2, states)
+            self.assertNotIn(1, states)
+            self.assertEqual(len(states), 1)
+            self.assertEqual(states[2].name, "Tubewell 3")
+            self.assertEqual([(i, s.name) for i, s in states.items()], [(2, "Tubewell 3")])
+            with self.assertRaises(KeyError):
+                states.peek(1)
+            with self.assertRaises(RuntimeError):
+                states.update(2, lambda s: s)
+            states.table.close()
+            writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()